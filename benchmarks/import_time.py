@@ -0,0 +1,76 @@
+"""Measures how long a fresh interpreter takes to import stmoab modules.
+
+Every sample starts a new process so nothing is already in sys.modules:
+
+    python benchmarks/import_time.py --repeat 20
+    python benchmarks/import_time.py stmoab.StatisticalDashboard
+"""
+import sys
+import json
+import argparse
+import subprocess
+
+DEFAULT_MODULES = [
+    "stmoab.utils",
+    "stmoab.stats",
+    "stmoab.SummaryDashboard",
+    "stmoab.ExperimentDashboard",
+    "stmoab.StatisticalDashboard",
+]
+
+# Dependencies that should only be loaded once they're needed.
+HEAVY_MODULES = ["boto3", "botocore", "scipy", "statsmodels"]
+
+TIMER = (
+    "import sys, time, json\n"
+    "start = time.time()\n"
+    "import {module}\n"
+    "elapsed = time.time() - start\n"
+    "print(json.dumps({{'seconds': elapsed, 'loaded': "
+    "[m for m in {heavy!r} if m in sys.modules]}}))\n")
+
+
+def time_import(module):
+  output = subprocess.check_output([
+      sys.executable, "-c",
+      TIMER.format(module=module, heavy=HEAVY_MODULES)])
+  return json.loads(output.decode("utf-8"))
+
+
+def benchmark(module, repeat):
+  samples = [time_import(module) for _ in range(repeat)]
+  seconds = sorted(sample["seconds"] for sample in samples)
+
+  return {
+      "module": module,
+      "repeat": repeat,
+      "min_ms": seconds[0] * 1000,
+      "median_ms": seconds[len(seconds) // 2] * 1000,
+      "max_ms": seconds[-1] * 1000,
+      "heavy_modules_loaded": samples[-1]["loaded"],
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+  parser.add_argument("--repeat", type=int, default=10)
+  parser.add_argument(
+      "--json", action="store_true", help="Print results as JSON")
+  args = parser.parse_args()
+
+  results = [benchmark(module, args.repeat) for module in args.modules]
+
+  if args.json:
+    print(json.dumps(results, indent=2))
+    return
+
+  for result in results:
+    print("{module:<32} min {min_ms:8.1f}ms  median {median_ms:8.1f}ms  "
+          "max {max_ms:8.1f}ms  heavy: {loaded}".format(
+              loaded=", ".join(result["heavy_modules_loaded"]) or "none",
+              **result))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,233 @@
+"""Times and memory-profiles the T-Table statistics on synthetic results.
+
+Runs offline. Redash is never called, each query returns generated rows
+with one row per client, as the T-Table templates do:
+
+    python benchmarks/stats_benchmark.py
+    python benchmarks/stats_benchmark.py --rows 1000 10000000 --variants 2 10
+    python benchmarks/stats_benchmark.py --output after.json \
+        --baseline before.json
+
+Rows are split evenly between the control and the experiment variants, and
+every metric runs its own query against them, each a few rows short of the
+last so that no two metrics share their statistics. Every benchmark runs
+once to warm up before it's timed, and memoized powers are cleared before
+each timed run.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+
+import mock
+import numpy as np
+
+try:
+  import tracemalloc
+except ImportError:  # pragma: no cover
+  tracemalloc = None
+
+# Runs against the checkout it's in, whether or not stmoab is installed.
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stmoab.stats  # noqa: E402
+from stmoab.SummaryDashboard import RedashClient  # noqa: E402
+from stmoab.StatisticalDashboard import StatisticalDashboard  # noqa: E402
+
+DEFAULT_ROWS = [1000, 10000, 100000, 1000000]
+DEFAULT_VARIANTS = [2, 5, 10]
+DEFAULT_METRICS = [1, 10]
+
+# A benchmark has regressed when it's this much slower than the baseline.
+REGRESSION_RATIO = 1.25
+
+
+def get_dashboard():
+  create_patcher = mock.patch.object(
+      RedashClient, "create_new_dashboard",
+      return_value={"dashboard_id": 1, "slug_url": ""})
+  publish_patcher = mock.patch.object(RedashClient, "publish_dashboard")
+
+  with create_patcher, publish_patcher:
+    return StatisticalDashboard(
+        "api_key", "access", "secret", "us-west-2", "bucket",
+        "Benchmark Project", "Benchmark Dashboard", "exp-benchmark",
+        lazy_public_url=True)
+
+
+def generate_rows(num_rows, num_variants, seed=42):
+  rand = random.Random(seed)
+  variants = ["control"] + [
+      "variant-{i}".format(i=i) for i in range(1, num_variants)]
+
+  rows = []
+  for i in range(num_rows):
+    variant = variants[i % num_variants]
+    shift = 0.0 if variant == "control" else 0.05 * (i % num_variants)
+    rows.append({
+        "type": variant,
+        "count": rand.expovariate(1.0) * 10 + shift,
+    })
+  return rows
+
+
+def clear_caches():
+  # Memoized powers would make every run after the first a lookup.
+  with stmoab.stats._power_cache_lock:
+    stmoab.stats._power_cache.clear()
+
+
+def measure(function, repeat):
+  # Best wall clock time of `repeat` runs, then the peak memory allocated
+  # by one more run. A first, untimed run loads anything imported lazily.
+  function()
+
+  seconds = []
+  for _ in range(repeat):
+    clear_caches()
+    started_at = time.time()
+    function()
+    seconds.append(time.time() - started_at)
+
+  peak_bytes = None
+  if tracemalloc is not None:
+    clear_caches()
+    tracemalloc.start()
+    function()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+  seconds.sort()
+  return {
+      "min_ms": seconds[0] * 1000,
+      "median_ms": seconds[len(seconds) // 2] * 1000,
+      "peak_mb": None if peak_bytes is None else peak_bytes / 1e6,
+  }
+
+
+def benchmark_case(dashboard, num_rows, num_variants, num_metrics, repeat):
+  rows = generate_rows(num_rows, num_variants)
+  control_vals = [row["count"] for row in rows if row["type"] == "control"]
+  exp_vals = [row["count"] for row in rows if row["type"] == "variant-1"]
+
+  metric_rows = dict(
+      ("SELECT {metric}".format(metric=metric),
+       rows[:len(rows) - metric * num_variants])
+      for metric in range(num_metrics))
+  dashboard._get_query_results = (
+      lambda query_string, *args: metric_rows[query_string])
+
+  def power_and_ttest():
+    dashboard._power_and_ttest(control_vals, exp_vals)
+
+  def pooled_stddev():
+    dashboard._compute_pooled_stddev(
+        np.std(control_vals, ddof=1), np.std(exp_vals, ddof=1),
+        control_vals, exp_vals)
+
+  def ttable_pipeline():
+    for metric in range(num_metrics):
+      dashboard._get_ttable_data_for_query(
+          "Metric {metric}".format(metric=metric),
+          "SELECT {metric}".format(metric=metric),
+          "count", 5)
+
+  case = {"rows": num_rows, "variants": num_variants, "metrics": num_metrics}
+  results = []
+  for name, function in [("power_and_ttest", power_and_ttest),
+                         ("compute_pooled_stddev", pooled_stddev),
+                         ("ttable_pipeline", ttable_pipeline)]:
+    result = dict(case, benchmark=name)
+    result.update(measure(function, repeat))
+    results.append(result)
+
+  return results
+
+
+def get_environment():
+  import scipy
+
+  return {
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "numpy": np.__version__,
+      "scipy": scipy.__version__,
+      "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+  }
+
+
+def _get_key(result):
+  return (result["benchmark"], result["rows"], result["variants"],
+          result["metrics"])
+
+
+def compare(results, baseline):
+  # Adds the ratio to the baseline's time to every result it also has.
+  baseline_results = dict(
+      (_get_key(result), result) for result in baseline["results"])
+
+  regressions = []
+  for result in results:
+    previous = baseline_results.get(_get_key(result), None)
+    if previous is None or not previous["min_ms"]:
+      continue
+
+    result["baseline_ratio"] = result["min_ms"] / previous["min_ms"]
+    if result["baseline_ratio"] > REGRESSION_RATIO:
+      regressions.append(result)
+  return regressions
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+  parser.add_argument(
+      "--variants", type=int, nargs="+", default=DEFAULT_VARIANTS)
+  parser.add_argument(
+      "--metrics", type=int, nargs="+", default=DEFAULT_METRICS)
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument(
+      "--output", default=None, help="Write the results as JSON to this file")
+  parser.add_argument(
+      "--baseline", default=None,
+      help="Compare against the JSON results of an earlier run")
+  args = parser.parse_args(argv)
+
+  dashboard = get_dashboard()
+  results = []
+  for num_rows in args.rows:
+    for num_variants in args.variants:
+      for num_metrics in args.metrics:
+        results.extend(benchmark_case(
+            dashboard, num_rows, num_variants, num_metrics, args.repeat))
+
+  regressions = []
+  if args.baseline is not None:
+    with open(args.baseline) as baseline_file:
+      regressions = compare(results, json.load(baseline_file))
+
+  if args.output is not None:
+    with open(args.output, "w") as output_file:
+      json.dump(
+          {"environment": get_environment(), "results": results},
+          output_file, indent=2)
+
+  for result in results:
+    print("{benchmark:<22} rows {rows:>9} variants {variants:>3} "
+          "metrics {metrics:>3}  min {min_ms:10.1f}ms  "
+          "peak {peak}{ratio}".format(
+              peak="n/a" if result["peak_mb"] is None else
+              "{mb:.1f}MB".format(mb=result["peak_mb"]),
+              ratio=" x{ratio:.2f}".format(ratio=result["baseline_ratio"])
+              if "baseline_ratio" in result else "",
+              **result))
+
+  return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
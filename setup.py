@@ -11,6 +11,8 @@ setup(
   classifiers = [],
   install_requires=[
     "boto3 == 1.4.4",
+    "futures == 3.2.0; python_version < '3.0'",
+    "numpy == 1.14.0",
     "scipy == 1.0.0",
     "statistics == 1.0.3.5",
     "statsmodels == 0.9.0",
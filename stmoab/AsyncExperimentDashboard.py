@@ -0,0 +1,66 @@
+import asyncio
+
+from stmoab.ExperimentDashboard import ExperimentDashboard
+from stmoab.AsyncSummaryDashboard import AsyncSummaryDashboard
+
+
+class AsyncExperimentDashboard(AsyncSummaryDashboard):
+  DASHBOARD_CLASS = ExperimentDashboard
+  TemplateApplicationError = ExperimentDashboard.TemplateApplicationError
+
+  async def _apply_functions_to_templates(
+      self, template_keyword, events_list, events_table,
+      events_function, general_function=None, title=None,
+      commit_function=None
+  ):
+    dashboard = self.dashboard
+    if events_table is None:
+      events_table = dashboard._events_table
+
+    templates = await self._run(dashboard._search_templates, template_keyword)
+    chart_data = await self.get_query_ids_and_names()
+    units = dashboard._get_template_units(
+        templates, events_list, events_table)
+
+    staged_units = [
+        asyncio.ensure_future(self._run(
+            dashboard._stage_template_unit, unit, chart_data,
+            events_function, general_function, title))
+        for unit in units]
+
+    # Commit every unit as soon as it and all the units before it are
+    # staged, so the dashboard order matches the synchronous engine.
+    public_urls = []
+    failures = []
+    for unit, staged_unit in zip(units, staged_units):
+      try:
+        staged = await staged_unit
+        if staged is not None and commit_function:
+          public_url = await self._run(commit_function, staged)
+          if public_url is not None and unit["event"] is None:
+            public_urls.append(public_url)
+      except Exception as e:
+        failures.append(dashboard._get_unit_failure(unit, e))
+
+    if failures:
+      raise self.TemplateApplicationError(
+          "{failed} of {total} template units failed".format(
+              failed=len(failures), total=len(units)),
+          failures,
+          public_urls)
+
+    return public_urls
+
+  async def add_graph_templates(self, template_keyword,
+                                events_list=None, events_table=None):
+    if events_list is None:
+      events_list = self.dashboard.DEFAULT_EVENTS
+
+    return await self._apply_functions_to_templates(
+        template_keyword,
+        events_list,
+        events_table,
+        self.dashboard._apply_event_template,
+        self.dashboard._apply_non_event_template,
+        commit_function=self.dashboard._attach_staged_graph,
+    )
@@ -0,0 +1,28 @@
+from stmoab.StatisticalDashboard import StatisticalDashboard
+from stmoab.AsyncExperimentDashboard import AsyncExperimentDashboard
+
+
+class AsyncStatisticalDashboard(AsyncExperimentDashboard):
+  DASHBOARD_CLASS = StatisticalDashboard
+
+  async def add_ttable_data(self, template_keyword, title,
+                            events_list=None, events_table=None):
+    dashboard = self.dashboard
+    if events_list is None:
+      events_list = dashboard.DEFAULT_EVENTS
+      events_table = dashboard._events_table
+
+    if title not in dashboard._ttables:
+      dashboard._ttables[title] = dashboard._copy_ttable_tempalte()
+
+    await self._apply_functions_to_templates(
+        template_keyword,
+        events_list,
+        events_table,
+        dashboard._apply_ttable_event_template,
+        None,
+        title,
+        commit_function=dashboard._commit_ttable_rows)
+
+  async def add_ttable(self, title):
+    return await self._run(self.dashboard.add_ttable, title)
@@ -0,0 +1,140 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from redash_client.constants import VizType
+
+from stmoab.SummaryDashboard import SummaryDashboard
+
+
+class AsyncSummaryDashboard(object):
+  # redash_client only speaks blocking HTTP, so every Redash call is handed
+  # to a thread pool and awaited from the event loop. The semaphore bounds
+  # the calls this dashboard has in flight, the executor bounds them for
+  # every dashboard sharing it.
+  DEFAULT_MAX_IN_FLIGHT = 32
+  DASHBOARD_CLASS = SummaryDashboard
+  ExternalAPIError = SummaryDashboard.ExternalAPIError
+
+  def __init__(self, dashboard, max_in_flight=None, executor=None):
+    self.dashboard = dashboard
+    self._max_in_flight = max_in_flight or self.DEFAULT_MAX_IN_FLIGHT
+    self._executor = executor or ThreadPoolExecutor(
+        max_workers=self._max_in_flight)
+    self._semaphore = None
+
+  @classmethod
+  async def create(cls, *args, max_in_flight=None, executor=None, **kwargs):
+    max_in_flight = max_in_flight or cls.DEFAULT_MAX_IN_FLIGHT
+    executor = executor or ThreadPoolExecutor(max_workers=max_in_flight)
+
+    loop = asyncio.get_event_loop()
+    dashboard = await loop.run_in_executor(
+        executor, functools.partial(cls.DASHBOARD_CLASS, *args, **kwargs))
+    return cls(dashboard, max_in_flight, executor)
+
+  @property
+  def public_url(self):
+    return self.dashboard.public_url
+
+  @property
+  def slug_url(self):
+    return self.dashboard.slug_url
+
+  async def _run(self, function, *args, **kwargs):
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore(self._max_in_flight)
+
+    loop = asyncio.get_event_loop()
+    async with self._semaphore:
+      return await loop.run_in_executor(
+          self._executor, functools.partial(function, *args, **kwargs))
+
+  async def _create_new_query(self, query_title, query_string,
+                              data_source, description=""):
+    return await self._run(
+        self.dashboard._create_new_query,
+        query_title, query_string, data_source, description)
+
+  async def _create_new_visualization(self, *args):
+    return await self._run(self.dashboard._create_new_visualization, *args)
+
+  async def _add_visualization_to_dashboard(self, viz_id,
+                                            visualization_width):
+    return await self._run(
+        self.dashboard._add_visualization_to_dashboard,
+        viz_id, visualization_width)
+
+  async def _get_query_results(self, query_string, data_source_id,
+                               query_name=""):
+    return await self._run(
+        self.dashboard._get_query_results,
+        query_string, data_source_id, query_name)
+
+  async def get_query_ids_and_names(self):
+    return await self._run(self.dashboard.get_query_ids_and_names)
+
+  async def remove_graph_from_dashboard(self, widget_id, query_id):
+    return await self._run(
+        self.dashboard.remove_graph_from_dashboard, widget_id, query_id)
+
+  def _get_errors(self, results):
+    return [
+        result if isinstance(result, Exception) else None
+        for result in results]
+
+  async def remove_graphs(self, names=None, raise_on_error=True):
+    graphs = await self.get_query_ids_and_names()
+    if names is None:
+      names = list(graphs)
+    else:
+      names = [name for name in names if name in graphs]
+
+    results = await asyncio.gather(*[
+        self._run(self.dashboard._remove_named_graph, graphs, name)
+        for name in names], return_exceptions=True)
+
+    return self.dashboard._get_removal_report(
+        names, self._get_errors(results), raise_on_error)
+
+  async def remove_all_graphs(self, raise_on_error=True):
+    return await self.remove_graphs(raise_on_error=raise_on_error)
+
+  async def update_refresh_schedule(self, seconds_to_refresh,
+                                    raise_on_error=True):
+    widgets = await self._run(
+        self.dashboard._get_widgets_from_dash,
+        self.dashboard._dash_slug or self.dashboard._dash_name)
+    query_ids = self.dashboard._get_scheduled_query_ids(widgets)
+
+    results = await asyncio.gather(*[
+        self._run(
+            self.dashboard._update_query_schedule,
+            query_id, seconds_to_refresh)
+        for query_id in query_ids], return_exceptions=True)
+
+    return self.dashboard._get_schedule_report(
+        query_ids, self._get_errors(results), raise_on_error)
+
+  async def add_query_to_dashboard(self, query_title, query_string,
+                                   data_source, visualization_width,
+                                   visualization_type=VizType.CHART,
+                                   visualization_name="", chart_type=None,
+                                   column_mapping=None, series_options=None,
+                                   time_interval=None, stacking=True,
+                                   axis_info={}):
+    query_id, table_id = await self._create_new_query(
+        query_title, query_string, data_source)
+    viz_id = await self._create_new_visualization(
+        query_id,
+        visualization_type,
+        visualization_name,
+        chart_type,
+        column_mapping,
+        series_options,
+        time_interval,
+        stacking,
+        axis_info,
+    )
+    await self._add_visualization_to_dashboard(viz_id, visualization_width)
+    self.dashboard._index_graph(query_title, query_id, query_string)
@@ -1,12 +1,25 @@
 import time
 import logging
+import threading
 
 from redash_client.constants import VizWidth
 
+from stmoab.utils import imap_concurrently
+from stmoab.Tracer import traced
 from stmoab.SummaryDashboard import SummaryDashboard
+from stmoab.PendingResultsQueue import PendingResultsQueue
 
 
 class ExperimentDashboard(SummaryDashboard):
+
+  class TemplateApplicationError(SummaryDashboard.ExternalAPIError):
+
+    def __init__(self, message, failures, public_urls):
+      super(ExperimentDashboard.TemplateApplicationError, self).__init__(
+          message, failures)
+      self.failures = failures
+      self.public_urls = public_urls
+
   # These are either strings representing both the measurement name
   # event being measured or a key value pair: {<measurement_name>: <events>}
   DEFAULT_EVENTS = ["CLICK", "SEARCH", "BLOCK", "DELETE",
@@ -35,16 +48,32 @@ class ExperimentDashboard(SummaryDashboard):
 
   DEFAULT_EVENTS_TABLE = "assa_events_daily"
   URL_FETCHER_DATA_SOURCE_ID = 28
+
+  # Redash API calls made by each planned action, not counting polls for
+  # results that are still being computed.
+  PLAN_API_CALLS = {
+      # Results, the query, its visualization, a refresh, chart and widget.
+      "create": 6,
+      # Results, the query update and a refresh.
+      "update": 3,
+      # Removing the widget and its query, then creating it again.
+      "replace": 8,
+      "unchanged": 0,
+  }
   DISABLE_TITLE = "Disable Rate"
   RETENTION_DIFF_TITLE = "Daily Retention Difference (Experiment - Control)"
 
   def __init__(self, api_key, project_name, dash_name, exp_id,
-               start_date, end_date=None, events_table_name=None):
+               start_date, end_date=None, events_table_name=None,
+               update_in_place=False, defer_pending=False,
+               pending_timeout=None, template_registry=None,
+               **dashboard_options):
     DASH_TITLE = "{project}: {dash}".format(
         project=project_name, dash=dash_name)
     super(ExperimentDashboard, self).__init__(
         api_key,
-        DASH_TITLE)
+        DASH_TITLE,
+        **dashboard_options)
 
     logging.basicConfig()
     self._logger = logging.getLogger()
@@ -53,6 +82,12 @@ class ExperimentDashboard(SummaryDashboard):
     self._start_date = start_date
     self._end_date = end_date if end_date else time.strftime("%Y-%m-%d")
     self._events_table = events_table_name or self.DEFAULT_EVENTS_TABLE
+    self._update_in_place = update_in_place
+    self._defer_pending = defer_pending
+    self._pending_timeout = pending_timeout
+    self._pending_queue = None
+    self._pending_queue_lock = threading.Lock()
+    self._template_registry = template_registry
     self._params = {
         "start_date": self._start_date,
         "end_date": self._end_date,
@@ -69,19 +104,40 @@ class ExperimentDashboard(SummaryDashboard):
       title = title[1]
     return title
 
-  def _get_event_title_description(self, template, event):
-    if type(event) == str:
-      event_name = event.capitalize()
+  def _is_mapped_event(self, event):
+    # Mapped events are dicts, anything else is an event name, which is
+    # unicode when it comes from JSON on Python 2.
+    return isinstance(event, dict)
+
+  def _get_event_params(self, event):
+    if not self._is_mapped_event(event):
       event_string = "('{}')".format(event)
     else:
-      event_name = event["event_name"]
       events = []
       for event in event["event_list"]:
         events.append("'{}'".format(event))
       event_string = "(" + ", ".join(events) + ")"
 
-    self._params["event"] = event
-    self._params["event_string"] = event_string
+    return {
+        "event": event,
+        "event_string": event_string
+    }
+
+  def _get_query_params(self, events_table, event=None):
+    params = self._params.copy()
+    params["events_table"] = events_table
+
+    if event is not None:
+      params.update(self._get_event_params(event))
+
+    return params
+
+  def _get_event_title_description(self, template, event):
+    if not self._is_mapped_event(event):
+      event_name = event.capitalize()
+    else:
+      event_name = event["event_name"]
+
     title = description = self._get_title(
         template["name"]).replace(
         "Event", event_name).replace(
@@ -97,63 +153,115 @@ class ExperimentDashboard(SummaryDashboard):
     }
     return event_data
 
-  def _create_options(self):
+  def _create_options(self, params):
     options = {
         "parameters": []
     }
 
-    for param in self._params:
+    for param in params:
       param_obj = {
           "title": param,
           "name": param,
           "type": "text",
-          "value": self._params[param],
+          "value": params[param],
           "global": False
       }
       options["parameters"].append(param_obj)
 
     return options
 
-  def _apply_non_event_template(self, template, chart_data, values=None):
+  def _apply_non_event_template(self, template, chart_data, params):
     title = description = self._get_title(template["name"])
 
     if template["description"]:
       description = template["description"]
 
-    public_url = self._add_template_to_dashboard(
+    return self._add_template_to_dashboard(
         template,
         chart_data,
+        params,
         title,
         VizWidth.WIDE,
         description
     )
-    return public_url
 
-  def _apply_event_template(self, template, chart_data,
-                            events_list, events_table, title=None):
-    for event in events_list:
-      event_data = self._get_event_title_description(template, event)
+  def _apply_event_template(self, template, chart_data, params,
+                            event, title=None):
+    event_data = self._get_event_title_description(template, event)
 
-      self._add_template_to_dashboard(
-          template,
-          chart_data,
-          event_data["title"],
-          VizWidth.REGULAR,
-          event_data["description"],
-      )
+    return self._add_template_to_dashboard(
+        template,
+        chart_data,
+        params,
+        event_data["title"],
+        VizWidth.REGULAR,
+        event_data["description"],
+    )
 
-  def _add_template_to_dashboard(self, template, chart_data, title,
+  def _add_template_to_dashboard(self, template, chart_data, params, title,
                                  viz_width, description):
     data_ready = self._template_copy_results_exist(
       title,
       template["query"],
       template["data_source_id"],
-      self._params,
+      params,
     )
 
     if not data_ready:
+      if self._defer_pending:
+        self._defer_template(
+            template, chart_data, params, title, viz_width, description)
       return
 
+    return self._stage_template_graph(
+        template, chart_data, params, title, viz_width, description)
+
+  def _get_pending_queue(self):
+    with self._pending_queue_lock:
+      if self._pending_queue is None:
+        self._pending_queue = PendingResultsQueue(
+            self._check_query_results, self._pending_timeout)
+      return self._pending_queue
+
+  def _defer_template(self, template, chart_data, params, title,
+                      viz_width, description):
+    self._logger.info(("ExperimentDashboard: "
+                       "{title} graph will be added once its results are "
+                       "ready".format(title=title)))
+
+    def add_graph():
+      staged_graph = self._stage_template_graph(
+          template, chart_data, params, title, viz_width, description)
+      return self._attach_staged_graph(staged_graph)
+
+    self._get_pending_queue().add(
+        title,
+        self._render_template(template, params),
+        template["data_source_id"],
+        add_graph)
+
+  def wait_for_pending(self, timeout=None):
+    # Blocks until every deferred graph has been added or has expired, or
+    # for at most `timeout` seconds, and reports what happened to them.
+    return self._get_pending_queue().wait(timeout)
+
+  def close_pending(self):
+    # Stops adding deferred graphs, leaving those not yet added pending.
+    with self._pending_queue_lock:
+      pending_queue = self._pending_queue
+    if pending_queue is not None:
+      pending_queue.close()
+
+  def _stage_template_graph(self, template, chart_data, params, title,
+                            viz_width, description):
+    if title in chart_data and self._update_in_place:
+      staged_graph = self._update_existing_graph(
+          template, chart_data[title], params, title)
+
+      if staged_graph is not None:
+        staged_graph["viz_width"] = viz_width
+        return staged_graph
+
     # Remove graphs if they already exist.
     if title in chart_data:
       self._logger.info(("ExperimentDashboard: "
@@ -168,61 +276,348 @@ class ExperimentDashboard(SummaryDashboard):
                        "New {title} graph is being added"
                        .format(title=title)))
 
-    public_url = self._add_copied_query_to_dashboard(
+    staged_graph = self._create_copied_query(
         template,
         title,
-        self._params,
-        viz_width,
+        params,
         description
     )
-    return public_url
+    staged_graph["viz_width"] = viz_width
+    return staged_graph
 
-  def _apply_functions_to_templates(
-      self, template_keyword, events_list, events_table,
-      events_function, general_function=None, title=None
-  ):
-    if events_table is None:
-      events_table = self._events_table
-    self._params["events_table"] = events_table
+  def _can_update_in_place(self, template, visualization):
+    return (visualization is not None and visualization["id"] is not None and
+            visualization["type"] == template["type"] and
+            visualization["options"] == template["options"])
+
+  def _update_existing_graph(self, template, graph, params, title):
+    # The existing widget can only be kept if its visualization still
+    # matches the template's, otherwise the graph has to be recreated.
+    visualization = self._get_graph_visualization(title)
+    if not self._can_update_in_place(template, visualization):
+      return None
+
+    self._logger.info(("ExperimentDashboard: "
+                       "{title} graph exists and is being updated"
+                       .format(title=title)))
+
+    return self._update_copied_query(
+        template,
+        title,
+        params,
+        graph["query_id"],
+        graph["widget_id"],
+        visualization
+    )
+
+  def _attach_staged_graph(self, staged_graph):
+    return self._attach_copied_query(staged_graph, staged_graph["viz_width"])
 
-    templates = []
+  @traced("search_templates")
+  def _search_templates(self, template_keyword):
     try:
-      templates = self.redash.search_queries(template_keyword)
+      if self._template_registry is not None:
+        return self._template_registry.search(self.redash, template_keyword)
+
+      return self.redash.search_queries(template_keyword)
     except self.redash.RedashClientException as e:
         raise self.ExternalAPIError((
           "Unable to find query templates for "
           "keyword '{keyword}': {error}").format(
               keyword=template_keyword, error=e))
 
-    chart_data = self.get_query_ids_and_names()
-
-    public_urls = []
+  def _get_template_units(self, templates, events_list, events_table):
+    # A unit is one (template, event) pair. Non-event templates make up a
+    # single unit with no event.
+    units = []
     for template in templates:
       if "event" in template["name"].lower():
-        self._logger.info((
-            "ExperimentDashboard: "
-            "Processing template '{template_name}'"
-            .format(template_name=template["name"])))
-        events_function(
-            template,
-            chart_data,
-            events_list,
-            events_table,
-            title)
+        for event in events_list:
+          units.append({
+              "template": template,
+              "event": event,
+              "params": self._get_query_params(events_table, event),
+          })
       else:
-        self._logger.info((
-            "ExperimentDashboard: "
-            "Processing template '{template_name}'"
-            .format(template_name=template["name"])))
-        public_url = general_function(template, chart_data)
+        units.append({
+            "template": template,
+            "event": None,
+            "params": self._get_query_params(events_table),
+        })
+
+    for unit in units:
+      self._check_template_parameters(unit["template"], unit["params"])
+
+    return units
+
+  def _check_template_parameters(self, template, params):
+    # Templates are compiled up front so a missing parameter fails the run
+    # before any query is copied.
+    try:
+      compiled = self._compile_template(template)
+    except ValueError as e:
+      raise self.ExternalAPIError(
+          "Unable to compile template '{name}': {error}".format(
+              name=template["name"], error=e))
+
+    missing = compiled.get_missing_parameters(params)
+    if missing:
+      raise self.ExternalAPIError(
+          "Template '{name}' uses unknown parameters: {missing}".format(
+              name=template["name"], missing=", ".join(missing)))
+
+  def _stage_template_unit(self, unit, chart_data, events_function,
+                           general_function=None, title=None):
+    template = unit["template"]
+    self._logger.info((
+        "ExperimentDashboard: "
+        "Processing template '{template_name}'"
+        .format(template_name=template["name"])))
+
+    if unit["event"] is not None:
+      return events_function(
+          template,
+          chart_data,
+          unit["params"],
+          unit["event"],
+          title)
+
+    if general_function is None:
+      return None
+
+    return general_function(template, chart_data, unit["params"])
+
+  def _get_unit_failure(self, unit, error):
+    self._logger.error((
+        "ExperimentDashboard: Template '{template_name}' failed for "
+        "event '{event}': {error}").format(
+            template_name=unit["template"]["name"],
+            event=unit["event"], error=error))
+
+    return {
+        "template": unit["template"]["name"],
+        "event": unit["event"],
+        "error": error,
+    }
+
+  def _apply_functions_to_templates(
+      self, template_keyword, events_list, events_table,
+      events_function, general_function=None, title=None,
+      commit_function=None, max_workers=None
+  ):
+    if events_table is None:
+      events_table = self._events_table
+
+    with self._span("run", keyword=template_keyword) as run_span:
+      templates = self._search_templates(template_keyword)
+      chart_data = self.get_query_ids_and_names()
+      units = self._get_template_units(templates, events_list, events_table)
+
+      return self._apply_template_units(
+          units, chart_data, events_function, general_function, title,
+          commit_function, max_workers, run_span)
+
+  def _start_unit_span(self, template_spans, spans_lock, unit, run_span):
+    # Units of one template share its span, each event gets its own below.
+    # Spans start when the unit is staged, so their durations only cover
+    # that unit's work.
+    if self._tracer is None:
+      return None
+
+    template = unit["template"]
+    with spans_lock:
+      if template["id"] not in template_spans:
+        template_spans[template["id"]] = self._tracer.start_span(
+            "template", run_span, template=template["name"])
+      template_span = template_spans[template["id"]]
+
+    event = unit["event"]
+    if event is None:
+      return template_span
+
+    return self._tracer.start_span(
+        "event", template_span,
+        event=event["event_name"] if self._is_mapped_event(event) else event)
+
+  def _end_unit_span(self, template_spans, remaining_units, unit, unit_span,
+                     error=None):
+    # A template's span ends with its last unit, failed if any unit failed.
+    if unit_span is None:
+      return
 
-        if public_url is not None:
-          public_urls.append(public_url)
+    template_id = unit["template"]["id"]
+    if unit["event"] is not None:
+      unit_span.end(error)
+
+    remaining = remaining_units[template_id]
+    remaining["count"] -= 1
+    remaining["error"] = remaining["error"] or error
+    if not remaining["count"]:
+      template_spans[template_id].end(remaining["error"])
+
+  def _apply_template_units(
+      self, units, chart_data, events_function, general_function, title,
+      commit_function, max_workers, run_span
+  ):
+    template_spans = {}
+    spans_lock = threading.Lock()
+    unit_spans = [None] * len(units)
+    remaining_units = {}
+    for unit in units:
+      remaining = remaining_units.setdefault(
+          unit["template"]["id"], {"count": 0, "error": None})
+      remaining["count"] += 1
+
+    def stage_unit(index):
+      unit_spans[index] = self._start_unit_span(
+          template_spans, spans_lock, units[index], run_span)
+      with self._span("stage", unit_spans[index]):
+        return self._stage_template_unit(
+            units[index], chart_data, events_function, general_function,
+            title)
+
+    # Units are staged concurrently when a pool is requested, but always
+    # committed in unit order so widgets land on the dashboard in a
+    # deterministic order.
+    public_urls = []
+    failures = []
+    staged_units = imap_concurrently(
+        stage_unit, list(range(len(units))), max_workers)
+    for index, (staged, error) in enumerate(staged_units):
+      unit = units[index]
+      if error is None and staged is not None and commit_function:
+        try:
+          with self._span("commit", unit_spans[index]):
+            public_url = commit_function(staged)
+          if public_url is not None and unit["event"] is None:
+            public_urls.append(public_url)
+        except Exception as e:
+          error = e
+
+      self._end_unit_span(
+          template_spans, remaining_units, unit, unit_spans[index], error)
+
+      if error is None:
+        continue
+
+      if not max_workers:
+        if unit_spans[index] is not None:
+          template_spans[unit["template"]["id"]].end(error)
+        raise error
+
+      failures.append(self._get_unit_failure(unit, error))
+
+    if failures:
+      raise self.TemplateApplicationError(
+          "{failed} of {total} template units failed".format(
+              failed=len(failures), total=len(units)),
+          failures,
+          public_urls)
 
     return public_urls
 
+  def _get_unit_title(self, unit):
+    if unit["event"] is None:
+      return self._get_title(unit["template"]["name"])
+
+    return self._get_event_title_description(
+        unit["template"], unit["event"])["title"]
+
+  def _get_graph_action(self, unit, chart_data):
+    title = unit["title"]
+    if title not in chart_data:
+      return "create"
+    if chart_data[title]["query"] == unit["query"]:
+      return "unchanged"
+    if (self._update_in_place and self._can_update_in_place(
+       unit["template"], self._get_graph_visualization(title))):
+      return "update"
+    return "replace"
+
+  def _plan_units(self, template_keyword, events_list, events_table,
+                  get_action):
+    # Only the template search and the dashboard's widgets are fetched,
+    # nothing is changed.
+    if events_list is None:
+      events_list = self.DEFAULT_EVENTS
+    if events_table is None:
+      events_table = self._events_table
+
+    templates = self._search_templates(template_keyword)
+    chart_data = self.get_query_ids_and_names()
+    units = self._get_template_units(templates, events_list, events_table)
+
+    for unit in units:
+      unit["title"] = self._get_unit_title(unit)
+      unit["query"] = self._render_template(unit["template"], unit["params"])
+      unit["data_source_id"] = unit["template"]["data_source_id"]
+      unit["action"] = get_action(unit, chart_data)
+      unit["deleted_query_id"] = None
+      if unit["action"] == "replace":
+        unit["deleted_query_id"] = chart_data[unit["title"]]["query_id"]
+
+    return units
+
+  def _get_plan(self, kind, template_keyword, units, title=None):
+    active_units = [
+        unit for unit in units if unit["action"] != "unchanged"]
+
+    actions = dict((action, 0) for action in self.PLAN_API_CALLS)
+    for unit in units:
+      actions[unit["action"]] += 1
+
+    return {
+        "kind": kind,
+        "keyword": template_keyword,
+        "title": title,
+        "units": units,
+        "actions": actions,
+        "api_calls": sum(
+            self.PLAN_API_CALLS[unit["action"]] for unit in units),
+        "warehouse_queries": [{
+            "title": unit["title"],
+            "query": unit["query"],
+            "data_source_id": unit["data_source_id"],
+        } for unit in active_units],
+        "deleted_query_ids": [
+            unit["deleted_query_id"] for unit in active_units
+            if unit["deleted_query_id"] is not None],
+        "empty": len(active_units) == 0,
+    }
+
+  def plan_graph_templates(self, template_keyword, events_list=None,
+                           events_table=None):
+    # What add_graph_templates would do, for apply_plan. Graphs whose query
+    # wouldn't change are left alone.
+    units = self._plan_units(
+        template_keyword, events_list, events_table, self._get_graph_action)
+    return self._get_plan("graphs", template_keyword, units)
+
+  def _get_plan_functions(self, plan):
+    # The (events, general, title, commit) functions that apply a plan.
+    return (self._apply_event_template, self._apply_non_event_template,
+            None, self._attach_staged_graph)
+
+  def apply_plan(self, plan, max_workers=None):
+    units = [
+        unit for unit in plan["units"] if unit["action"] != "unchanged"]
+    if not units:
+      self._logger.info((
+          "ExperimentDashboard: Nothing to do for "
+          "{keyword}").format(keyword=plan["keyword"]))
+      return []
+
+    events_function, general_function, title, commit_function = (
+        self._get_plan_functions(plan))
+
+    with self._span("apply", keyword=plan["keyword"]) as run_span:
+      return self._apply_template_units(
+          units, self.get_query_ids_and_names(), events_function,
+          general_function, title, commit_function, max_workers, run_span)
+
   def add_graph_templates(self, template_keyword,
-                          events_list=None, events_table=None):
+                          events_list=None, events_table=None,
+                          max_workers=None, wait_for_pending=False):
     self._logger.info(
         "ExperimentDashboard: Adding templates.")
 
@@ -234,6 +629,26 @@ class ExperimentDashboard(SummaryDashboard):
         events_list,
         events_table,
         self._apply_event_template,
-        self._apply_non_event_template
+        self._apply_non_event_template,
+        commit_function=self._attach_staged_graph,
+        max_workers=max_workers,
     )
+
+    if wait_for_pending and self._defer_pending:
+      pending_report = self.wait_for_pending(self._pending_timeout)
+      self._logger.info((
+          "ExperimentDashboard: {completed} deferred graphs added, "
+          "{expired} expired, {failed} failed and {pending} still "
+          "pending.").format(
+              completed=len(pending_report["completed"]),
+              expired=len(pending_report["expired"]),
+              failed=len(pending_report["failed"]),
+              pending=len(pending_report["pending"])))
+
+      # Deferred graphs that were added while waiting get their URLs
+      # returned like the rest.
+      public_urls.extend(
+          public_url for public_url in pending_report["completed"].values()
+          if public_url is not None)
+
     return public_urls
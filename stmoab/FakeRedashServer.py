@@ -0,0 +1,415 @@
+import re
+import json
+import time
+import random
+import threading
+
+from slugify import slugify
+from redash_client.client import RedashClient
+
+# Taking into account different versions of Python
+try:  # pragma: no cover
+  from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+  from SocketServer import ThreadingMixIn
+  from urlparse import urlparse, parse_qs
+except ImportError:  # pragma: no cover
+  from http.server import HTTPServer, BaseHTTPRequestHandler
+  from socketserver import ThreadingMixIn
+  from urllib.parse import urlparse, parse_qs
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+  def _dispatch(self):
+    url = urlparse(self.path)
+    length = int(self.headers.get("Content-Length", None) or 0)
+    body = self.rfile.read(length) if length else b""
+
+    status, response = self.server.fake_redash.handle(
+        self.command, url.path, parse_qs(url.query), body)
+
+    content = json.dumps(response).encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  do_GET = do_POST = do_DELETE = _dispatch
+
+  def log_message(self, format, *args):
+    pass
+
+
+class FakeRedashServer(object):
+  # An in-process stand-in for the parts of the Redash HTTP API that
+  # redash_client and stmoab use, for load tests that need real requests.
+  # Latency and error rates are set per endpoint, by the names in ROUTES,
+  # with "*" as the default. Query results stay pending for
+  # `execution_delay` seconds after a query is first run, and then come
+  # from set_results() or `results(query_string, data_source_id)`.
+  ROUTES = [
+      ("GET", r"dashboards/(?P<id>[^/]+)", "get_dashboard"),
+      ("POST", r"dashboards", "create_dashboard"),
+      ("POST", r"dashboards/(?P<id>[^/]+)/share", "share_dashboard"),
+      ("POST", r"dashboards/(?P<id>[^/]+)", "update_dashboard"),
+      ("GET", r"queries", "search_queries"),
+      ("POST", r"queries", "create_query"),
+      ("GET", r"queries/(?P<id>\d+)", "get_query"),
+      ("POST", r"queries/(?P<id>\d+)/refresh", "refresh_query"),
+      ("POST", r"queries/(?P<id>\d+)/fork", "fork_query"),
+      ("POST", r"queries/(?P<id>\d+)", "update_query"),
+      ("DELETE", r"queries/(?P<id>\d+)", "delete_query"),
+      ("POST", r"query_results", "query_results"),
+      ("POST", r"visualizations", "create_visualization"),
+      ("POST", r"widgets", "create_widget"),
+      ("DELETE", r"widgets/(?P<id>\d+)", "delete_widget"),
+  ]
+  ERROR_STATUS_CODE = 503
+
+  def __init__(self, latency=None, error_rates=None, execution_delay=0,
+               results=None, seed=None):
+    self._latency = latency or {}
+    self._error_rates = error_rates or {}
+    self._execution_delay = execution_delay
+    self._results = results or self.get_default_rows
+    self._random = random.Random(seed)
+    self._routes = [
+        (method, re.compile("^/api/{path}$".format(path=path)), name)
+        for method, path, name in self.ROUTES]
+
+    self._lock = threading.Lock()
+    self._ids = iter(range(1, 2 ** 31))
+    self._queries = {}
+    self._visualizations = {}
+    self._widgets = {}
+    self._dashboards = {}
+    self._executions = {}
+    self._fixed_results = {}
+    self.reset_stats()
+
+    self._server = None
+    self._original_urls = None
+
+  def start(self):
+    self._server = _ThreadingHTTPServer(("127.0.0.1", 0), _RequestHandler)
+    self._server.fake_redash = self
+
+    thread = threading.Thread(target=self._server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return self
+
+  def stop(self):
+    self.uninstall()
+    if self._server is not None:
+      self._server.shutdown()
+      self._server.server_close()
+      self._server = None
+
+  @property
+  def url(self):
+    return "http://127.0.0.1:{port}/".format(
+        port=self._server.server_address[1])
+
+  def install(self):
+    # Points every RedashClient at this server until uninstall().
+    if self._original_urls is None:
+      self._original_urls = (RedashClient.BASE_URL, RedashClient.API_BASE_URL)
+    RedashClient.BASE_URL = self.url
+    RedashClient.API_BASE_URL = self.url + "api/"
+
+  def uninstall(self):
+    if self._original_urls is not None:
+      RedashClient.BASE_URL, RedashClient.API_BASE_URL = self._original_urls
+      self._original_urls = None
+
+  def __enter__(self):
+    self.start()
+    self.install()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.stop()
+
+  def reset_stats(self):
+    with self._lock:
+      self._calls = {}
+      self._errors = 0
+      self._in_flight = 0
+      self._max_in_flight = 0
+
+  def get_stats(self):
+    with self._lock:
+      return {
+          "calls": dict(self._calls),
+          "total_calls": sum(self._calls.values()),
+          "errors": self._errors,
+          "max_concurrency": self._max_in_flight,
+      }
+
+  def get_default_rows(self, query_string, data_source_id):
+    # A week of per-client rows for a control and an experiment variant,
+    # enough for both graphs and T-Tables.
+    rand = random.Random(query_string)
+    rows = []
+    for day in range(1, 8):
+      for i in range(10):
+        for variant, shift in [("control", 0), ("experiment", 1)]:
+          rows.append({
+              "date": "2018-01-0{day}".format(day=day),
+              "type": variant,
+              "count": rand.randint(0, 20) + shift,
+              "event": "CLICK",
+          })
+    return rows
+
+  def _get_setting(self, settings, name):
+    return settings.get(name, settings.get("*", 0))
+
+  def handle(self, method, path, query_params, body):
+    for route_method, pattern, name in self._routes:
+      match = pattern.match(path)
+      if route_method == method and match:
+        break
+    else:
+      return 404, {"message": "No route for {method} {path}".format(
+          method=method, path=path)}
+
+    with self._lock:
+      self._calls[name] = self._calls.get(name, 0) + 1
+      self._in_flight += 1
+      self._max_in_flight = max(self._max_in_flight, self._in_flight)
+      failed = (
+          self._random.random() < self._get_setting(self._error_rates, name))
+      if failed:
+        self._errors += 1
+
+    try:
+      latency = self._get_setting(self._latency, name)
+      if isinstance(latency, (list, tuple)):
+        latency = self._random.uniform(*latency)
+      if latency:
+        time.sleep(latency)
+
+      if failed:
+        return self.ERROR_STATUS_CODE, {"message": "Injected error"}
+
+      data = json.loads(body.decode("utf-8")) if body else {}
+      with self._lock:
+        return getattr(self, "_" + name)(
+            match.groupdict(), query_params, data)
+    finally:
+      with self._lock:
+        self._in_flight -= 1
+
+  def add_template(self, name, query, data_source_id=5, viz_type="CHART",
+                   options=None, description=""):
+    # Adds a saved query with a visualization, like the templates that
+    # dashboards are built from. Returns its ID.
+    with self._lock:
+      query_info = self._add_query(name, query, data_source_id, description)
+      self._add_visualization(
+          query_info["id"], viz_type, name, options or {})
+      return query_info["id"]
+
+  def set_results(self, query_string, rows):
+    # The rows `query_string` returns, whatever its data source.
+    with self._lock:
+      self._fixed_results[query_string] = rows
+
+  def _now(self):
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
+
+  def _add_query(self, name, query, data_source_id, description=None):
+    query_info = {
+        "id": next(self._ids),
+        "name": name,
+        "query": query,
+        "data_source_id": data_source_id,
+        "description": description,
+        "options": {},
+        "schedule": None,
+        "updated_at": self._now(),
+        "version": 1,
+        "visualizations": [],
+    }
+    self._queries[query_info["id"]] = query_info
+    return query_info
+
+  def _add_visualization(self, query_id, viz_type, name, options):
+    visualization = {
+        "id": next(self._ids),
+        "type": viz_type,
+        "name": name,
+        "options": options,
+        "query_id": query_id,
+    }
+    self._visualizations[visualization["id"]] = visualization
+    self._queries[query_id]["visualizations"].append(visualization)
+    return visualization
+
+  def _find_dashboard(self, slug_or_id):
+    if slug_or_id.isdigit():
+      return self._dashboards.get(int(slug_or_id), None)
+
+    for dashboard in self._dashboards.values():
+      if dashboard["slug"] == slug_or_id:
+        return dashboard
+    return None
+
+  def _get_widget_info(self, widget):
+    visualization = self._visualizations.get(
+        widget["visualization_id"], {})
+    query_info = self._queries.get(visualization.get("query_id", None), {})
+
+    return {
+        "id": widget["id"],
+        "width": widget["width"],
+        "visualization": dict(visualization, query=dict(
+            (field, query_info.get(field, None))
+            for field in ["id", "name", "query", "updated_at"])),
+    }
+
+  def _get_dashboard(self, path_params, query_params, data):
+    dashboard = self._find_dashboard(path_params["id"])
+    if dashboard is None:
+      return 404, {"message": "Dashboard not found"}
+
+    widgets = [
+        self._get_widget_info(widget) for widget in self._widgets.values()
+        if widget["dashboard_id"] == dashboard["id"]]
+    return 200, dict(dashboard, widgets=widgets)
+
+  def _create_dashboard(self, path_params, query_params, data):
+    dashboard = {
+        "id": next(self._ids),
+        "name": data["name"],
+        "slug": slugify(data["name"]),
+        "is_draft": True,
+        "public_url": None,
+    }
+    self._dashboards[dashboard["id"]] = dashboard
+    return 200, dashboard
+
+  def _share_dashboard(self, path_params, query_params, data):
+    dashboard = self._find_dashboard(path_params["id"])
+    if dashboard is None:
+      return 404, {"message": "Dashboard not found"}
+
+    dashboard["public_url"] = "{url}public/dashboards/{id}".format(
+        url=self.url, id=dashboard["id"])
+    return 200, {"public_url": dashboard["public_url"]}
+
+  def _update_dashboard(self, path_params, query_params, data):
+    dashboard = self._find_dashboard(path_params["id"])
+    if dashboard is None:
+      return 404, {"message": "Dashboard not found"}
+
+    dashboard.update(data)
+    return 200, dashboard
+
+  def _search_queries(self, path_params, query_params, data):
+    keyword = query_params.get("q", [""])[0].lower()
+    page = int(query_params.get("page", ["1"])[0])
+    page_size = int(query_params.get("page_size", ["25"])[0])
+
+    matches = [
+        query_info for query_id, query_info in sorted(self._queries.items())
+        if keyword in query_info["name"].lower()]
+    start = (page - 1) * page_size
+    return 200, {
+        "count": len(matches),
+        "page": page,
+        "page_size": page_size,
+        "results": matches[start:start + page_size],
+    }
+
+  def _create_query(self, path_params, query_params, data):
+    query_info = self._add_query(
+        data["name"], data["query"], data["data_source_id"],
+        data.get("description", None))
+
+    # Redash gives every new query a table visualization.
+    self._add_visualization(query_info["id"], "TABLE", "Table", {})
+    return 200, query_info
+
+  def _get_query(self, path_params, query_params, data):
+    query_info = self._queries.get(int(path_params["id"]), None)
+    if query_info is None:
+      return 404, {"message": "Query not found"}
+    return 200, query_info
+
+  def _refresh_query(self, path_params, query_params, data):
+    if int(path_params["id"]) not in self._queries:
+      return 404, {"message": "Query not found"}
+    return 200, {"job": {"id": str(next(self._ids)), "status": 1}}
+
+  def _fork_query(self, path_params, query_params, data):
+    original = self._queries.get(int(path_params["id"]), None)
+    if original is None:
+      return 404, {"message": "Query not found"}
+
+    fork = self._add_query(
+        "Copy of " + original["name"], original["query"],
+        original["data_source_id"], original["description"])
+    for visualization in original["visualizations"]:
+      self._add_visualization(
+          fork["id"], visualization["type"], visualization["name"],
+          visualization["options"])
+    return 200, fork
+
+  def _update_query(self, path_params, query_params, data):
+    query_info = self._queries.get(int(path_params["id"]), None)
+    if query_info is None:
+      return 404, {"message": "Query not found"}
+
+    query_info.update(
+        (field, value) for field, value in data.items() if field != "id")
+    query_info["updated_at"] = self._now()
+    query_info["version"] += 1
+    return 200, query_info
+
+  def _delete_query(self, path_params, query_params, data):
+    if self._queries.pop(int(path_params["id"]), None) is None:
+      return 404, {"message": "Query not found"}
+    return 200, {}
+
+  def _query_results(self, path_params, query_params, data):
+    key = (data["query"], data["data_source_id"])
+    started_at = self._executions.setdefault(key, time.time())
+
+    if time.time() - started_at < self._execution_delay:
+      return 200, {"job": {"id": str(next(self._ids)), "status": 2}}
+
+    rows = self._fixed_results.get(data["query"], None)
+    if rows is None:
+      rows = self._results(data["query"], data["data_source_id"])
+    return 200, {"query_result": {"data": {"rows": rows}}}
+
+  def _create_visualization(self, path_params, query_params, data):
+    if data["query_id"] not in self._queries:
+      return 404, {"message": "Query not found"}
+
+    visualization = self._add_visualization(
+        data["query_id"], data["type"], data["name"], data["options"])
+    return 200, visualization
+
+  def _create_widget(self, path_params, query_params, data):
+    widget = {
+        "id": next(self._ids),
+        "dashboard_id": data["dashboard_id"],
+        "visualization_id": data["visualization_id"],
+        "width": data["width"],
+    }
+    self._widgets[widget["id"]] = widget
+    return 200, widget
+
+  def _delete_widget(self, path_params, query_params, data):
+    if self._widgets.pop(int(path_params["id"]), None) is None:
+      return 404, {"message": "Widget not found"}
+    return 200, {}
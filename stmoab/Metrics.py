@@ -0,0 +1,179 @@
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+
+def timed(name):
+  # Times a dashboard method under `name` when the dashboard has metrics.
+  def decorator(function):
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+      if getattr(self, "_metrics", None) is None:
+        return function(self, *args, **kwargs)
+
+      with self._metrics.timer(name):
+        return function(self, *args, **kwargs)
+    return wrapper
+  return decorator
+
+
+class Metrics(object):
+  # Call counts, latency histograms, bytes transferred and errors per
+  # operation, plus plain counters such as cache hits. Summaries are
+  # written as JSON or in the Prometheus text format.
+  DEFAULT_BUCKETS = (
+      0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+  PREFIX = "stmoab"
+
+  def __init__(self, buckets=DEFAULT_BUCKETS, labels=None):
+    self._buckets = tuple(sorted(buckets))
+    self._labels = labels or {}
+    self._lock = threading.Lock()
+    self._started_at = time.time()
+    self._operations = OrderedDict()
+    self._counters = OrderedDict()
+
+  def _get_operation(self, name):
+    operation = self._operations.get(name, None)
+    if operation is None:
+      operation = {
+          "count": 0,
+          "errors": 0,
+          "seconds": 0.0,
+          "max_seconds": 0.0,
+          "bytes_sent": 0,
+          "bytes_received": 0,
+          "buckets": [0] * (len(self._buckets) + 1),
+      }
+      self._operations[name] = operation
+    return operation
+
+  def record(self, name, seconds, error=False, bytes_sent=0,
+             bytes_received=0):
+    with self._lock:
+      operation = self._get_operation(name)
+      operation["count"] += 1
+      operation["errors"] += 1 if error else 0
+      operation["seconds"] += seconds
+      operation["max_seconds"] = max(operation["max_seconds"], seconds)
+      operation["bytes_sent"] += bytes_sent
+      operation["bytes_received"] += bytes_received
+
+      bucket = len(self._buckets)
+      for i, bound in enumerate(self._buckets):
+        if seconds <= bound:
+          bucket = i
+          break
+      operation["buckets"][bucket] += 1
+
+  def increment(self, name, value=1):
+    with self._lock:
+      self._counters[name] = self._counters.get(name, 0) + value
+
+  @contextmanager
+  def timer(self, name):
+    # Yields a dict the caller can set "bytes_sent" and "bytes_received" in.
+    call = {"bytes_sent": 0, "bytes_received": 0}
+    started_at = time.time()
+    error = False
+    try:
+      yield call
+    except Exception:
+      error = True
+      raise
+    finally:
+      self.record(
+          name, time.time() - started_at, error,
+          call["bytes_sent"], call["bytes_received"])
+
+  def _make_request(self, make_request, request_function, url, args={}):
+    with self.timer("redash_request") as call:
+      json_result, response = make_request(request_function, url, args)
+
+      if args and hasattr(args, "__len__"):
+        call["bytes_sent"] = len(args)
+      call["bytes_received"] = len(response.content or b"")
+      return json_result, response
+
+  def install(self, redash_client):
+    # Every redash_client API call goes through _make_request, so wrapping
+    # it records each HTTP request and its size.
+    redash_client._make_request = functools.partial(
+        self._make_request, redash_client._make_request)
+    return redash_client
+
+  def get_summary(self):
+    with self._lock:
+      operations = OrderedDict()
+      for name, operation in self._operations.items():
+        summary = dict(operation)
+        summary["mean_seconds"] = operation["seconds"] / operation["count"]
+        summary["buckets"] = OrderedDict(
+            (str(bound), count) for bound, count in
+            zip(self._buckets + ("+Inf",), operation["buckets"]))
+        operations[name] = summary
+
+      return {
+          "labels": dict(self._labels),
+          "started_at": self._started_at,
+          "seconds": time.time() - self._started_at,
+          "operations": operations,
+          "counters": dict(self._counters),
+      }
+
+  def write_json(self, path):
+    with open(path, "w") as summary_file:
+      json.dump(self.get_summary(), summary_file, indent=2)
+
+  def _format_labels(self, **labels):
+    labels = dict(self._labels, **labels)
+    if not labels:
+      return ""
+
+    return "{{{labels}}}".format(labels=",".join(
+        '{name}="{value}"'.format(
+            name=name,
+            value=str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in sorted(labels.items())))
+
+  def to_prometheus(self):
+    summary = self.get_summary()
+    lines = []
+
+    def add_metric(name, metric_type, samples):
+      name = "{prefix}_{name}".format(prefix=self.PREFIX, name=name)
+      lines.append("# TYPE {name} {type}".format(name=name, type=metric_type))
+      for suffix, labels, value in samples:
+        lines.append("{name}{suffix}{labels} {value}".format(
+            name=name, suffix=suffix,
+            labels=self._format_labels(**labels), value=value))
+
+    histogram = []
+    for name, operation in summary["operations"].items():
+      cumulative = 0
+      for bound, count in operation["buckets"].items():
+        cumulative += count
+        histogram.append(
+            ("_bucket", {"operation": name, "le": bound}, cumulative))
+      histogram.append(("_sum", {"operation": name}, operation["seconds"]))
+      histogram.append(("_count", {"operation": name}, operation["count"]))
+    add_metric("operation_duration_seconds", "histogram", histogram)
+
+    for field in ["errors", "bytes_sent", "bytes_received"]:
+      add_metric(
+          "operation_{field}_total".format(field=field), "counter",
+          [("", {"operation": name}, operation[field])
+           for name, operation in summary["operations"].items()])
+
+    add_metric("events_total", "counter", [
+        ("", {"event": name}, value)
+        for name, value in sorted(summary["counters"].items())])
+
+    return "\n".join(lines) + "\n"
+
+  def write_prometheus(self, path):
+    with open(path, "w") as metrics_file:
+      metrics_file.write(self.to_prometheus())
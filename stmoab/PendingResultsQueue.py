@@ -0,0 +1,173 @@
+import time
+import heapq
+import logging
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PendingResultsQueue(object):
+  # Polls queries whose results are still being computed, backing off
+  # exponentially between polls. A background thread hands every poll
+  # that's due to a bounded pool, so a slow query or callback doesn't hold
+  # up the others. `fetch_results` should check once rather than wait for
+  # results. Once a query has results its callback runs on the pool, if it
+  # has none by its deadline it expires.
+  DEFAULT_TIMEOUT = 10 * 60
+  DEFAULT_INITIAL_DELAY = 1.0
+  DEFAULT_MAX_DELAY = 60.0
+  DEFAULT_MAX_WORKERS = 4
+
+  def __init__(self, fetch_results, timeout=None, initial_delay=None,
+               max_delay=None, max_workers=None):
+    self._fetch_results = fetch_results
+    self._timeout = timeout or self.DEFAULT_TIMEOUT
+    self._initial_delay = initial_delay or self.DEFAULT_INITIAL_DELAY
+    self._max_delay = max_delay or self.DEFAULT_MAX_DELAY
+    self._max_workers = max_workers or self.DEFAULT_MAX_WORKERS
+
+    self._logger = logging.getLogger()
+    self._condition = threading.Condition()
+    self._order = itertools.count()
+    self._schedule = []
+    self._pending = {}
+    self._report = self._get_empty_report()
+    self._worker = None
+    self._executor = None
+    self._closed = False
+
+  def _get_empty_report(self):
+    return {
+        "completed": {},
+        "expired": [],
+        "failed": []
+    }
+
+  def add(self, name, query_string, data_source_id, on_ready):
+    entry = {
+        "id": next(self._order),
+        "name": name,
+        "query": query_string,
+        "data_source_id": data_source_id,
+        "on_ready": on_ready,
+        "deadline": time.time() + self._timeout,
+        "delay": self._initial_delay,
+    }
+
+    with self._condition:
+      self._pending[entry["id"]] = name
+      self._push(entry, time.time() + entry["delay"])
+
+      if self._worker is None:
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        self._worker = threading.Thread(
+            target=self._run, args=(self._executor,))
+        self._worker.daemon = True
+        self._worker.start()
+
+      self._condition.notify_all()
+
+  def _push(self, entry, poll_at):
+    heapq.heappush(self._schedule, (poll_at, next(self._order), entry))
+
+  def _next_entry(self):
+    # Returns None once the queue is closed.
+    with self._condition:
+      while not self._closed:
+        if self._schedule and self._schedule[0][0] <= time.time():
+          return heapq.heappop(self._schedule)[2]
+
+        timeout = None
+        if self._schedule:
+          timeout = self._schedule[0][0] - time.time()
+        self._condition.wait(timeout)
+
+  def _run(self, executor):
+    while True:
+      entry = self._next_entry()
+      if entry is None:
+        return
+      executor.submit(self._poll, entry)
+
+  def _poll(self, entry):
+    try:
+      results = self._fetch_results(
+          entry["query"], entry["data_source_id"], entry["name"])
+
+      if results:
+        self._finish(entry, "completed", entry["on_ready"]())
+        return
+    except Exception as e:
+      self._logger.error((
+          "PendingResultsQueue: '{name}' failed: {error}").format(
+              name=entry["name"], error=e))
+      self._finish(entry, "failed", e)
+      return
+
+    if time.time() >= entry["deadline"]:
+      self._logger.info((
+          "PendingResultsQueue: '{name}' has no results after {timeout} "
+          "seconds and will not be displayed.").format(
+              name=entry["name"], timeout=self._timeout))
+      self._finish(entry, "expired")
+      return
+
+    with self._condition:
+      entry["delay"] = min(self._max_delay, entry["delay"] * 2)
+      poll_at = min(entry["deadline"], time.time() + entry["delay"])
+      self._push(entry, poll_at)
+      self._condition.notify_all()
+
+  def _finish(self, entry, outcome, value=None):
+    name = entry["name"]
+
+    with self._condition:
+      if outcome == "completed":
+        self._report["completed"][name] = value
+      elif outcome == "failed":
+        self._report["failed"].append({"name": name, "error": value})
+      else:
+        self._report["expired"].append(name)
+
+      self._pending.pop(entry["id"], None)
+      self._condition.notify_all()
+
+  def __len__(self):
+    with self._condition:
+      return len(self._pending)
+
+  def wait(self, timeout=None):
+    # Blocks until every query has completed, failed or expired, or for at
+    # most `timeout` seconds. Returns what happened since the last wait,
+    # with any queries still outstanding under "pending".
+    deadline = None if timeout is None else time.time() + timeout
+
+    with self._condition:
+      while self._pending and not self._closed:
+        remaining = None
+        if deadline is not None:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            break
+        self._condition.wait(remaining)
+
+      report = self._report
+      report["pending"] = sorted(self._pending.values())
+      self._report = self._get_empty_report()
+
+    return report
+
+  def close(self):
+    # Stops polling once the polls in progress are done. Queries still
+    # outstanding are left pending and any wait() returns.
+    with self._condition:
+      self._closed = True
+      worker, executor = self._worker, self._executor
+      self._worker = None
+      self._executor = None
+      self._condition.notify_all()
+
+    if worker is not None:
+      worker.join()
+      executor.shutdown(wait=True)
@@ -0,0 +1,109 @@
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class QueryResultCache(object):
+  # Query results keyed on the rendered SQL and its data source. Entries
+  # expire after `ttl` seconds and the least recently used entries are
+  # evicted past `max_entries`. With a `path`, results are also kept in a
+  # SQLite file so they survive between runs.
+  DEFAULT_TTL = 60 * 60
+  DEFAULT_MAX_ENTRIES = 256
+
+  # Single quoted SQL literals, including '' escapes.
+  SQL_LITERAL = re.compile(r"('(?:[^']|'')*')")
+
+  def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+               path=None):
+    self._ttl = ttl
+    self._max_entries = max_entries
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+    self._db = None
+
+    if path is not None:
+      self._db = sqlite3.connect(path, check_same_thread=False)
+      self._db.execute(
+          "CREATE TABLE IF NOT EXISTS query_results "
+          "(key TEXT PRIMARY KEY, stored_at REAL, rows TEXT)")
+      self._db.execute(
+          "DELETE FROM query_results WHERE stored_at < ?",
+          (time.time() - self._ttl,))
+      self._db.commit()
+
+  def normalize(self, query_string):
+    # Collapse whitespace everywhere except inside string literals.
+    parts = self.SQL_LITERAL.split(query_string.strip())
+    for i in range(0, len(parts), 2):
+      parts[i] = " ".join(parts[i].split())
+    return "".join(parts)
+
+  def make_key(self, query_string, data_source_id):
+    normalized = self.normalize(query_string)
+    if not isinstance(normalized, bytes):
+      normalized = normalized.encode("utf-8")
+
+    return "{data_source}:{digest}".format(
+        data_source=data_source_id,
+        digest=hashlib.sha1(normalized).hexdigest())
+
+  def _is_fresh(self, stored_at):
+    return time.time() - stored_at <= self._ttl
+
+  def _store(self, key, stored_at, rows):
+    self._entries.pop(key, None)
+    self._entries[key] = (stored_at, rows)
+
+    while len(self._entries) > self._max_entries:
+      self._entries.popitem(last=False)
+
+  def get(self, query_string, data_source_id):
+    key = self.make_key(query_string, data_source_id)
+
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is not None and self._is_fresh(entry[0]):
+        self._entries[key] = entry
+        return entry[1]
+
+      if self._db is None:
+        return None
+
+      row = self._db.execute(
+          "SELECT stored_at, rows FROM query_results WHERE key = ?",
+          (key,)).fetchone()
+      if row is None or not self._is_fresh(row[0]):
+        return None
+
+      rows = json.loads(row[1])
+      self._store(key, row[0], rows)
+      return rows
+
+  def set(self, query_string, data_source_id, rows):
+    key = self.make_key(query_string, data_source_id)
+    stored_at = time.time()
+
+    with self._lock:
+      self._store(key, stored_at, rows)
+
+      if self._db is not None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO query_results VALUES (?, ?, ?)",
+            (key, stored_at, json.dumps(rows)))
+        self._db.commit()
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+      if self._db is not None:
+        self._db.execute("DELETE FROM query_results")
+        self._db.commit()
+
+  def __len__(self):
+    return len(self._entries)
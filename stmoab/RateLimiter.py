@@ -0,0 +1,163 @@
+import time
+import random
+import functools
+import threading
+
+import requests
+from requests.packages.urllib3.exceptions import NewConnectionError
+
+
+class RateLimiter(object):
+  # Paces Redash requests with a token bucket of `rate` requests a second
+  # and bounds how many are in flight with an AIMD limit: every success
+  # raises the limit a little, every throttled request halves it. Throttled
+  # requests and dropped connections are retried after a jittered
+  # exponential backoff.
+  RETRYABLE_STATUS_CODES = [429, 502, 503, 504]
+  RETRYABLE_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+  # A POST that failed with a gateway error or a dropped connection may
+  # still have been applied, and retrying it would create duplicate
+  # queries and widgets. POSTs are only retried when Redash refused them
+  # or they never reached it.
+  NON_IDEMPOTENT_RETRYABLE_STATUS_CODES = [429, 503]
+
+  DEFAULT_RATE = 10.0
+  DEFAULT_MAX_CONCURRENCY = 16
+  DEFAULT_MAX_RETRIES = 5
+  DEFAULT_BASE_DELAY = 0.5
+  DEFAULT_MAX_DELAY = 30.0
+
+  _shared = {}
+  _shared_lock = threading.Lock()
+
+  def __init__(self, rate=DEFAULT_RATE, burst=None,
+               max_concurrency=DEFAULT_MAX_CONCURRENCY, min_concurrency=1,
+               max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY,
+               max_delay=DEFAULT_MAX_DELAY):
+    self._rate = float(rate)
+    self._capacity = float(burst or rate)
+    self._tokens = self._capacity
+    self._refilled_at = time.time()
+
+    self._max_concurrency = max_concurrency
+    self._min_concurrency = min_concurrency
+    self._concurrency = float(max_concurrency)
+    self._in_flight = 0
+
+    self._max_retries = max_retries
+    self._base_delay = base_delay
+    self._max_delay = max_delay
+    self._condition = threading.Condition()
+
+  @classmethod
+  def shared(cls, name="default", **options):
+    # One limiter per name for the whole process, so every dashboard
+    # talking to the same Redash instance shares its capacity. Options
+    # only apply when the limiter is first created.
+    with cls._shared_lock:
+      if name not in cls._shared:
+        cls._shared[name] = cls(**options)
+      return cls._shared[name]
+
+  @property
+  def concurrency(self):
+    return int(self._concurrency)
+
+  def _refill(self):
+    now = time.time()
+    self._tokens = min(
+        self._capacity,
+        self._tokens + (now - self._refilled_at) * self._rate)
+    self._refilled_at = now
+
+  def _acquire(self):
+    with self._condition:
+      while True:
+        self._refill()
+        if self._in_flight < self.concurrency and self._tokens >= 1:
+          self._tokens -= 1
+          self._in_flight += 1
+          return
+
+        # Wake up when the next token is due, or when a request finishes.
+        timeout = None
+        if self._tokens < 1:
+          timeout = (1 - self._tokens) / self._rate
+        self._condition.wait(timeout)
+
+  def _release(self, throttled):
+    with self._condition:
+      self._in_flight -= 1
+
+      if throttled:
+        self._concurrency = max(
+            self._min_concurrency, self._concurrency / 2)
+      else:
+        self._concurrency = min(
+            self._max_concurrency,
+            self._concurrency + 1 / self._concurrency)
+
+      self._condition.notify_all()
+
+  def _was_sent(self, cause):
+    # Connecting failed before any of the request was sent.
+    if isinstance(cause, requests.ConnectTimeout):
+      return False
+
+    reason = getattr(cause.args[0] if cause.args else None, "reason", None)
+    return not isinstance(reason, NewConnectionError)
+
+  def is_retryable(self, error, idempotent=True):
+    # RedashClientException carries the status code or the underlying
+    # requests error as its second argument.
+    if len(getattr(error, "args", ())) < 2:
+      return False
+
+    cause = error.args[1]
+    if isinstance(cause, self.RETRYABLE_ERRORS):
+      return idempotent or not self._was_sent(cause)
+
+    if idempotent:
+      return cause in self.RETRYABLE_STATUS_CODES
+    return cause in self.NON_IDEMPOTENT_RETRYABLE_STATUS_CODES
+
+  def get_backoff(self, attempt):
+    return random.uniform(
+        0, min(self._max_delay, self._base_delay * (2 ** attempt)))
+
+  def _call(self, idempotent, function, *args, **kwargs):
+    attempt = 0
+    while True:
+      self._acquire()
+      throttled = False
+      try:
+        return function(*args, **kwargs)
+      except Exception as e:
+        throttled = self.is_retryable(e)
+        retryable = throttled and self.is_retryable(e, idempotent)
+        if not retryable or attempt >= self._max_retries:
+          raise
+      finally:
+        self._release(throttled)
+
+      time.sleep(self.get_backoff(attempt))
+      attempt += 1
+
+  def call(self, function, *args, **kwargs):
+    # `function` must be safe to repeat.
+    return self._call(True, function, *args, **kwargs)
+
+  def _make_request(self, make_request, request_function, url, args={}):
+    # redash_client sends a POST when it's given no request function.
+    idempotent = request_function not in (None, requests.post)
+    return self._call(
+        idempotent, make_request, request_function, url, args)
+
+  def install(self, redash_client):
+    # Every redash_client API call goes through _make_request, so limiting
+    # it covers all of them. Retries happen per HTTP request rather than
+    # per API call, so calls that make several requests aren't repeated.
+    redash_client._make_request = functools.partial(
+        self._make_request, redash_client._make_request)
+    return redash_client
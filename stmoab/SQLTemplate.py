@@ -0,0 +1,96 @@
+import re
+import string
+import threading
+from collections import OrderedDict
+
+
+class SQLTemplate(object):
+  # A query template parsed once into literal chunks and parameter slots,
+  # so rendering it for another set of parameters is a join. Templates use
+  # Redash's {{{param}}} placeholders or plain str.format fields and render
+  # exactly like str.format would.
+  MAX_CACHED_TEMPLATES = 512
+
+  _cache = OrderedDict()
+  _cache_lock = threading.Lock()
+  _formatter = string.Formatter()
+
+  FIELD_NAME = re.compile(r"[^.\[]*")
+
+  class MissingParameterError(KeyError):
+    pass
+
+  def __init__(self, sql):
+    adjusted_sql = sql.replace("{{{", "{").replace("}}}", "}")
+
+    self._chunks = []
+    parameters = set()
+    fields = self._formatter.parse(adjusted_sql)
+    for literal, field, format_spec, conversion in fields:
+      if field is not None:
+        name = self.FIELD_NAME.match(field).group(0)
+        if name == "" or name.isdigit():
+          raise ValueError(
+              "SQL templates only take named parameters: {sql}".format(
+                  sql=sql))
+        parameters.add(name)
+
+        # Plain {name} fields, nearly all of them, skip the formatter.
+        if field != name or format_spec or conversion:
+          field = (field, format_spec, conversion)
+
+      self._chunks.append((literal, field))
+
+    self.parameters = frozenset(parameters)
+
+  @classmethod
+  def compile(cls, sql, template_id=None, version=None):
+    # Templates are cached by ID and version. Without a version the SQL
+    # itself is part of the key, so an edited template is compiled again.
+    key = (template_id, version if version is not None else sql)
+
+    with cls._cache_lock:
+      compiled = cls._cache.pop(key, None)
+      if compiled is not None:
+        cls._cache[key] = compiled
+        return compiled
+
+    compiled = cls(sql)
+
+    with cls._cache_lock:
+      cls._cache[key] = compiled
+      while len(cls._cache) > cls.MAX_CACHED_TEMPLATES:
+        cls._cache.popitem(last=False)
+
+    return compiled
+
+  def get_missing_parameters(self, params):
+    return sorted(self.parameters.difference(params))
+
+  def _format_field(self, field, params):
+    field, format_spec, conversion = field
+    value = self._formatter.get_field(field, (), params)[0]
+    value = self._formatter.convert_field(value, conversion)
+    if "{" in format_spec:
+      format_spec = self._formatter.vformat(format_spec, (), params)
+    return self._formatter.format_field(value, format_spec)
+
+  def render(self, params):
+    missing = self.get_missing_parameters(params)
+    if missing:
+      raise self.MissingParameterError(
+          "Missing SQL template parameters: {missing}".format(
+              missing=", ".join(missing)))
+
+    parts = []
+    for literal, field in self._chunks:
+      parts.append(literal)
+
+      if field is None:
+        continue
+      elif isinstance(field, tuple):
+        parts.append(self._format_field(field, params))
+      else:
+        parts.append(format(params[field]))
+
+    return "".join(parts)
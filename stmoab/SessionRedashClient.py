@@ -0,0 +1,28 @@
+import functools
+
+import requests
+from redash_client.client import RedashClient
+
+
+class SessionRedashClient(RedashClient):
+  # A RedashClient whose requests all go through one requests.Session, so
+  # they reuse its connection pool instead of each opening a connection.
+
+  def __init__(self, api_key, session=None):
+    super(SessionRedashClient, self).__init__(api_key)
+    self._session = session or requests.Session()
+
+  def _get_session_function(self, request_function, args):
+    # RedashClient passes the requests module's functions, and only sends
+    # arguments along with a POST.
+    if not request_function or request_function == requests.post:
+      return functools.partial(self._session.post, data=args)
+    if request_function == requests.get:
+      return self._session.get
+    if request_function == requests.delete:
+      return self._session.delete
+    return request_function
+
+  def _make_request(self, request_function, url, args={}):
+    return super(SessionRedashClient, self)._make_request(
+        self._get_session_function(request_function, args), url, args)
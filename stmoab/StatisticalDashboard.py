@@ -1,11 +1,17 @@
 import math
-import statistics
-from scipy import stats
-import statsmodels.stats.power as smp
+import time
+import hashlib
+from datetime import timedelta
+from collections import OrderedDict
 
+from dateutil.parser import parse
 from redash_client.constants import VizWidth
 
+from stmoab.stats import (
+    RunningStats, summarize, summary_from_sums, summary_from_variance,
+    sums_from_summary, pooled_stddev, ttest_and_power)
 from stmoab.utils import upload_as_json, create_boto_transfer
+from stmoab.Tracer import traced
 from stmoab.constants import TTableSchema
 from stmoab.ExperimentDashboard import (
     ExperimentDashboard)
@@ -23,11 +29,29 @@ class StatisticalDashboard(ExperimentDashboard):
   ALPHA_ERROR = 0.005
   TTABLE_TEMPLATE = {"columns": TTableSchema, "rows": []}
 
+  # T-Table queries are always run: their results, then updating the
+  # template and refreshing it.
+  PLAN_API_CALLS = dict(ExperimentDashboard.PLAN_API_CALLS, execute=3)
+
+  # Incremental T-Tables need every row to carry the day it's from.
+  DATE_COLUMN = "date"
+
+  # Aggregated T-Table templates return one row per variant "type" with
+  # its count and either its mean and variance or its sum and sum of
+  # squares.
+  COUNT_COLUMN = "n"
+  MEAN_COLUMN = "mean"
+  VARIANCE_COLUMN = "variance"
+  TOTAL_COLUMN = "total"
+  TOTAL_SQ_COLUMN = "total_sq"
+
 
   def __init__(
       self, api_key, aws_access_key, aws_secret_key, s3_region,
       s3_bucket_id, project_name, dash_name, exp_id,
-      start_date=None, end_date=None
+      start_date=None, end_date=None, compress_ttables=False,
+      upload_concurrency=10, stats_store=None, aggregated_ttables=False,
+      s3_transfer=None, **dashboard_options
   ):
     super(StatisticalDashboard, self).__init__(
         api_key,
@@ -35,12 +59,25 @@ class StatisticalDashboard(ExperimentDashboard):
         dash_name,
         exp_id,
         start_date,
-        end_date)
+        end_date,
+        **dashboard_options)
 
     self._ttables = {}
     self._s3_bucket = s3_bucket_id
-    self._transfer = create_boto_transfer(
-      aws_access_key, aws_secret_key, s3_region)
+    self._compress_ttables = compress_ttables
+    self._stats_store = stats_store
+    self._aggregated_ttables = aggregated_ttables
+    self._transfer_args = (
+        aws_access_key, aws_secret_key, s3_region, upload_concurrency)
+    self._s3_transfer = s3_transfer
+
+  @property
+  def _transfer(self):
+    # The S3 client is only built once a T-Table is uploaded, unless a
+    # transfer was passed in.
+    if self._s3_transfer is None:
+      self._s3_transfer = create_boto_transfer(*self._transfer_args)
+    return self._s3_transfer
 
   def _copy_ttable_tempalte(self):
     template_copy = self.TTABLE_TEMPLATE.copy()
@@ -49,59 +86,67 @@ class StatisticalDashboard(ExperimentDashboard):
 
   def _compute_pooled_stddev(self, control_std, exp_std,
                              control_vals, exp_vals):
+    return float(pooled_stddev(
+        len(control_vals), control_std, len(exp_vals), exp_std))
+
+  def _ttest_results(self, control_summary, exp_summaries):
+    # Summaries are (count, mean, stddev) tuples. All the experiment
+    # variants are tested against the control in one vectorized pass.
+    control_n, control_mean, control_std = control_summary
+    exp_n, exp_mean, exp_std = zip(*exp_summaries)
+
+    batch = ttest_and_power(
+        control_n, control_mean, control_std,
+        exp_n, exp_mean, exp_std, self.ALPHA_ERROR)
+
+    results = []
+    for i in range(len(exp_summaries)):
+      p_val = ""
+      if not math.isnan(batch["p_val"][i]):
+        p_val = float(batch["p_val"][i])
+
+      mean_diff = float(batch["mean_diff"][i])
+
+      if p_val != "" and p_val <= self.ALPHA_ERROR and mean_diff < 0:
+        significance = "Negative"
+      elif p_val != "" and p_val <= self.ALPHA_ERROR and mean_diff > 0:
+        significance = "Positive"
+      else:
+        significance = "Neutral"
+
+      results.append({
+          "power": float(batch["power"][i]),
+          "p_val": p_val,
+          "control_mean": float(batch["control_mean"][i]),
+          "mean_diff": mean_diff,
+          "percent_diff": float(batch["percent_diff"][i]),
+          "significance": significance,
+      })
 
-    control_len_sub_1 = len(control_vals) - 1
-    exp_len_sub_1 = len(exp_vals) - 1
-
-    pooled_stddev_num = (pow(control_std, 2) * control_len_sub_1 +
-                         pow(exp_std, 2) * exp_len_sub_1)
-    pooled_stddev_denom = control_len_sub_1 + exp_len_sub_1
-
-    pooled_stddev = math.sqrt(pooled_stddev_num / float(pooled_stddev_denom))
-    return pooled_stddev
+    return results
 
   def _power_and_ttest(self, control_vals, exp_vals):
-    control_mean = statistics.mean(control_vals)
-    control_std = statistics.stdev(control_vals)
-    exp_mean = statistics.mean(exp_vals)
-    exp_std = statistics.stdev(exp_vals)
-
-    pooled_stddev = self._compute_pooled_stddev(
-        control_std, exp_std, control_vals, exp_vals)
-
-    power = 0
-    percent_diff = None
-    if control_mean != 0 and pooled_stddev != 0:
-      percent_diff = (control_mean - exp_mean) / float(control_mean)
-      effect_size = (abs(percent_diff) * float(control_mean)) / float(pooled_stddev)
-      power = smp.TTestIndPower().solve_power(
-          effect_size,
-          nobs1=len(control_vals),
-          ratio=len(exp_vals) / float(len(control_vals)),
-          alpha=self.ALPHA_ERROR, alternative='two-sided')
-
-    ttest_result = stats.ttest_ind(control_vals, exp_vals, equal_var=False)
-    p_val = ""
-    if len(ttest_result) >= 2 and not math.isnan(ttest_result[1]):
-      p_val = ttest_result[1]
-
-    mean_diff = exp_mean - control_mean
-
-    if p_val <= self.ALPHA_ERROR and mean_diff < 0:
-      significance = "Negative"
-    elif p_val <= self.ALPHA_ERROR and mean_diff > 0:
-      significance = "Positive"
-    else:
-      significance = "Neutral"
+    return self._ttest_results(
+        summarize(control_vals), [summarize(exp_vals)])[0]
+
+  def _accumulate_variant_stats(self, rows, column_name):
+    # One pass over the rows, keeping O(variants) state. Returns None when a
+    # row isn't labelled with its variant type.
+    control_stats = RunningStats()
+    exp_stats = OrderedDict()
+    for row in rows:
+      if "type" not in row:
+        return None
+
+      if row["type"].lower().find("control") != -1:
+        control_stats.push(row[column_name])
+      else:
+        if row["type"] not in exp_stats:
+          exp_stats[row["type"]] = RunningStats()
 
-    return {
-        "power": power,
-        "p_val": p_val,
-        "control_mean": control_mean,
-        "mean_diff": mean_diff,
-        "percent_diff": 0 if percent_diff is None else percent_diff * -100,
-        "significance": significance,
-    }
+        exp_stats[row["type"]].push(row[column_name])
+
+    return control_stats, exp_stats
 
   def _get_ttable_data_for_query(self, label, query_string,
                                  column_name, data_source_id):
@@ -110,75 +155,256 @@ class StatisticalDashboard(ExperimentDashboard):
     if data is None or len(data) <= 3 or (column_name not in data[0]):
       return []
 
-    control_vals = []
-    exp_vals = {}
-    for row in data:
-      if "type" in row and row["type"].lower().find("control") != -1:
-        control_vals.append(row[column_name])
-      elif "type" in row:
-        if row["type"] not in exp_vals:
-          exp_vals[row["type"]] = []
+    variant_stats = self._accumulate_variant_stats(data, column_name)
+    if variant_stats is None:
+      return []
 
-        exp_vals[row["type"]].append(row[column_name])
-      else:
-        return []
+    control_stats, exp_stats = variant_stats
+    return self._get_ttable_rows(
+        label,
+        control_stats.summary(),
+        OrderedDict(
+            (variant, exp_stats[variant].summary()) for variant in exp_stats))
+
+  @traced("stats")
+  def _get_ttable_rows(self, label, control_summary, exp_summaries):
+    # A sample needs at least two values to have a standard deviation.
+    variants = [
+        variant for variant in exp_summaries
+        if exp_summaries[variant][0] > 1]
+    if control_summary[0] < 2 or len(variants) == 0:
+      return []
+
+    results = self._ttest_results(
+        control_summary,
+        [exp_summaries[variant] for variant in variants])
 
     ttable_results = []
-    for variant in exp_vals:
-      results = self._power_and_ttest(control_vals, exp_vals[variant])
+    for variant, result in zip(variants, results):
       ttable_results.append({
           "Metric": "[control vs. {variant}] {metric}".format(variant=variant, metric=label),
           "Alpha Error": self.ALPHA_ERROR,
-          "Power": results["power"],
-          "Two-Tailed P-value (ttest)": results["p_val"],
-          "Control Mean": results["control_mean"],
-          "Experiment Mean - Control Mean": results["mean_diff"],
-          "Percent Difference in Means": results["percent_diff"],
-          "Significance": results["significance"]
+          "Power": result["power"],
+          "Two-Tailed P-value (ttest)": result["p_val"],
+          "Control Mean": result["control_mean"],
+          "Experiment Mean - Control Mean": result["mean_diff"],
+          "Percent Difference in Means": result["percent_diff"],
+          "Significance": result["significance"]
       })
     return ttable_results
 
-  def _apply_ttable_event_template(self, template, chart_data, events_list,
-                                   events_table, title):
+  def get_ttable_rows_from_summaries(self, label, summaries):
+    # T-Table rows from pre-aggregated inputs. `summaries` maps each variant
+    # to its (count, mean, stddev), every variant whose name contains
+    # "control" is merged into the control.
+    control_sums = [0, 0.0, 0.0]
+    exp_summaries = OrderedDict()
+    for variant, summary in summaries.items():
+      if variant.lower().find("control") != -1:
+        for i, value in enumerate(sums_from_summary(*summary)):
+          control_sums[i] += value
+      else:
+        exp_summaries[variant] = tuple(summary)
+
+    if control_sums[0] == 0:
+      return []
 
-    if title not in self._ttables:
-      self._ttables[title] = self._copy_ttable_tempalte()
+    return self._get_ttable_rows(
+        label, summary_from_sums(*control_sums), exp_summaries)
 
-    self._params["events_table"] = events_table
-    for event in events_list:
-      event_data = self._get_event_title_description(template, event)
-      options = self._create_options()
+  def _get_row_summary(self, row):
+    n = row[self.COUNT_COLUMN]
+    if self.MEAN_COLUMN in row:
+      return summary_from_variance(
+          n, row[self.MEAN_COLUMN], row.get(self.VARIANCE_COLUMN, None))
 
-      adjusted_string = template["query"].replace(
-          "{{{", "{").replace("}}}", "}")
-      query_string = adjusted_string.format(**self._params)
+    return summary_from_sums(
+        n, row[self.TOTAL_COLUMN], row[self.TOTAL_SQ_COLUMN])
+
+  def _get_aggregated_ttable_data(self, label, query_string,
+                                  data_source_id):
+    data = self._get_query_results(query_string, data_source_id, label)
+
+    if not data:
+      return []
+
+    summaries = OrderedDict()
+    for row in data:
+      if ("type" not in row or not row.get(self.COUNT_COLUMN, None) or
+         (self.MEAN_COLUMN not in row and self.TOTAL_COLUMN not in row)):
+        self._logger.info((
+            "StatisticalDashboard: Query '{name}' is not aggregated by "
+            "variant type.").format(name=label))
+        return []
 
-      self._update_query(
-          template["id"],
-          template["name"],
-          template["query"],
+      summaries[row["type"]] = self._get_row_summary(row)
+
+    return self.get_ttable_rows_from_summaries(label, summaries)
+
+  def _accumulate_daily_sums(self, rows, column_name):
+    # Maps each (day, variant) to its [count, sum, sum of squares]. Returns
+    # None when a row isn't labelled with its variant type and day.
+    daily_sums = OrderedDict()
+    for row in rows:
+      if "type" not in row or self.DATE_COLUMN not in row:
+        return None
+
+      value = row[column_name]
+      key = (str(row[self.DATE_COLUMN])[:10], row["type"])
+      sums = daily_sums.setdefault(key, [0, 0.0, 0.0])
+      sums[0] += 1
+      sums[1] += value
+      sums[2] += value * value
+
+    return daily_sums
+
+  def _get_stats_key(self, template, params):
+    # Stored days only add up while the query computing them is the same,
+    # so they're kept under the template's query rendered with every
+    # parameter except the end date, which moves on every run. Editing the
+    # template or changing the events table or start date starts over.
+    query_params = dict(params)
+    query_params["end_date"] = ""
+    query_string = self._render_template(template, query_params)
+    return "{id}:{digest}".format(
+        id=template["id"],
+        digest=hashlib.sha1(query_string.encode("utf-8")).hexdigest())
+
+  def _get_incremental_ttable_data(self, template, label, params,
+                                   column_name):
+    # Only the days after the last stored one are queried, the rest come
+    # from the stats store.
+    stats_key = self._get_stats_key(template, params)
+    checkpoint = self._stats_store.get_checkpoint(
+        self._experiment_id, stats_key, label)
+
+    query_params = params
+    if checkpoint is not None:
+      query_params = dict(params)
+      query_params["start_date"] = (
+          parse(checkpoint) + timedelta(days=1)).strftime("%Y-%m-%d")
+
+    daily_sums = OrderedDict()
+    if checkpoint is None or query_params["start_date"] <= self._end_date:
+      data = self._get_query_results(
+          self._render_template(template, query_params),
           template["data_source_id"],
-          event_data["description"],
-          options
-      )
+          label)
+
+      if data and column_name in data[0]:
+        daily_sums = self._accumulate_daily_sums(data, column_name)
 
+      if daily_sums is None:
+        self._logger.info((
+            "StatisticalDashboard: Query '{name}' has no {column} column "
+            "and will be computed in full.").format(
+                name=label, column=self.DATE_COLUMN))
+        return self._get_ttable_data_for_query(
+            label,
+            self._render_template(template, params),
+            column_name,
+            template["data_source_id"])
+
+    # Today's numbers may still change, so only earlier days are stored.
+    today = time.strftime("%Y-%m-%d")
+    self._stats_store.save_days(
+        self._experiment_id, stats_key, label,
+        OrderedDict(
+            (key, sums) for key, sums in daily_sums.items()
+            if key[0] < today))
+
+    totals = OrderedDict(
+        (variant, list(sums)) for variant, sums in
+        self._stats_store.get_totals(
+            self._experiment_id, stats_key, label).items())
+    for (day, variant), sums in daily_sums.items():
+      if day >= today:
+        variant_totals = totals.setdefault(variant, [0, 0.0, 0.0])
+        for i in range(3):
+          variant_totals[i] += sums[i]
+
+    return self.get_ttable_rows_from_summaries(
+        label,
+        OrderedDict(
+            (variant, summary_from_sums(*sums))
+            for variant, sums in totals.items()))
+
+  def _apply_ttable_event_template(self, template, chart_data, params,
+                                   event, title):
+    event_data = self._get_event_title_description(template, event)
+
+    if self._aggregated_ttables:
+      ttable_rows = self._get_aggregated_ttable_data(
+          event_data["title"],
+          self._render_template(template, params),
+          template["data_source_id"])
+    elif self._stats_store is not None:
+      ttable_rows = self._get_incremental_ttable_data(
+          template, event_data["title"], params, "count")
+    else:
       ttable_rows = self._get_ttable_data_for_query(
           event_data["title"],
-          query_string,
+          self._render_template(template, params),
           "count",
           template["data_source_id"])
 
-      if len(ttable_rows) == 0:
-        self._logger.info((
-            "StatisticalDashboard: "
-            "Query '{name}' has no relevant data and will not be "
-            "included in T-Table.".format(name=event_data["title"])))
-        continue
+    return {
+        "title": title,
+        "template": template,
+        "event_data": event_data,
+        "options": self._create_options(params),
+        "rows": ttable_rows,
+    }
+
+  def _commit_ttable_rows(self, staged_rows):
+    template = staged_rows["template"]
+    event_data = staged_rows["event_data"]
+    title = staged_rows["title"]
+
+    # The template is updated in commit order so it is left with the
+    # parameters of the last event, however the rows were computed.
+    self._update_query(
+        template["id"],
+        template["name"],
+        template["query"],
+        template["data_source_id"],
+        event_data["description"],
+        staged_rows["options"]
+    )
+
+    if len(staged_rows["rows"]) == 0:
+      self._logger.info((
+          "StatisticalDashboard: "
+          "Query '{name}' has no relevant data and will not be "
+          "included in T-Table.".format(name=event_data["title"])))
+      return
+
+    self._ttables[title]["rows"] = (
+        self._ttables[title]["rows"] + staged_rows["rows"])
 
-      self._ttables[title]["rows"] = self._ttables[title]["rows"] + ttable_rows
+  def plan_ttable_data(self, template_keyword, title, events_list=None,
+                       events_table=None):
+    # What add_ttable_data would do, for apply_plan.
+    # Only event templates are used for T-Tables.
+    units = self._plan_units(
+        template_keyword, events_list, events_table,
+        lambda unit, chart_data:
+            "execute" if unit["event"] is not None else "unchanged")
+    return self._get_plan("ttable", template_keyword, units, title)
+
+  def _get_plan_functions(self, plan):
+    if plan["kind"] != "ttable":
+      return super(StatisticalDashboard, self)._get_plan_functions(plan)
+
+    if plan["title"] not in self._ttables:
+      self._ttables[plan["title"]] = self._copy_ttable_tempalte()
+
+    return (self._apply_ttable_event_template, None, plan["title"],
+            self._commit_ttable_rows)
 
   def add_ttable_data(self, template_keyword, title,
-                      events_list=None, events_table=None):
+                      events_list=None, events_table=None,
+                      max_workers=None):
     self._logger.info((
         "StatisticalDashboard: Adding data for "
         "{keyword}").format(keyword=template_keyword))
@@ -187,6 +413,9 @@ class StatisticalDashboard(ExperimentDashboard):
       events_list = self.DEFAULT_EVENTS
       events_table = self._events_table
 
+    if title not in self._ttables:
+      self._ttables[title] = self._copy_ttable_tempalte()
+
     # Create the t-table
     self._apply_functions_to_templates(
         template_keyword,
@@ -194,8 +423,11 @@ class StatisticalDashboard(ExperimentDashboard):
         events_table,
         self._apply_ttable_event_template,
         None,
-        title)
+        title,
+        commit_function=self._commit_ttable_rows,
+        max_workers=max_workers)
 
+  @traced("add_ttable")
   def add_ttable(self, title):
     if title not in self._ttables or len(self._ttables[title]["rows"]) < 1:
       self._logger.info((
@@ -234,13 +466,16 @@ class StatisticalDashboard(ExperimentDashboard):
       widget_id = chart_data[title]["widget_id"]
       self.remove_graph_from_dashboard(widget_id, query_id)
 
-    query_string = upload_as_json(
-        "experiments",
-        FILENAME,
-        self._transfer,
-        self._s3_bucket,
-        self._ttables[title],
-    )
+    with self._span("upload", title=title):
+      query_string = upload_as_json(
+          "experiments",
+          FILENAME,
+          self._transfer,
+          self._s3_bucket,
+          self._ttables[title],
+          self._compress_ttables,
+          self._metrics,
+      )
     query_id, table_id = self._create_new_query(
         title,
         query_string,
@@ -248,3 +483,12 @@ class StatisticalDashboard(ExperimentDashboard):
         self.TTABLE_DESCRIPTION,
     )
     self._add_visualization_to_dashboard(table_id, VizWidth.WIDE)
+    self._index_graph(title, query_id, query_string)
+
+    # The T-Table URL is reused between runs, so keep the cached copy in
+    # step with what was just uploaded.
+    if self._result_cache is not None:
+      self._result_cache.set(
+          query_string,
+          self.URL_FETCHER_DATA_SOURCE_ID,
+          self._ttables[title]["rows"])
@@ -0,0 +1,52 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class SufficientStatsStore(object):
+  # Per-day, per-variant sufficient statistics (count, sum and sum of
+  # squares) of a T-Table metric, keyed by experiment and template, kept in
+  # a SQLite file. Days that are stored never need to be queried again.
+
+  def __init__(self, path):
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(path, check_same_thread=False)
+    self._db.execute(
+        "CREATE TABLE IF NOT EXISTS daily_stats ("
+        "experiment_id TEXT, template TEXT, metric TEXT, day TEXT, "
+        "variant TEXT, n INTEGER, total REAL, total_sq REAL, "
+        "PRIMARY KEY (experiment_id, template, metric, day, variant))")
+    self._db.commit()
+
+  def get_checkpoint(self, experiment_id, template, metric):
+    # The last day stored, as YYYY-MM-DD, or None.
+    with self._lock:
+      row = self._db.execute(
+          "SELECT MAX(day) FROM daily_stats "
+          "WHERE experiment_id = ? AND template = ? AND metric = ?",
+          (experiment_id, str(template), metric)).fetchone()
+    return row[0]
+
+  def save_days(self, experiment_id, template, metric, daily_stats):
+    # `daily_stats` maps (day, variant) to (n, total, total_sq).
+    rows = [
+        (experiment_id, str(template), metric, day, variant) + tuple(sums)
+        for (day, variant), sums in daily_stats.items()]
+
+    with self._lock:
+      self._db.executemany(
+          "INSERT OR REPLACE INTO daily_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+          rows)
+      self._db.commit()
+
+  def get_totals(self, experiment_id, template, metric):
+    # Maps each variant to its (n, total, total_sq) over every stored day.
+    with self._lock:
+      rows = self._db.execute(
+          "SELECT variant, SUM(n), SUM(total), SUM(total_sq) "
+          "FROM daily_stats "
+          "WHERE experiment_id = ? AND template = ? AND metric = ? "
+          "GROUP BY variant ORDER BY MIN(rowid)",
+          (experiment_id, str(template), metric)).fetchall()
+
+    return OrderedDict((row[0], tuple(row[1:])) for row in rows)
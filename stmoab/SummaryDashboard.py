@@ -1,31 +1,132 @@
+import json
+import requests
+import threading
+from datetime import datetime
+
+from dateutil.tz import tzutc
 from dateutil.parser import parse
 
+# Taking into account different versions of Python
+try:  # pragma: no cover
+  from urllib import urlencode
+  from urlparse import urljoin
+except ImportError:  # pragma: no cover
+  from urllib.parse import urlencode, urljoin
+
 from redash_client.client import RedashClient
 from redash_client.constants import (
     VizWidth, VizType, ChartType, TimeInterval)
 
+from stmoab.utils import imap_concurrently
+from stmoab.Metrics import timed
+from stmoab.Tracer import traced, NO_SPAN
+from stmoab.SQLTemplate import SQLTemplate
+from stmoab.SessionRedashClient import SessionRedashClient
+
 
 class SummaryDashboard(object):
 
   class ExternalAPIError(Exception):
     pass
 
-  def __init__(self, api_key, dash_name):
-    self._dash_name = dash_name
+  class BulkOperationError(ExternalAPIError):
 
-    try:
-      self.redash = RedashClient(api_key)
+    def __init__(self, message, report):
+      super(SummaryDashboard.BulkOperationError, self).__init__(
+          message, report)
+      self.report = report
 
-      dash_info = self.redash.create_new_dashboard(self._dash_name)
-      self._dash_id = dash_info["dashboard_id"]
-      self.slug_url = dash_info["slug_url"]
+  # Widget index fields returned by get_query_ids_and_names(). Entries also
+  # keep the widget's visualization so graphs can be updated in place.
+  GRAPH_FIELDS = ["query_id", "widget_id", "query", "updated_at"]
 
-      self.redash.publish_dashboard(self._dash_id)
-      self.public_url = self.redash.get_public_url(self._dash_id)
+  def __init__(self, api_key, dash_name, dash_slug=None, dash_id=None,
+               lazy_public_url=False, result_cache=None, rate_limiter=None,
+               metrics=None, tracer=None, session=None):
+    self._dash_name = dash_name
+    self._metrics = metrics
+    self._tracer = tracer
+    self._result_cache = result_cache
+    self._public_url = None
+    self._widget_index = None
+    self._widget_index_lock = threading.Lock()
+
+    try:
+      # With a requests session every Redash call reuses its connections.
+      if session is not None:
+        self.redash = SessionRedashClient(api_key, session)
+      else:
+        self.redash = RedashClient(api_key)
+      if rate_limiter is not None:
+        rate_limiter.install(self.redash)
+      if metrics is not None:
+        metrics.install(self.redash)
+
+      if dash_slug is not None or dash_id is not None:
+        self._attach_to_dashboard(dash_slug or dash_id)
+      else:
+        dash_info = self.redash.create_new_dashboard(self._dash_name)
+        self._dash_id = dash_info["dashboard_id"]
+        self._dash_slug = dash_info.get("dashboard_slug", None)
+        self.slug_url = dash_info["slug_url"]
+
+        self.redash.publish_dashboard(self._dash_id)
+
+      if not lazy_public_url and self._public_url is None:
+        self._public_url = self.redash.get_public_url(self._dash_id)
     except self.redash.RedashClientException as e:
       raise self.ExternalAPIError(
           "Unable to create new dashboard: {error}".format(error=e), e)
 
+  @timed("attach_to_dashboard")
+  def _attach_to_dashboard(self, dash_slug_or_id):
+    # redash_client can only look a dashboard up by creating it, so the
+    # existing dashboard is fetched directly.
+    url_path = "dashboards/{dash}?{params}".format(
+        dash=dash_slug_or_id,
+        params=urlencode({"api_key": self.redash._api_key}))
+    dash_info, response = self.redash._make_request(
+        requests.get, urljoin(self.redash.API_BASE_URL, url_path))
+
+    self._dash_id = dash_info.get("id", None)
+    self._dash_slug = dash_info.get("slug", None)
+    self._dash_name = dash_info.get("name", None) or self._dash_name
+    self.slug_url = urljoin(
+        self.redash.BASE_URL, "dashboard/{slug}".format(slug=self._dash_slug))
+    self._public_url = dash_info.get("public_url", None)
+    self._load_widget_index(dash_info.get("widgets", []))
+
+    if dash_info.get("is_draft", True):
+      self.redash.publish_dashboard(self._dash_id)
+
+  def _count_event(self, name):
+    if self._metrics is not None:
+      self._metrics.increment(name)
+
+  def _span(self, name, parent=None, **attributes):
+    if self._tracer is None:
+      return NO_SPAN
+    return self._tracer.span(name, parent, **attributes)
+
+  def _annotate_span(self, **attributes):
+    # Adds attributes to the span open on this thread, if any.
+    if self._tracer is not None and self._tracer.current_span() is not None:
+      self._tracer.current_span().attributes.update(attributes)
+
+  @property
+  def public_url(self):
+    if self._public_url is None:
+      try:
+        self._public_url = self.redash.get_public_url(self._dash_id)
+      except self.redash.RedashClientException as e:
+        raise self.ExternalAPIError(
+            "Unable to get public URL for dashboard '{title}': {error}".format(
+                title=self._dash_name, error=e), e)
+
+    return self._public_url
+
+  @timed("create_new_query")
+  @traced("create_query")
   def _create_new_query(self, query_title, query_string,
                         data_source, description=""):
     try:
@@ -37,6 +138,7 @@ class SummaryDashboard(object):
           "Unable to create query titled '{title}': {error}".format(
               title=query_title, error=e))
 
+  @timed("add_visualization_to_dashboard")
   def _add_visualization_to_dashboard(self, viz_id, visualization_width):
     try:
       self.redash.add_visualization_to_dashboard(
@@ -47,16 +149,67 @@ class SummaryDashboard(object):
            "dashboard '{title}': {error}").format(
               id=viz_id, title=self._dash_name, error=e))
 
+  @timed("get_query_results")
+  @traced("query")
   def _get_query_results(self, query_string, data_source_id, query_name=""):
+    self._annotate_span(name=query_name, data_source_id=data_source_id)
+
+    if self._result_cache is not None:
+      data = self._result_cache.get(query_string, data_source_id)
+      self._count_event(
+          "result_cache_hits" if data is not None else "result_cache_misses")
+      if data is not None:
+        self._annotate_span(cached=True, rows=len(data))
+        return data
+
     try:
       data = self.redash.get_query_results(
           query_string, data_source_id)
-      return data
     except self.redash.RedashClientException as e:
       raise self.ExternalAPIError(
         "Unable to fetch query results: '{query_name}' "
         " {error}".format(query_name=query_name, error=e))
 
+    # Empty results usually mean the query is still running, so they
+    # aren't worth keeping.
+    if self._result_cache is not None and data:
+      self._result_cache.set(query_string, data_source_id, data)
+
+    self._annotate_span(cached=False, rows=len(data or []))
+    return data
+
+  @timed("check_query_results")
+  def _check_query_results(self, query_string, data_source_id,
+                           query_name=""):
+    # Unlike redash_client's get_query_results, this asks Redash once and
+    # doesn't wait out a query that's still running, so a poller isn't
+    # held up by it. Returns no rows until the results are ready.
+    if self._result_cache is not None:
+      data = self._result_cache.get(query_string, data_source_id)
+      if data is not None:
+        return data
+
+    url_path = "query_results?{params}".format(
+        params=urlencode({"api_key": self.redash._api_key}))
+    try:
+      json_result, response = self.redash._make_request(
+          requests.post, urljoin(self.redash.API_BASE_URL, url_path),
+          json.dumps({
+              "query": query_string,
+              "data_source_id": data_source_id,
+          }))
+    except self.redash.RedashClientException as e:
+      raise self.ExternalAPIError(
+          "Unable to fetch query results: '{query_name}' "
+          " {error}".format(query_name=query_name, error=e))
+
+    data = json_result.get(
+        "query_result", {}).get("data", {}).get("rows", [])
+    if self._result_cache is not None and data:
+      self._result_cache.set(query_string, data_source_id, data)
+    return data
+
+  @timed("create_new_visualization")
   def _create_new_visualization(
       self,
       query_id,
@@ -87,6 +240,7 @@ class SummaryDashboard(object):
           "Unable to create visualization titled '{title}': {error}".format(
               title=visualization_name, error=e))
 
+  @timed("get_widgets_from_dash")
   def _get_widgets_from_dash(self, dash_name):
     try:
       return self.redash.get_widget_from_dash(dash_name)
@@ -94,6 +248,8 @@ class SummaryDashboard(object):
       raise self.ExternalAPIError(
           "Unable to access dashboard widgets: {error}".format(error=e), e)
 
+  @timed("update_query")
+  @traced("update_query")
   def _update_query(self, query_id, query_title, sql,
                     data_source_id, description="", options=""):
     try:
@@ -110,22 +266,70 @@ class SummaryDashboard(object):
           "Unable to update query {title}: {error}".format(
               title=query_title, error=e))
 
-  def update_refresh_schedule(self, seconds_to_refresh):
-    widgets = self._get_widgets_from_dash(self._dash_name)
+  @timed("update_query_schedule")
+  def _update_query_schedule(self, query_id, seconds_to_refresh):
+    try:
+      self.redash.update_query_schedule(query_id, seconds_to_refresh)
+    except self.redash.RedashClientException as e:
+      raise self.ExternalAPIError(
+        "Unable to update schedule for query {query_id}: {error}".format(
+            query_id=query_id, error=e))
 
+  def _get_scheduled_query_ids(self, widgets):
+    # Several widgets can show the same query, it only needs scheduling once.
+    query_ids = []
+    seen = set()
     for widget in widgets:
-      widget_id = widget.get(
+      query_id = widget.get(
           "visualization", {}).get("query", {}).get("id", None)
 
-      if not widget_id:
-        continue
+      if query_id and query_id not in seen:
+        seen.add(query_id)
+        query_ids.append(query_id)
 
-      try:
-        self.redash.update_query_schedule(widget_id, seconds_to_refresh)
-      except self.redash.RedashClientException as e:
-        raise self.ExternalAPIError(
-          "Unable to update schedule for widget {widget_id}: {error}".format(
-              widget_id=widget_id, error=e))
+    return query_ids
+
+  def update_refresh_schedule(self, seconds_to_refresh, max_workers=None,
+                              raise_on_error=True):
+    widgets = self._get_widgets_from_dash(self._dash_slug or self._dash_name)
+    query_ids = self._get_scheduled_query_ids(widgets)
+
+    def update_schedule(query_id):
+      self._update_query_schedule(query_id, seconds_to_refresh)
+
+    # Every query is attempted even when some of them fail.
+    results = imap_concurrently(update_schedule, query_ids, max_workers)
+    errors = [error for result, error in results]
+
+    return self._get_schedule_report(query_ids, errors, raise_on_error)
+
+  def _get_bulk_report(self, items, errors, succeeded_key, item_key,
+                       error_message, raise_on_error):
+    report = {
+        succeeded_key: [],
+        "failed": []
+    }
+    for item, error in zip(items, errors):
+      if error is None:
+        report[succeeded_key].append(item)
+      else:
+        report["failed"].append({item_key: item, "error": error})
+
+    if report["failed"] and raise_on_error:
+      raise self.BulkOperationError(
+          error_message.format(
+              failed=len(report["failed"]), total=len(items),
+              error=report["failed"][0]["error"]),
+          report)
+
+    return report
+
+  def _get_schedule_report(self, query_ids, errors, raise_on_error):
+    return self._get_bulk_report(
+        query_ids, errors, "updated", "query_id",
+        ("Unable to update the refresh schedule of {failed} of {total} "
+         "queries: {error}"),
+        raise_on_error)
 
   def get_update_range(self):
     query_data = self.get_query_ids_and_names()
@@ -140,10 +344,12 @@ class SummaryDashboard(object):
     }
     return update_range
 
-  def get_query_ids_and_names(self):
-    widgets = self._get_widgets_from_dash(self._dash_name)
+  def refresh(self):
+    widgets = self._get_widgets_from_dash(self._dash_slug or self._dash_name)
+    self._load_widget_index(widgets)
 
-    data = {}
+  def _load_widget_index(self, widgets):
+    widget_index = {}
     for widget in widgets:
       widget_id = widget.get("id", None)
 
@@ -159,18 +365,71 @@ class SummaryDashboard(object):
       updated_at = widget.get(
           "visualization", {}).get("query", {}).get("updated_at", None)
 
+      visualization = widget.get("visualization", {})
+
       if not widget_name:
         continue
 
-      data[widget_name] = {
+      widget_index[widget_name] = {
           "query_id": query_id,
           "widget_id": widget_id,
           "query": widget_query,
-          "updated_at": updated_at
+          "updated_at": updated_at,
+          "visualization": {
+              "id": visualization.get("id", None),
+              "type": visualization.get("type", None),
+              "options": visualization.get("options", None),
+          }
       }
 
+    with self._widget_index_lock:
+      self._widget_index = widget_index
+
+  def _index_graph(self, query_title, query_id, query_string,
+                   visualization=None, widget_id=None):
+    # redash_client doesn't return the ID of a new widget. That's fine for
+    # removal since deleting a query archives its widgets along with it.
+    with self._widget_index_lock:
+      if self._widget_index is None:
+        return
+
+      self._widget_index[query_title] = {
+          "query_id": query_id,
+          "widget_id": widget_id,
+          "query": query_string,
+          "updated_at": datetime.now(tzutc()).isoformat(),
+          "visualization": visualization,
+      }
+
+  def _get_graph_visualization(self, query_title):
+    with self._widget_index_lock:
+      entry = (self._widget_index or {}).get(query_title, {})
+      return entry.get("visualization", None)
+
+  def _unindex_graph(self, widget_id, query_id):
+    with self._widget_index_lock:
+      if self._widget_index is None:
+        return
+
+      for name, entry in list(self._widget_index.items()):
+        if ((query_id is not None and entry["query_id"] == query_id) or
+           (widget_id is not None and entry["widget_id"] == widget_id)):
+          del self._widget_index[name]
+
+  def get_query_ids_and_names(self):
+    if self._widget_index is None:
+      self.refresh()
+
+    with self._widget_index_lock:
+      data = {}
+      for name, entry in self._widget_index.items():
+        data[name] = dict(
+            (field, entry[field]) for field in self.GRAPH_FIELDS)
+
     return data
 
+  @timed("remove_graph_from_dashboard")
+  @traced("remove_graph")
   def remove_graph_from_dashboard(self, widget_id, query_id):
     try:
       if widget_id is not None:
@@ -184,27 +443,57 @@ class SummaryDashboard(object):
         "{query_id} from dashboard: {error}".format(
             widget_id=widget_id, query_id=query_id, error=e))
 
-  def remove_all_graphs(self):
-    widgets = self.get_query_ids_and_names()
+    self._unindex_graph(widget_id, query_id)
+
+  def _remove_named_graph(self, graphs, name):
+    self.remove_graph_from_dashboard(
+        graphs[name].get("widget_id", None),
+        graphs[name].get("query_id", None))
+
+  def _get_removal_report(self, names, errors, raise_on_error):
+    return self._get_bulk_report(
+        names, errors, "removed", "name",
+        "Unable to remove {failed} of {total} graphs: {error}",
+        raise_on_error)
+
+  def remove_graphs(self, names=None, max_workers=None, raise_on_error=True):
+    # Removes the named graphs, or every graph, carrying on past failed
+    # removals. Names that aren't on the dashboard are ignored.
+    graphs = self.get_query_ids_and_names()
+    if names is None:
+      names = list(graphs)
+    else:
+      names = [name for name in names if name in graphs]
 
-    for widget_name in widgets:
-      widget = widgets[widget_name]
-      widget_id = widget.get("widget_id", None)
-      query_id = widget.get("query_id", None)
+    def remove_graph(name):
+      self._remove_named_graph(graphs, name)
 
-      self.remove_graph_from_dashboard(widget_id, query_id)
+    results = imap_concurrently(remove_graph, names, max_workers)
+    errors = [error for result, error in results]
+
+    return self._get_removal_report(names, errors, raise_on_error)
+
+  def remove_all_graphs(self, max_workers=None, raise_on_error=True):
+    return self.remove_graphs(
+        max_workers=max_workers, raise_on_error=raise_on_error)
 
   def _populate_sql_string_with_variables(self, template_sql, query_params):
-    adjusted_string = template_sql.replace("{{{", "{").replace("}}}", "}")
-    sql_query = adjusted_string.format(**query_params)
-    return sql_query
+    return SQLTemplate.compile(template_sql).render(query_params)
 
-  def _add_copied_query_to_dashboard(
-      self, template, query_title, query_params, visualization_width,
-      visualization_name="Chart"
+  def _compile_template(self, template):
+    return SQLTemplate.compile(
+        template["query"], template.get("id", None),
+        template.get("version", None))
+
+  def _render_template(self, template, query_params):
+    return self._compile_template(template).render(query_params)
+
+  @timed("create_copied_query")
+  @traced("copy_query")
+  def _create_copied_query(
+      self, template, query_title, query_params, visualization_name="Chart"
   ):
-    query_string = self._populate_sql_string_with_variables(
-        template["query"], query_params)
+    query_string = self._render_template(template, query_params)
 
     query_id, table_id = self._create_new_query(
         query_title, query_string, template["data_source_id"])
@@ -215,16 +504,76 @@ class SummaryDashboard(object):
           template["options"],
           visualization_name,
       )
+      return {
+          "query_id": query_id,
+          "viz_id": viz_id,
+          "title": query_title,
+          "query": query_string,
+          "visualization": {
+              "id": viz_id,
+              "type": template["type"],
+              "options": template["options"],
+          },
+      }
+    except self.redash.RedashClientException as e:
+      raise self.ExternalAPIError(
+        "Unable to add copied query {query_id} to "
+        "dashboard: {error}".format(query_id=query_id, error=e))
+
+  def _update_copied_query(
+      self, template, query_title, query_params, query_id, widget_id,
+      visualization
+  ):
+    # Rewrites and re-runs an existing copy of a template, keeping its
+    # widget and visualization (and so its public URL) as they are.
+    query_string = self._render_template(template, query_params)
+
+    self._update_query(
+        query_id, query_title, query_string, template["data_source_id"])
+
+    return {
+        "query_id": query_id,
+        "viz_id": visualization["id"],
+        "widget_id": widget_id,
+        "title": query_title,
+        "query": query_string,
+        "visualization": visualization,
+        "in_place": True,
+    }
+
+  @timed("attach_copied_query")
+  @traced("widget")
+  def _attach_copied_query(self, copied_query, visualization_width):
+    self._annotate_span(title=copied_query["title"])
+    query_id = copied_query["query_id"]
+    viz_id = copied_query["viz_id"]
+
+    if not copied_query.get("in_place", False):
       self._add_visualization_to_dashboard(viz_id, visualization_width)
 
-      public_url = self.redash.get_visualization_public_url(query_id, viz_id)
+    self._index_graph(
+        copied_query["title"],
+        query_id,
+        copied_query["query"],
+        copied_query["visualization"],
+        copied_query.get("widget_id", None))
 
+    try:
+      public_url = self.redash.get_visualization_public_url(query_id, viz_id)
       return public_url
     except self.redash.RedashClientException as e:
       raise self.ExternalAPIError(
         "Unable to add copied query {query_id} to "
         "dashboard: {error}".format(query_id=query_id, error=e))
 
+  def _add_copied_query_to_dashboard(
+      self, template, query_title, query_params, visualization_width,
+      visualization_name="Chart"
+  ):
+    copied_query = self._create_copied_query(
+        template, query_title, query_params, visualization_name)
+    return self._attach_copied_query(copied_query, visualization_width)
+
   def _template_copy_results_exist(
       self, query_title, template_sql, data_source_id, query_params
   ):
@@ -268,3 +617,4 @@ class SummaryDashboard(object):
         axis_info,
     )
     self._add_visualization_to_dashboard(viz_id, visualization_width)
+    self._index_graph(query_title, query_id, query_string)
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+
+import requests
+
+# Taking into account different versions of Python
+try:  # pragma: no cover
+  from urllib import urlencode
+  from urlparse import urljoin
+except ImportError:  # pragma: no cover
+  from urllib.parse import urlencode, urljoin
+
+
+class TemplateRegistry(object):
+  # A local copy of every query template matching `search_term`, so template
+  # keyword lookups don't each need a server side search. It's refreshed
+  # once it's older than `ttl` seconds, and only templates whose updated_at
+  # changed since are fetched again. With a `path`, it's also kept in a
+  # JSON file so it survives between runs. Keywords the local copy can't
+  # answer are searched for on the server.
+  DEFAULT_SEARCH_TERM = "Template"
+  DEFAULT_TTL = 60 * 60
+  PAGE_SIZE = 250
+
+  def __init__(self, search_term=DEFAULT_SEARCH_TERM, ttl=DEFAULT_TTL,
+               path=None):
+    self._search_term = search_term
+    self._ttl = ttl
+    self._path = path
+    self._lock = threading.Lock()
+    self._templates = {}
+    self._order = []
+    self._fetched_at = None
+    self._logger = logging.getLogger()
+
+    if path is not None and os.path.exists(path):
+      self._load()
+
+  def _load(self):
+    with open(self._path) as registry_file:
+      registry = json.load(registry_file)
+
+    if registry.get("search_term", None) != self._search_term:
+      return
+
+    self._fetched_at = registry["fetched_at"]
+    self._order = registry["order"]
+    self._templates = dict(
+        (template["id"], template) for template in registry["templates"])
+
+  def _save(self):
+    registry = {
+        "search_term": self._search_term,
+        "fetched_at": self._fetched_at,
+        "order": self._order,
+        "templates": list(self._templates.values()),
+    }
+
+    # Written aside and renamed so readers never see a partial file.
+    directory = os.path.dirname(os.path.abspath(self._path))
+    handle, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(handle, "w") as registry_file:
+      json.dump(registry, registry_file)
+    os.rename(temp_path, self._path)
+
+  def is_stale(self):
+    return (self._fetched_at is None or
+            time.time() - self._fetched_at > self._ttl)
+
+  def _get(self, redash, path, params=()):
+    # redash_client has no public calls for listing queries page by page,
+    # so its private request helper is used here and nowhere else.
+    url_path = "{path}?{params}".format(
+        path=path,
+        params=urlencode(list(params) + [("api_key", redash._api_key)]))
+    json_result, response = redash._make_request(
+        requests.get, urljoin(redash.API_BASE_URL, url_path))
+    return json_result
+
+  def _list_queries(self, redash):
+    queries = []
+    page = 1
+    while True:
+      json_result = self._get(redash, "queries", [
+          ("q", self._search_term),
+          ("page", page),
+          ("page_size", self.PAGE_SIZE),
+      ])
+
+      results = json_result.get("results", [])
+      queries.extend(results)
+
+      if not results or len(queries) >= json_result.get("count", 0):
+        return queries
+      page += 1
+
+  def _fetch_template(self, redash, query):
+    visualizations = self._get(
+        redash, "queries/{id}".format(id=query["id"])).get(
+            "visualizations", [])
+    visualization = visualizations[0] if visualizations else {}
+
+    return {
+        "id": query.get("id", None),
+        "description": query.get("description", None),
+        "name": query.get("name", None),
+        "data_source_id": query.get("data_source_id", None),
+        "options": visualization.get("options", None),
+        "type": visualization.get("type", None),
+        "query": query.get("query", None),
+        "updated_at": query.get("updated_at", None),
+        "version": query.get("version", None),
+    }
+
+  def refresh(self, redash):
+    queries = self._list_queries(redash)
+
+    templates = {}
+    for query in queries:
+      template = self._templates.get(query["id"], None)
+      if (template is None or
+         template["updated_at"] != query.get("updated_at", None)):
+        template = self._fetch_template(redash, query)
+      templates[query["id"]] = template
+
+    self._templates = templates
+    self._order = [query["id"] for query in queries]
+    self._fetched_at = time.time()
+
+    if self._path is not None:
+      self._save()
+
+  def search(self, redash, keyword):
+    # Like redash_client's search_queries, but matched locally against
+    # template names and without regard to case. The server searches
+    # descriptions and SQL too, so a keyword outside `search_term` or
+    # without any local match is searched for there.
+    if self._search_term.lower() in keyword.lower():
+      with self._lock:
+        if self.is_stale():
+          self.refresh(redash)
+
+        templates = [
+            dict(self._templates[query_id]) for query_id in self._order
+            if keyword.lower() in (
+                self._templates[query_id]["name"] or "").lower()]
+      if templates:
+        return templates
+
+    self._logger.info((
+        "TemplateRegistry: No cached templates match '{keyword}', "
+        "searching for them on the server.").format(keyword=keyword))
+    return redash.search_queries(keyword)
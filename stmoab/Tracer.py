@@ -0,0 +1,132 @@
+import json
+import time
+import uuid
+import functools
+import threading
+
+
+def traced(name):
+  # Runs a dashboard method in a span named `name` when the dashboard has
+  # a tracer.
+  def decorator(function):
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+      if getattr(self, "_tracer", None) is None:
+        return function(self, *args, **kwargs)
+
+      with self._tracer.span(name):
+        return function(self, *args, **kwargs)
+    return wrapper
+  return decorator
+
+
+class _NoSpan(object):
+  # Stands in for a span when there's no tracer.
+
+  def __enter__(self):
+    return None
+
+  def __exit__(self, *exc_info):
+    return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class JSONLinesExporter(object):
+  # Appends every finished span to a file as one JSON object per line.
+
+  def __init__(self, path):
+    self._path = path
+    self._lock = threading.Lock()
+
+  def export(self, span):
+    line = json.dumps(span, default=str) + "\n"
+    with self._lock:
+      with open(self._path, "a") as trace_file:
+        trace_file.write(line)
+
+
+class Span(object):
+
+  def __init__(self, tracer, name, parent=None, attributes=None):
+    self._tracer = tracer
+    self.name = name
+    self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+    self.span_id = uuid.uuid4().hex[:16]
+    self.parent_id = parent.span_id if parent else None
+    self.attributes = dict(attributes or {})
+    self.start = time.time()
+    self.end_time = None
+    self.error = None
+
+  def set_attribute(self, name, value):
+    self.attributes[name] = value
+
+  def end(self, error=None):
+    if self.end_time is not None:
+      return
+
+    self.end_time = time.time()
+    if error is not None:
+      self.error = "{type}: {error}".format(
+          type=type(error).__name__, error=error)
+    self._tracer._export(self)
+
+  def to_dict(self):
+    return {
+        "trace_id": self.trace_id,
+        "span_id": self.span_id,
+        "parent_id": self.parent_id,
+        "name": self.name,
+        "start": self.start,
+        "end": self.end_time,
+        "duration_seconds": self.end_time - self.start,
+        "status": "ok" if self.error is None else "error",
+        "error": self.error,
+        "attributes": self.attributes,
+    }
+
+
+class Tracer(object):
+  # Nested spans, each exported once it ends. A span's parent is the span
+  # open on the same thread unless one is given, so work handed to another
+  # thread passes its parent along explicitly.
+  DEFAULT_PATH = "stmoab-trace.jsonl"
+
+  def __init__(self, exporter=None):
+    self._exporter = exporter or JSONLinesExporter(self.DEFAULT_PATH)
+    self._local = threading.local()
+
+  def current_span(self):
+    return getattr(self._local, "span", None)
+
+  def start_span(self, name, parent=None, **attributes):
+    # For spans that end on another thread than they start, which aren't
+    # made current. They must be ended explicitly.
+    return Span(self, name, parent or self.current_span(), attributes)
+
+  def span(self, name, parent=None, **attributes):
+    return _ActiveSpan(self, self.start_span(name, parent, **attributes))
+
+  def _export(self, span):
+    self._exporter.export(span.to_dict())
+
+
+class _ActiveSpan(object):
+  # Makes a span current on this thread until it ends.
+
+  def __init__(self, tracer, span):
+    self._tracer = tracer
+    self._span = span
+    self._previous = None
+
+  def __enter__(self):
+    self._previous = self._tracer.current_span()
+    self._tracer._local.span = self._span
+    return self._span
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self._tracer._local.span = self._previous
+    self._span.end(exc_value)
+    return False
@@ -0,0 +1,226 @@
+"""Builds or refreshes the dashboards of many experiments from a manifest.
+
+    python -m stmoab.batch manifest.json --processes 4 --report report.json
+
+The manifest is a JSON object with an "experiments" list and optional
+"defaults" shared by every experiment:
+
+    {
+      "defaults": {"project_name": "Pocket Experiment"},
+      "experiments": [{
+        "exp_id": "pref-flip-activity-stream-...",
+        "dash_name": "Release Sponsored Stories",
+        "start_date": "2018-02-12",
+        "graph_templates": [
+          {"keyword": "UT Experiment Template: Population Size"},
+          {"keyword": "Experiment Template Rate Maps: [New Users]",
+           "events": "MAPPED_UT_EVENTS"}
+        ],
+        "ttables": [{
+          "title": "[New Users] Statistical Analysis (Per Active Hour) - UT",
+          "templates": [{
+            "keyword": "TTests Template Per Hour Maps: [New Users]",
+            "events": "MAPPED_UT_EVENTS"
+          }]
+        }]
+      }]
+    }
+
+Events are either a list or the name of a dashboard event list. Credentials
+come from the same environment variables as dashboard_instances/sample.py.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import traceback
+import multiprocessing
+
+import requests
+
+from stmoab.TemplateRegistry import TemplateRegistry
+from stmoab.SessionRedashClient import SessionRedashClient
+from stmoab.StatisticalDashboard import StatisticalDashboard
+
+CREDENTIAL_VARIABLES = {
+    "api_key": "REDASH_API_KEY",
+    "aws_access_key": "AWS_ACCESS_KEY",
+    "aws_secret_key": "AWS_SECRET_KEY",
+    "s3_region": "S3_REGION",
+    "s3_bucket_id": "S3_BUCKET_ID_STATS",
+}
+
+DASHBOARD_OPTIONS = [
+    "start_date", "end_date", "compress_ttables", "upload_concurrency",
+    "events_table_name", "update_in_place", "defer_pending",
+    "pending_timeout", "dash_slug", "dash_id", "lazy_public_url",
+    "aggregated_ttables",
+]
+
+# Set up once in every worker process by _init_worker.
+_worker = {}
+
+
+def get_credentials(environ=os.environ):
+  return dict(
+      (name, environ[variable])
+      for name, variable in CREDENTIAL_VARIABLES.items())
+
+
+def load_manifest(path):
+  with open(path) as manifest_file:
+    manifest = json.load(manifest_file)
+
+  defaults = manifest.get("defaults", {})
+  experiments = []
+  for experiment in manifest["experiments"]:
+    merged = dict(defaults)
+    merged.update(experiment)
+    experiments.append(merged)
+
+  return experiments
+
+
+def _init_worker(credentials, registry_path, registry_ttl):
+  # All of a worker's Redash calls reuse one connection pool.
+  _worker["session"] = requests.Session()
+  _worker["credentials"] = credentials
+  _worker["template_registry"] = TemplateRegistry(
+      ttl=registry_ttl, path=registry_path)
+
+
+def _get_events(dashboard, events):
+  if events is None:
+    return None
+  if isinstance(events, list):
+    return events
+  return getattr(dashboard, events)
+
+
+def build_dashboard(experiment, credentials, template_registry=None,
+                    session=None):
+  options = dict(
+      (option, experiment[option]) for option in DASHBOARD_OPTIONS
+      if option in experiment)
+
+  dashboard = StatisticalDashboard(
+      credentials["api_key"],
+      credentials["aws_access_key"],
+      credentials["aws_secret_key"],
+      credentials["s3_region"],
+      credentials["s3_bucket_id"],
+      experiment["project_name"],
+      experiment["dash_name"],
+      experiment["exp_id"],
+      template_registry=template_registry,
+      session=session,
+      **options)
+
+  for graph in experiment.get("graph_templates", []):
+    dashboard.add_graph_templates(
+        graph["keyword"],
+        _get_events(dashboard, graph.get("events", None)),
+        graph.get("events_table", None),
+        max_workers=experiment.get("max_workers", None))
+
+  for ttable in experiment.get("ttables", []):
+    for template in ttable["templates"]:
+      dashboard.add_ttable_data(
+          template["keyword"],
+          ttable["title"],
+          _get_events(dashboard, template.get("events", None)),
+          template.get("events_table", None),
+          max_workers=experiment.get("max_workers", None))
+    dashboard.add_ttable(ttable["title"])
+
+  return dashboard
+
+
+def run_experiment(experiment, credentials=None, template_registry=None,
+                   session=None):
+  # Never raises, every experiment gets a report whatever happens to it.
+  credentials = credentials or _worker["credentials"]
+  template_registry = template_registry or _worker.get(
+      "template_registry", None)
+  session = session or _worker.get("session", None)
+
+  started_at = time.time()
+  report = {
+      "exp_id": experiment.get("exp_id", None),
+      "dash_name": experiment.get("dash_name", None),
+  }
+
+  try:
+    dashboard = build_dashboard(
+        experiment, credentials, template_registry, session)
+    report["status"] = "ok"
+    report["public_url"] = dashboard.public_url
+  except Exception as e:
+    report["status"] = "failed"
+    report["error"] = "{type}: {error}".format(
+        type=type(e).__name__, error=e)
+    report["traceback"] = traceback.format_exc()
+
+  report["seconds"] = time.time() - started_at
+  return report
+
+
+def run_batch(experiments, credentials, processes=None,
+              registry_path=None, registry_ttl=TemplateRegistry.DEFAULT_TTL):
+  if registry_path is None:
+    registry_path = os.path.join(
+        tempfile.gettempdir(), "stmoab_templates.json")
+
+  # The registry is refreshed once up front, so workers start from the
+  # same file instead of all listing the templates at once.
+  registry = TemplateRegistry(ttl=registry_ttl, path=registry_path)
+  if registry.is_stale():
+    registry.refresh(SessionRedashClient(credentials["api_key"]))
+
+  pool = multiprocessing.Pool(
+      processes,
+      initializer=_init_worker,
+      initargs=(credentials, registry_path, registry_ttl))
+  try:
+    return pool.map(run_experiment, experiments, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description="Build or refresh the dashboards in a manifest.")
+  parser.add_argument("manifest")
+  parser.add_argument("--processes", type=int, default=None)
+  parser.add_argument("--report", default=None,
+                      help="Write the per-experiment report to this file")
+  parser.add_argument("--template-cache", default=None)
+  parser.add_argument("--template-ttl", type=int,
+                      default=TemplateRegistry.DEFAULT_TTL)
+  args = parser.parse_args(argv)
+
+  reports = run_batch(
+      load_manifest(args.manifest),
+      get_credentials(),
+      args.processes,
+      args.template_cache,
+      args.template_ttl)
+
+  if args.report is not None:
+    with open(args.report, "w") as report_file:
+      json.dump(reports, report_file, indent=2)
+
+  for report in reports:
+    print("{status:<6} {exp_id} {detail}".format(
+        status=report["status"], exp_id=report["exp_id"],
+        detail=report.get("public_url", None) or report.get("error", "")))
+
+  failed = [report for report in reports if report["status"] != "ok"]
+  return 1 if failed else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,187 @@
+"""Drives StatisticalDashboard against a local FakeRedashServer.
+
+    python -m stmoab.loadtest --experiments 4 --latency 0.05 --max-workers 8
+    python -m stmoab.loadtest --error-rate 0.02 --retry --json
+
+Every experiment builds a dashboard with a population graph, a graph per
+event and a T-Table, then refreshes it `--refreshes` times. The report has
+the wall time, the API calls made per endpoint and the most requests the
+server saw in flight at once. T-Tables aren't uploaded to S3, their URL
+is served by the fake server instead.
+"""
+import io
+import sys
+import gzip
+import json
+import time
+import argparse
+import traceback
+
+from stmoab.utils import imap_concurrently, BotoTransfer
+from stmoab.RateLimiter import RateLimiter
+from stmoab.FakeRedashServer import FakeRedashServer
+from stmoab.StatisticalDashboard import StatisticalDashboard
+
+POPULATION_TEMPLATE = "Load Test Template: Population Size"
+GRAPH_TEMPLATE = "Load Test Template Rate: Event Rate"
+TTABLE_TEMPLATE = "Load Test TTests Template: Event Rate"
+TTABLE_TITLE = "Load Test Statistical Analysis"
+
+TEMPLATE_QUERY = (
+    "SELECT date, type, count, event FROM {{{events_table}}} "
+    "WHERE experiment_id = '{{{experiment_id}}}' "
+    "AND date >= '{{{start_date}}}' AND date <= '{{{end_date}}}'")
+EVENT_TEMPLATE_QUERY = TEMPLATE_QUERY + " AND event IN {{{event_string}}}"
+
+DEFAULT_EVENTS = ["CLICK", "SEARCH", "BLOCK", "DELETE"]
+
+
+class FakeS3Client(object):
+  # Serves every uploaded T-Table's rows from the fake server at the URL
+  # upload_as_json returns for it.
+  BASE_URL = "https://analysis-output.telemetry.mozilla.org/"
+
+  def __init__(self, server):
+    self._server = server
+
+  def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None,
+                     Config=None):
+    body = fileobj.read()
+    if (ExtraArgs or {}).get("ContentEncoding") == "gzip":
+      body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+
+    data = json.loads(body.decode("utf-8"))
+    self._server.set_results(self.BASE_URL + key, data["rows"])
+
+
+def add_templates(server):
+  options = {"globalSeriesType": "line"}
+  server.add_template(POPULATION_TEMPLATE, TEMPLATE_QUERY, options=options)
+  server.add_template(GRAPH_TEMPLATE, EVENT_TEMPLATE_QUERY, options=options)
+  server.add_template(TTABLE_TEMPLATE, EVENT_TEMPLATE_QUERY, options=options)
+
+
+def run_experiment(server, index, events, refreshes, max_workers,
+                   dashboard_options):
+  started_at = time.time()
+  report = {"experiment": index, "runs": []}
+
+  try:
+    for run in range(refreshes + 1):
+      run_started_at = time.time()
+      dashboard = StatisticalDashboard(
+          "api_key", "access", "secret", "us-west-2", "bucket",
+          "Load Test", "Experiment {index}".format(index=index),
+          "load-test-experiment-{index}".format(index=index),
+          start_date="2018-01-01",
+          s3_transfer=BotoTransfer(FakeS3Client(server), None),
+          **dashboard_options)
+
+      dashboard.add_graph_templates(
+          POPULATION_TEMPLATE, max_workers=max_workers)
+      dashboard.add_graph_templates(
+          GRAPH_TEMPLATE, events, max_workers=max_workers)
+      dashboard.add_ttable_data(
+          TTABLE_TEMPLATE, TTABLE_TITLE, events, max_workers=max_workers)
+      dashboard.add_ttable(TTABLE_TITLE)
+
+      report["runs"].append(time.time() - run_started_at)
+    report["status"] = "ok"
+  except Exception as e:
+    report["status"] = "failed"
+    report["error"] = "{type}: {error}".format(
+        type=type(e).__name__, error=e)
+    report["traceback"] = traceback.format_exc()
+
+  report["seconds"] = time.time() - started_at
+  return report
+
+
+def run_load_test(server, experiments=1, events=None, refreshes=1,
+                  max_workers=None, parallel_experiments=None,
+                  dashboard_options=None):
+  events = events or DEFAULT_EVENTS
+  dashboard_options = dashboard_options or {}
+
+  server.reset_stats()
+  started_at = time.time()
+
+  results = list(imap_concurrently(
+      lambda index: run_experiment(
+          server, index, events, refreshes, max_workers, dashboard_options),
+      range(experiments),
+      parallel_experiments))
+
+  stats = server.get_stats()
+  stats["wall_seconds"] = time.time() - started_at
+  stats["calls_per_experiment"] = stats["total_calls"] / float(experiments)
+  stats["experiments"] = [result for result, error in results]
+  return stats
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--experiments", type=int, default=1)
+  parser.add_argument("--parallel-experiments", type=int, default=None)
+  parser.add_argument("--refreshes", type=int, default=1)
+  parser.add_argument("--max-workers", type=int, default=None)
+  parser.add_argument("--events", nargs="+", default=DEFAULT_EVENTS)
+  parser.add_argument(
+      "--latency", type=float, default=0.0,
+      help="Seconds every API call takes")
+  parser.add_argument(
+      "--error-rate", type=float, default=0.0,
+      help="Fraction of API calls that fail with a 503")
+  parser.add_argument(
+      "--execution-delay", type=float, default=0.0,
+      help="Seconds before a query has results")
+  parser.add_argument(
+      "--retry", action="store_true",
+      help="Retry failed calls through a RateLimiter")
+  parser.add_argument("--update-in-place", action="store_true")
+  parser.add_argument("--seed", type=int, default=None)
+  parser.add_argument(
+      "--json", action="store_true", help="Print the report as JSON")
+  args = parser.parse_args(argv)
+
+  dashboard_options = {
+      "update_in_place": args.update_in_place,
+      "lazy_public_url": True,
+  }
+  if args.retry:
+    dashboard_options["rate_limiter"] = RateLimiter(rate=1000.0)
+
+  server = FakeRedashServer(
+      latency={"*": args.latency},
+      error_rates={"*": args.error_rate},
+      execution_delay=args.execution_delay,
+      seed=args.seed)
+
+  with server:
+    add_templates(server)
+    report = run_load_test(
+        server, args.experiments, args.events, args.refreshes,
+        args.max_workers, args.parallel_experiments, dashboard_options)
+
+  if args.json:
+    print(json.dumps(report, indent=2))
+  else:
+    print("wall time {wall_seconds:.2f}s, {total_calls} calls "
+          "({calls_per_experiment:.0f} per experiment), {errors} errors, "
+          "max concurrency {max_concurrency}".format(**report))
+    for endpoint, calls in sorted(report["calls"].items()):
+      print("  {endpoint:<22} {calls:>6}".format(
+          endpoint=endpoint, calls=calls))
+    for experiment in report["experiments"]:
+      print(
+          "  experiment {experiment} {status} {seconds:.2f}s "
+          "{detail}".format(detail=experiment.get("error", ""), **experiment))
+
+  failed = [
+      experiment for experiment in report["experiments"]
+      if experiment["status"] != "ok"]
+  return 1 if failed else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,195 @@
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# scipy takes most of a second to import, so it's only loaded once a
+# T-Table is actually computed.
+
+# The least recently used powers are evicted past this many.
+MAX_CACHED_POWERS = 4096
+_power_cache = OrderedDict()
+_power_cache_lock = threading.Lock()
+
+
+class RunningStats(object):
+  # Welford's single pass accumulator for a sample's count, mean and
+  # sum of squared differences from the mean (M2).
+
+  def __init__(self):
+    self.count = 0
+    self.mean = 0.0
+    self.m2 = 0.0
+
+  def push(self, value):
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / float(self.count)
+    self.m2 += delta * (value - self.mean)
+
+  @property
+  def variance(self):
+    if self.count < 2:
+      return float("nan")
+    return self.m2 / (self.count - 1)
+
+  @property
+  def stdev(self):
+    return math.sqrt(self.variance)
+
+  def summary(self):
+    return self.count, self.mean, self.stdev
+
+
+def summarize(values):
+  values = np.asarray(values, dtype=float)
+  return len(values), values.mean(), values.std(ddof=1)
+
+
+def summary_from_sums(n, total, total_sq):
+  # (count, mean, stddev) of a sample from its sufficient statistics.
+  mean = total / float(n)
+  if n < 2:
+    return n, mean, float("nan")
+
+  variance = max(0.0, (total_sq - total * mean) / (n - 1))
+  return n, mean, math.sqrt(variance)
+
+
+def summary_from_variance(n, mean, variance):
+  # (count, mean, stddev) of a sample from its count, mean and variance.
+  if n < 2 or variance is None:
+    return n, mean, float("nan")
+  return n, mean, math.sqrt(max(0.0, variance))
+
+
+def sums_from_summary(n, mean, std):
+  # The inverse of summary_from_sums, so summaries can be merged.
+  variance = std * std if n > 1 else 0.0
+  return n, n * mean, (n - 1) * variance + n * mean * mean
+
+
+def pooled_stddev(control_n, control_std, exp_n, exp_std):
+  control_n = np.asarray(control_n, dtype=float)
+  exp_n = np.asarray(exp_n, dtype=float)
+
+  pooled_num = (np.square(control_std) * (control_n - 1) +
+                np.square(exp_std) * (exp_n - 1))
+  return np.sqrt(pooled_num / (control_n + exp_n - 2))
+
+
+def welch_ttest(control_n, control_mean, control_std,
+                exp_n, exp_mean, exp_std):
+  # Matches scipy.stats.ttest_ind(control, exp, equal_var=False) computed
+  # from each sample's size, mean and standard deviation.
+  from scipy import stats
+
+  control_n = np.asarray(control_n, dtype=float)
+  exp_n = np.asarray(exp_n, dtype=float)
+  control_vn = np.square(control_std) / control_n
+  exp_vn = np.square(exp_std) / exp_n
+
+  with np.errstate(divide="ignore", invalid="ignore"):
+    df = np.square(control_vn + exp_vn) / (
+        np.square(control_vn) / (control_n - 1) +
+        np.square(exp_vn) / (exp_n - 1))
+    df = np.where(np.isnan(df), 1, df)
+
+    t_stat = (np.asarray(control_mean) - exp_mean) / np.sqrt(
+        control_vn + exp_vn)
+    p_val = 2 * stats.t.sf(np.abs(t_stat), df)
+
+  return t_stat, p_val
+
+
+def _noncentral_t_power(effect_size, nobs1, alpha, ratio):
+  # Power of a two-sided, two sample t-test straight from the noncentral t
+  # distribution, as statsmodels' TTestIndPower().power computes it.
+  from scipy import special
+
+  nobs2 = nobs1 * ratio
+  df = nobs1 + nobs2 - 2
+  noncentrality = effect_size * np.sqrt(1.0 / (1.0 / nobs1 + 1.0 / nobs2))
+
+  crit_upp = special.stdtrit(df, 1 - alpha / 2.0)
+  crit_low = -crit_upp
+  return ((1 - special.nctdtr(df, noncentrality, crit_upp)) +
+          special.nctdtr(df, noncentrality, crit_low))
+
+
+def ttest_ind_power(effect_size, nobs1, alpha, ratio=1.0):
+  # Vectorized and memoized on (effect size, nobs1, ratio, alpha), so
+  # metrics seen on a previous run or in another T-Table are free.
+  arrays = np.broadcast_arrays(effect_size, nobs1, ratio)
+  effect_size, nobs1, ratio = [
+      np.atleast_1d(np.asarray(array, dtype=float)) for array in arrays]
+  keys = [
+      (effect_size[i], nobs1[i], ratio[i], alpha)
+      for i in range(len(effect_size))]
+
+  power = np.empty(len(keys))
+  with _power_cache_lock:
+    missing = []
+    for i, key in enumerate(keys):
+      if key in _power_cache:
+        # Moved to the end, as the most recently used.
+        power[i] = _power_cache[key] = _power_cache.pop(key)
+      else:
+        missing.append(i)
+
+  if missing:
+    power[missing] = _noncentral_t_power(
+        effect_size[missing], nobs1[missing], alpha, ratio[missing])
+
+    with _power_cache_lock:
+      for i in missing:
+        _power_cache[keys[i]] = power[i]
+      while len(_power_cache) > MAX_CACHED_POWERS:
+        _power_cache.popitem(last=False)
+
+  return power
+
+
+def ttest_and_power(control_n, control_mean, control_std,
+                    exp_n, exp_mean, exp_std, alpha):
+  # Every argument may be an array with one element per (metric, variant)
+  # pair, all of them are computed in a single vectorized pass.
+  arrays = np.broadcast_arrays(
+      control_n, control_mean, control_std, exp_n, exp_mean, exp_std)
+  control_n, control_mean, control_std, exp_n, exp_mean, exp_std = [
+      np.atleast_1d(np.asarray(array, dtype=float)) for array in arrays]
+
+  pooled = pooled_stddev(control_n, control_std, exp_n, exp_std)
+  t_stat, p_val = welch_ttest(
+      control_n, control_mean, control_std, exp_n, exp_mean, exp_std)
+
+  # Power is only defined where there's a baseline and some spread.
+  has_power = (control_mean != 0) & (pooled != 0)
+  percent_diff = np.zeros(len(control_mean))
+  effect_size = np.zeros(len(control_mean))
+  power = np.zeros(len(control_mean))
+
+  percent_diff[has_power] = (
+      (control_mean[has_power] - exp_mean[has_power]) /
+      control_mean[has_power])
+  effect_size[has_power] = (
+      np.abs(percent_diff[has_power]) * control_mean[has_power] /
+      pooled[has_power])
+
+  if has_power.any():
+    power[has_power] = ttest_ind_power(
+        effect_size[has_power],
+        control_n[has_power],
+        alpha,
+        exp_n[has_power] / control_n[has_power])
+
+  return {
+      "power": power,
+      "p_val": p_val,
+      "control_mean": control_mean,
+      "mean_diff": exp_mean - control_mean,
+      "percent_diff": np.where(has_power, percent_diff * -100, 0.0),
+      "pooled_stddev": pooled,
+      "effect_size": effect_size,
+  }
@@ -0,0 +1,166 @@
+import sys
+import json
+import unittest
+
+from redash_client.constants import VizWidth, ChartType
+
+from stmoab.tests.base import AppTest
+from stmoab.ExperimentDashboard import ExperimentDashboard
+
+if sys.version_info >= (3, 5):
+  import asyncio
+  from stmoab.AsyncSummaryDashboard import AsyncSummaryDashboard
+  from stmoab.AsyncExperimentDashboard import AsyncExperimentDashboard
+
+
+def run(coroutine):
+  loop = asyncio.new_event_loop()
+  try:
+    return loop.run_until_complete(coroutine)
+  finally:
+    loop.close()
+
+
+@unittest.skipIf(sys.version_info < (3, 5), "asyncio is not available")
+class TestAsyncSummaryDashboard(AppTest):
+
+  def test_add_query_to_dashboard_makes_expected_calls(self):
+    async_dash = AsyncSummaryDashboard(self.dash, max_in_flight=4)
+
+    run(async_dash.add_query_to_dashboard(
+        "title",
+        "SELECT * FROM test",
+        5,
+        VizWidth.WIDE,
+        column_mapping={"a": "x", "b": "y"},
+        chart_type=ChartType.BAR
+    ))
+
+    # Same calls as the synchronous dashboard
+    self.assertEqual(self.mock_requests_post.call_count, 5)
+    self.assertEqual(self.mock_requests_get.call_count, 1)
+
+  def test_add_query_to_dashboard_updates_the_widget_index(self):
+    async_dash = AsyncSummaryDashboard(self.dash, max_in_flight=4)
+    self.mock_requests_get.return_value = self.get_mock_response(
+        content=json.dumps({"widgets": []}))
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps({"id": 7}))
+
+    self.assertEqual(run(async_dash.get_query_ids_and_names()), {})
+    run(async_dash.add_query_to_dashboard(
+        "title", "SELECT * FROM test", 5, VizWidth.WIDE,
+        column_mapping={"a": "x", "b": "y"}, chart_type=ChartType.BAR))
+
+    graphs = run(async_dash.get_query_ids_and_names())
+    self.assertEqual(graphs["title"]["query_id"], 7)
+    self.assertEqual(graphs["title"]["query"], "SELECT * FROM test")
+
+  def test_update_refresh_schedule_success(self):
+    WIDGETS_RESPONSE = {
+        "widgets": [
+            {"visualization": {"query": {"id": 1}}},
+            {"visualization": {"query": {"nope": "fail"}}},
+            {"visualization": {"query": {"id": 2}}},
+        ]
+    }
+    self.mock_requests_get.return_value = self.get_mock_response(
+        content=json.dumps(WIDGETS_RESPONSE))
+
+    async_dash = AsyncSummaryDashboard(self.dash)
+    run(async_dash.update_refresh_schedule(86400))
+
+    # 2 posts to create the dashboard and make it public
+    # 2 posts for the two valid query IDs
+    self.assertEqual(self.mock_requests_post.call_count, 4)
+
+  def test_get_query_results_exception_thrown(self):
+    self._setupMockRedashClientException("get_query_results")
+    async_dash = AsyncSummaryDashboard(self.dash)
+
+    self.assertRaises(
+        async_dash.ExternalAPIError,
+        lambda: run(async_dash._get_query_results("a", "b")))
+
+
+@unittest.skipIf(sys.version_info < (3, 5), "asyncio is not available")
+class TestAsyncExperimentDashboard(AppTest):
+
+  def get_dashboard(self, api_key):
+    self.mock_requests_get.return_value = self.get_mock_response(
+        content=json.dumps({"id": "query_id123", "slug": "some_slug"}))
+    self.mock_requests_post.return_value = self.get_mock_response()
+
+    return ExperimentDashboard(
+        self.API_KEY, "Test Experiment", "Screenshots Long Cache",
+        "exp-014-screenshotsasync", "2017-17-02")
+
+  def test_add_templates_makes_correct_calls(self):
+    self.get_calls = 0
+    QUERIES_IN_SEARCH = {
+        "results": [{
+            "id": 5,
+            "description": "SomeQuery",
+            "name": "AS Template: Query Title Event",
+            "query": "SELECT * FROM table",
+            "data_source_id": 5
+        }, {
+            "id": 6,
+            "description": "SomeQuery2",
+            "name": "AS Template: Query Title",
+            "query": "SELECT * FROM table",
+            "data_source_id": 5
+        }]
+    }
+    QUERY_RESULTS_RESPONSE = {
+        "query_result": {
+            "data": {
+                "rows": [{"a": "b"}, {"c": "d"}]
+            }
+        }
+    }
+    VISUALIZATIONS_FOR_QUERY = {
+        "visualizations": [
+            {"options": {}},
+            {"options": {}}
+        ]
+    }
+    WIDGETS_RESPONSE = {
+        "widgets": [{
+            "id": "the_widget_id",
+            "visualization": {
+                "query": {
+                    "id": "some_id",
+                    "name": "Query Title Click"
+                },
+            },
+        }]
+    }
+
+    def get_server(url):
+      if self.get_calls == 0:
+        response = self.get_mock_response(
+            content=json.dumps(QUERIES_IN_SEARCH))
+      elif self.get_calls <= 2:
+        response = self.get_mock_response(
+            content=json.dumps(VISUALIZATIONS_FOR_QUERY))
+      else:
+        response = self.get_mock_response(
+            content=json.dumps(WIDGETS_RESPONSE))
+
+      self.get_calls += 1
+      return response
+
+    self.mock_requests_delete.return_value = self.get_mock_response()
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps(QUERY_RESULTS_RESPONSE))
+    self.mock_requests_get.side_effect = get_server
+
+    async_dash = AsyncExperimentDashboard(self.dash, max_in_flight=4)
+    public_urls = run(async_dash.add_graph_templates("Template:"))
+
+    # Same calls as the synchronous dashboard
+    self.assertEqual(len(public_urls), 1)
+    self.assertEqual(self.mock_requests_post.call_count, 26)
+    self.assertEqual(self.mock_requests_get.call_count, 5)
+    self.assertEqual(self.mock_requests_delete.call_count, 2)
@@ -0,0 +1,148 @@
+import os
+import json
+import mock
+import shutil
+import tempfile
+
+import requests
+
+from stmoab.tests.base import AppTest
+from stmoab import batch, loadtest
+from stmoab.FakeRedashServer import FakeRedashServer
+
+
+class TestBatch(AppTest):
+
+  CREDENTIALS = {
+      "api_key": "test_key",
+      "aws_access_key": "access",
+      "aws_secret_key": "secret",
+      "s3_region": "us-west-2",
+      "s3_bucket_id": "bucket",
+  }
+
+  def test_load_manifest_applies_defaults(self):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    path = os.path.join(temp_dir, "manifest.json")
+    with open(path, "w") as manifest_file:
+      json.dump({
+          "defaults": {"project_name": "Project", "start_date": "2018-01-01"},
+          "experiments": [
+              {"exp_id": "a", "dash_name": "A"},
+              {"exp_id": "b", "dash_name": "B", "start_date": "2018-02-01"},
+          ]
+      }, manifest_file)
+
+    experiments = batch.load_manifest(path)
+
+    self.assertEqual(len(experiments), 2)
+    self.assertEqual(experiments[0]["project_name"], "Project")
+    self.assertEqual(experiments[0]["start_date"], "2018-01-01")
+    self.assertEqual(experiments[1]["start_date"], "2018-02-01")
+
+  def test_manifest_event_lists_build_event_graphs(self):
+    server = FakeRedashServer().start()
+    server.install()
+    self.addCleanup(server.stop)
+    loadtest.add_templates(server)
+
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    path = os.path.join(temp_dir, "manifest.json")
+    with open(path, "w") as manifest_file:
+      json.dump({"experiments": [{
+          "exp_id": "exp",
+          "project_name": "Project",
+          "dash_name": "Dash",
+          "start_date": "2018-01-01",
+          "lazy_public_url": True,
+          "graph_templates": [{
+              "keyword": loadtest.GRAPH_TEMPLATE,
+              "events": ["CLICK", "SEARCH"]
+          }]
+      }]}, manifest_file)
+
+    # The session's requests reach the server past the mocked requests
+    # module.
+    report = batch.run_experiment(
+        batch.load_manifest(path)[0], self.CREDENTIALS,
+        session=requests.Session())
+
+    self.assertEqual(report["status"], "ok", report.get("traceback"))
+    self.assertEqual(server.get_stats()["calls"]["create_widget"], 2)
+
+  def test_run_experiment_reports_success(self):
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps({"public_url": "the_public_url"}))
+
+    report = batch.run_experiment({
+        "exp_id": "exp",
+        "project_name": "Project",
+        "dash_name": "Dash",
+        "start_date": "2018-01-01",
+    }, self.CREDENTIALS)
+
+    self.assertEqual(report["status"], "ok")
+    self.assertEqual(report["exp_id"], "exp")
+    self.assertEqual(report["public_url"], "the_public_url")
+
+  def test_run_experiment_isolates_failures(self):
+    self._setupMockRedashClientException("search_queries")
+
+    report = batch.run_experiment({
+        "exp_id": "exp",
+        "project_name": "Project",
+        "dash_name": "Dash",
+        "start_date": "2018-01-01",
+        "graph_templates": [{"keyword": "Template:"}],
+    }, self.CREDENTIALS)
+
+    self.assertEqual(report["status"], "failed")
+    self.assertTrue("Unable to find query templates" in report["error"])
+    self.assertTrue("traceback" in report)
+
+  def test_run_experiment_sends_every_call_through_the_session(self):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    registry = batch.TemplateRegistry(
+        path=os.path.join(temp_dir, "templates.json"))
+    self.mock_requests_get.reset_mock()
+    self.mock_requests_post.reset_mock()
+
+    def get_server(url):
+      if "/queries?" in url:
+        content = {"count": 0, "results": []}
+      else:
+        content = {"id": 1, "slug": "dash", "is_draft": False,
+                   "public_url": "the_public_url", "widgets": []}
+      return self.get_mock_response(content=json.dumps(content))
+
+    session = mock.Mock()
+    session.get.side_effect = get_server
+
+    report = batch.run_experiment({
+        "exp_id": "exp",
+        "project_name": "Project",
+        "dash_name": "Dash",
+        "dash_slug": "dash",
+        "start_date": "2018-01-01",
+        "graph_templates": [{"keyword": "Template:"}],
+    }, self.CREDENTIALS, registry, session)
+
+    self.assertEqual(report["status"], "ok")
+    urls = [call[0][0] for call in session.get.call_args_list]
+    # Attaching, listing templates and, with none cached, searching.
+    self.assertEqual(len(urls), 3)
+    self.assertTrue("/dashboards/dash?" in urls[0])
+    self.assertTrue("/queries?" in urls[1])
+    self.assertTrue("/queries?q=Template:" in urls[2])
+    self.assertEqual(self.mock_requests_get.call_count, 0)
+    self.assertEqual(self.mock_requests_post.call_count, 0)
+
+  def test_named_event_lists_come_from_the_dashboard(self):
+    dashboard = mock.Mock(UT_EVENTS=["a", "b"])
+
+    self.assertEqual(batch._get_events(dashboard, "UT_EVENTS"), ["a", "b"])
+    self.assertEqual(batch._get_events(dashboard, ["c"]), ["c"])
+    self.assertIsNone(batch._get_events(dashboard, None))
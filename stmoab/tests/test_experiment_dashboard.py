@@ -1,9 +1,15 @@
+import mock
 import json
 import time
+import unittest
 
+from stmoab import loadtest
 from stmoab.tests.base import AppTest
+from stmoab.FakeRedashServer import FakeRedashServer
+from stmoab.StatisticalDashboard import StatisticalDashboard
 from stmoab.ExperimentDashboard import (
     ExperimentDashboard)
+from stmoab.PendingResultsQueue import PendingResultsQueue
 
 
 class TestExperimentDashboard(AppTest):
@@ -209,3 +215,319 @@ class TestExperimentDashboard(AppTest):
     self.assertEqual(self.mock_requests_post.call_count, 26)
     self.assertEqual(self.mock_requests_get.call_count, 5)
     self.assertEqual(self.mock_requests_delete.call_count, 2)
+
+  def _get_templates_server(self, widgets_response):
+    self.get_calls = 0
+    QUERIES_IN_SEARCH = {
+        "results": [{
+            "id": 5,
+            "description": "SomeQuery",
+            "name": "AS Template: Query Title Event",
+            "query": "SELECT * FROM table",
+            "data_source_id": 5
+        }, {
+            "id": 6,
+            "description": "SomeQuery2",
+            "name": "AS Template: Query Title",
+            "query": "SELECT * FROM table",
+            "data_source_id": 5
+        }]
+    }
+    VISUALIZATIONS_FOR_QUERY = {
+        "visualizations": [
+            {"options": {}},
+            {"options": {}}
+        ]
+    }
+
+    def get_server(url):
+      if self.get_calls == 0:
+        response = self.get_mock_response(
+            content=json.dumps(QUERIES_IN_SEARCH))
+      elif self.get_calls <= 2:
+        response = self.get_mock_response(
+            content=json.dumps(VISUALIZATIONS_FOR_QUERY))
+      else:
+        response = self.get_mock_response(
+            content=json.dumps(widgets_response))
+
+      self.get_calls += 1
+      return response
+
+    return get_server
+
+  def test_add_templates_with_workers_makes_correct_calls(self):
+    QUERY_RESULTS_RESPONSE = {
+        "query_result": {
+            "data": {
+                "rows": [{"a": "b"}, {"c": "d"}]
+            }
+        }
+    }
+    WIDGETS_RESPONSE = {
+        "widgets": [{
+            "id": "the_widget_id",
+            "visualization": {
+                "query": {
+                    "id": "some_id",
+                    "name": "Query Title Click"
+                },
+            },
+        }]
+    }
+
+    self.mock_requests_delete.return_value = self.get_mock_response()
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps(QUERY_RESULTS_RESPONSE))
+    self.mock_requests_get.side_effect = self._get_templates_server(
+        WIDGETS_RESPONSE)
+
+    public_urls = self.dash.add_graph_templates("Template:", max_workers=4)
+
+    # The pool makes exactly the same calls as the sequential run.
+    self.assertEqual(len(public_urls), 1)
+    self.assertEqual(self.mock_requests_post.call_count, 26)
+    self.assertEqual(self.mock_requests_get.call_count, 5)
+    self.assertEqual(self.mock_requests_delete.call_count, 2)
+
+  def test_add_templates_with_workers_reports_every_failed_unit(self):
+    QUERY_RESULTS_RESPONSE = {
+        "query_result": {
+            "data": {
+                "rows": [{"a": "b"}, {"c": "d"}]
+            }
+        }
+    }
+
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps(QUERY_RESULTS_RESPONSE))
+    self.mock_requests_get.side_effect = self._get_templates_server(
+        {"widgets": []})
+    self._setupMockRedashClientException("make_new_visualization_request")
+
+    with self.assertRaises(self.dash.TemplateApplicationError) as context:
+      self.dash.add_graph_templates("Template:", max_workers=4)
+
+    # One unit per default event plus the non-event template
+    failures = context.exception.failures
+    self.assertEqual(len(failures), len(self.dash.DEFAULT_EVENTS) + 1)
+    self.assertEqual(
+        [failure["event"] for failure in failures],
+        self.dash.DEFAULT_EVENTS + [None])
+    self.assertEqual(context.exception.public_urls, [])
+
+  def test_event_params_do_not_leak_between_units(self):
+    units = self.dash._get_template_units(
+        [{"name": "Template: Event", "query": "SELECT {{{event}}}"},
+         {"name": "Template: Other", "query": "SELECT 1"}],
+        ["CLICK", "SEARCH"], "events")
+
+    self.assertEqual(len(units), 3)
+    self.assertEqual(units[0]["params"]["event_string"], "('CLICK')")
+    self.assertEqual(units[1]["params"]["event_string"], "('SEARCH')")
+    self.assertFalse("event" in units[2]["params"])
+    self.assertFalse("event" in self.dash._params)
+
+  def test_missing_template_parameters_are_reported_up_front(self):
+    TEMPLATE = {
+        "name": "Template: Other",
+        "query": "SELECT * FROM {{{events_table}}} WHERE {{{nope}}}"
+    }
+
+    self.assertRaisesRegexp(
+        self.dash.ExternalAPIError,
+        "Template 'Template: Other' uses unknown parameters: nope",
+        lambda: self.dash._get_template_units([TEMPLATE], [], "events"))
+
+  def _add_templates_over_existing_graph(self, update_in_place,
+                                         visualization_options):
+    QUERY_RESULTS_RESPONSE = {
+        "query_result": {
+            "data": {
+                "rows": [{"a": "b"}, {"c": "d"}]
+            }
+        }
+    }
+    WIDGETS_RESPONSE = {
+        "widgets": [{
+            "id": "the_widget_id",
+            "visualization": {
+                "id": "the_viz_id",
+                "options": visualization_options,
+                "query": {
+                    "id": "some_id",
+                    "name": "Query Title",
+                    "query": "SELECT * FROM old_table"
+                },
+            },
+        }]
+    }
+
+    dash = self.get_dashboard(self.API_KEY)
+    dash._update_in_place = update_in_place
+
+    self.mock_requests_post.reset_mock()
+    self.mock_requests_get.reset_mock()
+    self.mock_requests_delete.reset_mock()
+    self.mock_requests_delete.return_value = self.get_mock_response()
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps(QUERY_RESULTS_RESPONSE))
+    self.mock_requests_get.side_effect = self._get_templates_server(
+        WIDGETS_RESPONSE)
+
+    public_urls = dash.add_graph_templates("Template:", events_list=[])
+    return dash, public_urls
+
+  def test_add_templates_updates_existing_graph_in_place(self):
+    dash, public_urls = self._add_templates_over_existing_graph(True, {})
+
+    # The existing query is rewritten and re-run, its widget is kept:
+    # POST calls:
+    #     1) Get query results
+    #     2) Update query
+    #     3) Refresh query
+    self.assertEqual(
+        public_urls,
+        [dash.redash.get_visualization_public_url("some_id", "the_viz_id")])
+    self.assertEqual(self.mock_requests_post.call_count, 3)
+    self.assertEqual(self.mock_requests_delete.call_count, 0)
+
+    graph = dash.get_query_ids_and_names()["Query Title"]
+    self.assertEqual(graph["widget_id"], "the_widget_id")
+    self.assertEqual(graph["query"], "SELECT * FROM table")
+
+  def test_add_templates_recreates_graph_when_visualization_differs(self):
+    dash, public_urls = self._add_templates_over_existing_graph(
+        True, {"globalSeriesType": "line"})
+
+    # Same calls as recreating the graph without update_in_place:
+    # POST calls:
+    #     1) Get query results
+    #     2) Create new query
+    #     3) Create visualization
+    #     4) Append visualization to dashboard
+    # DELETE calls:
+    #     The existing graph is removed and its query deleted
+    self.assertEqual(len(public_urls), 1)
+    self.assertEqual(self.mock_requests_post.call_count, 4)
+    self.assertEqual(self.mock_requests_delete.call_count, 2)
+
+    dash, public_urls = self._add_templates_over_existing_graph(False, {})
+
+    self.assertEqual(self.mock_requests_post.call_count, 4)
+    self.assertEqual(self.mock_requests_delete.call_count, 2)
+
+  def test_add_templates_defers_graphs_until_results_are_ready(self):
+    QUERY_ID_RESPONSE = {
+        "id": "some_id"
+    }
+    dash = self.get_dashboard(self.API_KEY)
+    dash._defer_pending = True
+    dash._get_query_results = mock.Mock(return_value=[])
+    dash._check_query_results = mock.Mock(side_effect=[[], [{"a": 1}]])
+
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps(QUERY_ID_RESPONSE))
+    self.mock_requests_get.side_effect = self._get_templates_server(
+        {"widgets": []})
+
+    with mock.patch.object(
+            PendingResultsQueue, "DEFAULT_INITIAL_DELAY", 0.001):
+      public_urls = dash.add_graph_templates("Template:", events_list=[])
+      report = dash.wait_for_pending(5)
+
+    # The graph isn't ready during the run, it's added in the background.
+    self.assertEqual(public_urls, [])
+    self.assertEqual(list(report["completed"]), ["Query Title"])
+    self.assertIsNotNone(report["completed"]["Query Title"])
+    self.assertTrue("Query Title" in dash.get_query_ids_and_names())
+    self.assertEqual(dash._check_query_results.call_count, 2)
+    dash.close_pending()
+
+  def test_add_templates_returns_graphs_added_while_waiting(self):
+    QUERY_ID_RESPONSE = {
+        "id": "some_id"
+    }
+    dash = self.get_dashboard(self.API_KEY)
+    dash._defer_pending = True
+    dash._get_query_results = mock.Mock(return_value=[])
+    dash._check_query_results = mock.Mock(return_value=[{"a": 1}])
+    self.addCleanup(dash.close_pending)
+
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps(QUERY_ID_RESPONSE))
+    self.mock_requests_get.side_effect = self._get_templates_server(
+        {"widgets": []})
+
+    with mock.patch.object(
+            PendingResultsQueue, "DEFAULT_INITIAL_DELAY", 0.001):
+      public_urls = dash.add_graph_templates(
+          "Template:", events_list=[], wait_for_pending=True)
+
+    self.assertEqual(len(public_urls), 1)
+
+
+class TestExperimentDashboardPlan(unittest.TestCase):
+
+  EVENTS = ["CLICK", "SEARCH"]
+
+  def setUp(self):
+    self.server = FakeRedashServer()
+    self.server.start()
+    self.server.install()
+    self.addCleanup(self.server.stop)
+    loadtest.add_templates(self.server)
+
+  def get_dashboard(self, **options):
+    return StatisticalDashboard(
+        "api_key", "access", "secret", "us-west-2", "bucket",
+        "Load Test", "Planned", "exp", start_date="2018-01-01",
+        lazy_public_url=True, **options)
+
+  def _apply(self, dash, plan):
+    # The API calls apply_plan made.
+    self.server.reset_stats()
+    dash.apply_plan(plan)
+    return self.server.get_stats()["total_calls"]
+
+  def test_plan_matches_the_calls_made_to_apply_it(self):
+    dash = self.get_dashboard()
+    plan = dash.plan_graph_templates(loadtest.GRAPH_TEMPLATE, self.EVENTS)
+
+    self.assertEqual(plan["actions"]["create"], 2)
+    self.assertEqual(
+        [query["title"] for query in plan["warehouse_queries"]],
+        ["Click Rate", "Search Rate"])
+    self.assertFalse(plan["empty"])
+    self.assertEqual(self._apply(dash, plan), plan["api_calls"])
+
+    replan = dash.plan_graph_templates(loadtest.GRAPH_TEMPLATE, self.EVENTS)
+
+    self.assertTrue(replan["empty"])
+    self.assertEqual(replan["api_calls"], 0)
+    self.assertEqual(self._apply(dash, replan), 0)
+
+  def test_changed_queries_are_planned_as_updates_or_replacements(self):
+    dash = self.get_dashboard()
+    dash.apply_plan(
+        dash.plan_graph_templates(loadtest.GRAPH_TEMPLATE, self.EVENTS))
+
+    for update_in_place, action in [(True, "update"), (False, "replace")]:
+      dash = self.get_dashboard(update_in_place=update_in_place)
+      dash._params["end_date"] = "2018-02-0{day}".format(
+          day=2 if update_in_place else 3)
+      plan = dash.plan_graph_templates(loadtest.GRAPH_TEMPLATE, self.EVENTS)
+
+      self.assertEqual(plan["actions"][action], 2)
+      self.assertEqual(
+          len(plan["deleted_query_ids"]), 0 if update_in_place else 2)
+      self.assertEqual(self._apply(dash, plan), plan["api_calls"])
+
+  def test_ttable_plan(self):
+    dash = self.get_dashboard()
+    plan = dash.plan_ttable_data(
+        loadtest.TTABLE_TEMPLATE, loadtest.TTABLE_TITLE, self.EVENTS)
+
+    self.assertEqual(plan["actions"]["execute"], 2)
+    self.assertEqual(self._apply(dash, plan), plan["api_calls"])
+    self.assertEqual(len(dash._ttables[loadtest.TTABLE_TITLE]["rows"]), 2)
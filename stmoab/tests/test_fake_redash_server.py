@@ -0,0 +1,69 @@
+import unittest
+
+from redash_client.client import RedashClient
+from redash_client.constants import VizWidth
+
+from stmoab.FakeRedashServer import FakeRedashServer
+
+
+class TestFakeRedashServer(unittest.TestCase):
+
+  def setUp(self):
+    self.server = FakeRedashServer(seed=1).start()
+    self.server.install()
+    self.addCleanup(self.server.stop)
+    self.redash = RedashClient("api_key")
+
+  def test_redash_client_builds_a_dashboard(self):
+    template_id = self.server.add_template(
+        "AS Template: Clicks", "SELECT 1", options={"a": 1})
+
+    dash_info = self.redash.create_new_dashboard("Some Dashboard")
+    templates = self.redash.search_queries("as template")
+    query_id, table_id = self.redash.create_new_query(
+        "Clicks", "SELECT 2", 5)
+    viz_id = self.redash.make_new_visualization_request(
+        query_id, "CHART", {"a": 1}, "Chart")
+    self.redash.add_visualization_to_dashboard(
+        dash_info["dashboard_id"], viz_id, VizWidth.REGULAR)
+    widgets = self.redash.get_widget_from_dash("Some Dashboard")
+
+    self.assertEqual(dash_info["dashboard_slug"], "some-dashboard")
+    self.assertEqual([t["id"] for t in templates], [template_id])
+    self.assertEqual(templates[0]["options"], {"a": 1})
+    self.assertTrue(table_id is not None)
+    self.assertEqual(len(widgets), 1)
+    self.assertEqual(widgets[0]["visualization"]["query"]["id"], query_id)
+    self.assertEqual(len(self.redash.get_query_results("SELECT 2", 5)), 140)
+
+    stats = self.server.get_stats()
+    self.assertEqual(stats["calls"]["create_widget"], 1)
+    self.assertEqual(stats["calls"]["get_query"], 2)
+    self.assertEqual(stats["errors"], 0)
+
+  def test_injected_errors_are_returned_as_503(self):
+    self.server = FakeRedashServer(
+        error_rates={"search_queries": 1.0}).start()
+    self.server.install()
+    self.addCleanup(self.server.stop)
+
+    with self.assertRaises(RedashClient.RedashClientException) as context:
+      self.redash.search_queries("Template")
+
+    self.assertEqual(context.exception.args[1], 503)
+    self.assertEqual(self.server.get_stats()["errors"], 1)
+
+  def test_results_are_pending_until_the_execution_delay(self):
+    server = FakeRedashServer(execution_delay=60)
+    server.set_results("SELECT 1", [{"a": 1}])
+
+    status, first = server.handle(
+        "POST", "/api/query_results", {},
+        b'{"query": "SELECT 1", "data_source_id": 5}')
+    server._execution_delay = 0
+    status, second = server.handle(
+        "POST", "/api/query_results", {},
+        b'{"query": "SELECT 1", "data_source_id": 5}')
+
+    self.assertTrue("job" in first)
+    self.assertEqual(second["query_result"]["data"]["rows"], [{"a": 1}])
@@ -0,0 +1,31 @@
+import unittest
+
+from stmoab import loadtest
+from stmoab.FakeRedashServer import FakeRedashServer
+
+
+class TestLoadTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = FakeRedashServer(seed=1).start()
+    self.server.install()
+    self.addCleanup(self.server.stop)
+
+  def test_load_test_builds_and_refreshes_dashboards(self):
+    loadtest.add_templates(self.server)
+
+    report = loadtest.run_load_test(
+        self.server, experiments=2, events=["CLICK", "SEARCH"],
+        max_workers=2, parallel_experiments=2,
+        dashboard_options={"lazy_public_url": True})
+
+    self.assertEqual(
+        [experiment["status"] for experiment in report["experiments"]],
+        ["ok", "ok"])
+    # A population graph, a graph per event and a T-Table, made twice and
+    # removed once for each experiment.
+    self.assertEqual(report["calls"]["create_widget"], 2 * 2 * 4)
+    self.assertEqual(report["calls"]["delete_widget"], 2 * 4)
+    self.assertEqual(report["calls_per_experiment"],
+                     report["total_calls"] / 2.0)
+    self.assertTrue(report["max_concurrency"] >= 1)
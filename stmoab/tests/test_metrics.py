@@ -0,0 +1,101 @@
+import os
+import json
+import shutil
+import tempfile
+
+from stmoab.tests.base import AppTest
+from stmoab.Metrics import Metrics
+from stmoab.QueryResultCache import QueryResultCache
+from stmoab.SummaryDashboard import SummaryDashboard
+
+
+class TestMetrics(AppTest):
+
+  def test_record_fills_histogram_buckets(self):
+    metrics = Metrics(buckets=[0.1, 1.0])
+    metrics.record("op", 0.05)
+    metrics.record("op", 0.5, error=True, bytes_received=10)
+    metrics.record("op", 5.0, bytes_sent=3)
+
+    operation = metrics.get_summary()["operations"]["op"]
+
+    self.assertEqual(operation["count"], 3)
+    self.assertEqual(operation["errors"], 1)
+    self.assertEqual(operation["bytes_sent"], 3)
+    self.assertEqual(operation["bytes_received"], 10)
+    self.assertEqual(operation["max_seconds"], 5.0)
+    self.assertEqual(
+        list(operation["buckets"].items()),
+        [("0.1", 1), ("1.0", 1), ("+Inf", 1)])
+
+  def test_timer_counts_errors(self):
+    metrics = Metrics()
+
+    with self.assertRaises(ValueError):
+      with metrics.timer("op"):
+        raise ValueError("boom")
+
+    self.assertEqual(metrics.get_summary()["operations"]["op"]["errors"], 1)
+
+  def test_prometheus_output(self):
+    metrics = Metrics(buckets=[1.0], labels={"experiment": "exp"})
+    metrics.record("get_query_results", 0.5, bytes_received=7)
+    metrics.record("get_query_results", 2.0)
+    metrics.increment("result_cache_hits")
+
+    lines = metrics.to_prometheus().splitlines()
+
+    self.assertTrue(
+        "# TYPE stmoab_operation_duration_seconds histogram" in lines)
+    self.assertTrue(
+        'stmoab_operation_duration_seconds_bucket{experiment="exp",'
+        'le="1.0",operation="get_query_results"} 1' in lines)
+    self.assertTrue(
+        'stmoab_operation_duration_seconds_bucket{experiment="exp",'
+        'le="+Inf",operation="get_query_results"} 2' in lines)
+    self.assertTrue(
+        'stmoab_operation_duration_seconds_count{experiment="exp",'
+        'operation="get_query_results"} 2' in lines)
+    self.assertTrue(
+        'stmoab_operation_bytes_received_total{experiment="exp",'
+        'operation="get_query_results"} 7' in lines)
+    self.assertTrue(
+        'stmoab_events_total{event="result_cache_hits",'
+        'experiment="exp"} 1' in lines)
+
+  def test_summary_files_are_written(self):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    metrics = Metrics()
+    metrics.record("op", 0.5)
+
+    metrics.write_json(os.path.join(temp_dir, "metrics.json"))
+    metrics.write_prometheus(os.path.join(temp_dir, "metrics.prom"))
+
+    with open(os.path.join(temp_dir, "metrics.json")) as summary_file:
+      self.assertEqual(json.load(summary_file)["operations"]["op"]["count"], 1)
+    with open(os.path.join(temp_dir, "metrics.prom")) as metrics_file:
+      self.assertEqual(metrics_file.read(), metrics.to_prometheus())
+
+  def test_dashboard_records_calls_requests_and_cache_hits(self):
+    ROWS = [{"a": 1}]
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps({"query_result": {"data": {"rows": ROWS}}}))
+    metrics = Metrics()
+    dash = SummaryDashboard(
+        self.API_KEY, "Metrics Dash", metrics=metrics,
+        result_cache=QueryResultCache())
+
+    dash._get_query_results("SELECT 1", 5)
+    dash._get_query_results("SELECT 1", 5)
+
+    summary = metrics.get_summary()
+    self.assertEqual(
+        summary["operations"]["get_query_results"]["count"], 2)
+    self.assertEqual(summary["counters"], {
+        "result_cache_misses": 1, "result_cache_hits": 1})
+    # Creating and publishing the dashboard, sharing it and one query.
+    requests = summary["operations"]["redash_request"]
+    self.assertEqual(requests["count"], 4)
+    self.assertTrue(requests["bytes_received"] > 0)
+    self.assertTrue(requests["bytes_sent"] > 0)
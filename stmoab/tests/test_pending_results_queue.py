@@ -0,0 +1,88 @@
+import mock
+import threading
+import unittest
+
+from stmoab.PendingResultsQueue import PendingResultsQueue
+
+
+class TestPendingResultsQueue(unittest.TestCase):
+
+  def get_queue(self, fetch_results, timeout=5, max_workers=None):
+    queue = PendingResultsQueue(
+        fetch_results, timeout, initial_delay=0.001, max_delay=0.01,
+        max_workers=max_workers)
+    self.addCleanup(queue.close)
+    return queue
+
+  def test_callback_runs_once_results_are_ready(self):
+    fetch_results = mock.Mock(side_effect=[[], [], [{"a": 1}]])
+    on_ready = mock.Mock(return_value="url")
+    queue = self.get_queue(fetch_results)
+
+    queue.add("graph", "SELECT 1", 5, on_ready)
+    report = queue.wait(5)
+
+    self.assertEqual(report["completed"], {"graph": "url"})
+    self.assertEqual(report["pending"], [])
+    self.assertEqual(fetch_results.call_count, 3)
+    fetch_results.assert_called_with("SELECT 1", 5, "graph")
+    self.assertEqual(on_ready.call_count, 1)
+    self.assertEqual(len(queue), 0)
+
+  def test_queries_without_results_expire(self):
+    on_ready = mock.Mock()
+    queue = self.get_queue(mock.Mock(return_value=[]), timeout=0.05)
+
+    queue.add("graph", "SELECT 1", 5, on_ready)
+    report = queue.wait(5)
+
+    self.assertEqual(report["expired"], ["graph"])
+    self.assertEqual(on_ready.call_count, 0)
+
+  def test_failures_are_reported(self):
+    error = ValueError("nope")
+    queue = self.get_queue(mock.Mock(return_value=[{"a": 1}]))
+
+    queue.add("graph", "SELECT 1", 5, mock.Mock(side_effect=error))
+    report = queue.wait(5)
+
+    self.assertEqual(report["failed"], [{"name": "graph", "error": error}])
+
+  def test_wait_returns_at_its_timeout(self):
+    queue = self.get_queue(mock.Mock(return_value=[]), timeout=60)
+
+    queue.add("graph", "SELECT 1", 5, mock.Mock())
+    report = queue.wait(0.01)
+
+    self.assertEqual(report["pending"], ["graph"])
+    self.assertEqual(len(queue), 1)
+
+  def test_slow_queries_do_not_hold_up_ready_ones(self):
+    release = threading.Event()
+
+    def fetch_results(query_string, data_source_id, name):
+      if name == "slow":
+        release.wait(5)
+      return [{"a": 1}]
+
+    queue = self.get_queue(fetch_results, max_workers=2)
+    queue.add("slow", "SELECT 1", 5, mock.Mock(return_value="slow_url"))
+    queue.add("ready", "SELECT 2", 5, mock.Mock(return_value="ready_url"))
+
+    report = queue.wait(0.5)
+    release.set()
+
+    self.assertEqual(report["completed"], {"ready": "ready_url"})
+    self.assertEqual(report["pending"], ["slow"])
+    self.assertEqual(queue.wait(5)["completed"], {"slow": "slow_url"})
+
+  def test_close_stops_polling(self):
+    fetch_results = mock.Mock(return_value=[])
+    queue = self.get_queue(fetch_results, timeout=60)
+
+    queue.add("graph", "SELECT 1", 5, mock.Mock())
+    queue.close()
+    polls = fetch_results.call_count
+
+    self.assertEqual(queue.wait()["pending"], ["graph"])
+    self.assertEqual(fetch_results.call_count, polls)
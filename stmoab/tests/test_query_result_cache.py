@@ -0,0 +1,86 @@
+import os
+import json
+import shutil
+import tempfile
+
+from stmoab.tests.base import AppTest
+from stmoab.SummaryDashboard import SummaryDashboard
+from stmoab.QueryResultCache import QueryResultCache
+
+
+class TestQueryResultCache(AppTest):
+
+  ROWS = [{"a": 1}, {"a": 2}]
+
+  def test_key_ignores_whitespace_outside_literals(self):
+    cache = QueryResultCache()
+
+    self.assertEqual(
+        cache.make_key("SELECT a\n  FROM  t", 5),
+        cache.make_key(" SELECT a FROM t ", 5))
+    self.assertNotEqual(
+        cache.make_key("SELECT 'a  b' FROM t", 5),
+        cache.make_key("SELECT 'a b' FROM t", 5))
+    self.assertNotEqual(
+        cache.make_key("SELECT a FROM t", 5),
+        cache.make_key("SELECT a FROM t", 6))
+
+  def test_least_recently_used_entry_is_evicted(self):
+    cache = QueryResultCache(max_entries=2)
+    cache.set("a", 1, self.ROWS)
+    cache.set("b", 1, self.ROWS)
+    cache.get("a", 1)
+    cache.set("c", 1, self.ROWS)
+
+    self.assertEqual(len(cache), 2)
+    self.assertEqual(cache.get("a", 1), self.ROWS)
+    self.assertIsNone(cache.get("b", 1))
+    self.assertEqual(cache.get("c", 1), self.ROWS)
+
+  def test_expired_entry_is_a_miss(self):
+    cache = QueryResultCache(ttl=-1)
+    cache.set("a", 1, self.ROWS)
+
+    self.assertIsNone(cache.get("a", 1))
+
+  def test_results_persist_to_sqlite(self):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    path = os.path.join(temp_dir, "results.sqlite")
+
+    QueryResultCache(path=path).set("SELECT 1", 5, self.ROWS)
+
+    self.assertEqual(QueryResultCache(path=path).get("SELECT 1", 5), self.ROWS)
+    self.assertIsNone(QueryResultCache(ttl=-1, path=path).get("SELECT 1", 5))
+
+  def test_dashboard_reuses_cached_results(self):
+    QUERY_RESULTS_RESPONSE = {
+        "query_result": {
+            "data": {
+                "rows": self.ROWS
+            }
+        }
+    }
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps(QUERY_RESULTS_RESPONSE))
+    cache = QueryResultCache()
+    dash = SummaryDashboard(self.API_KEY, "Cached", result_cache=cache)
+    self.mock_requests_post.reset_mock()
+
+    first = dash._get_query_results("SELECT *  FROM t", 5)
+    second = dash._get_query_results("SELECT * FROM t", 5)
+
+    self.assertEqual(first, self.ROWS)
+    self.assertEqual(second, self.ROWS)
+    self.assertEqual(self.mock_requests_post.call_count, 1)
+
+  def test_dashboard_does_not_cache_empty_results(self):
+    cache = QueryResultCache()
+    dash = SummaryDashboard(self.API_KEY, "Cached", result_cache=cache)
+    self.mock_requests_post.reset_mock()
+
+    dash._get_query_results("SELECT * FROM t", 5)
+    dash._get_query_results("SELECT * FROM t", 5)
+
+    self.assertEqual(len(cache), 0)
+    self.assertEqual(self.mock_requests_post.call_count, 2)
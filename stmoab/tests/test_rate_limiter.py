@@ -0,0 +1,111 @@
+import mock
+import requests
+
+from stmoab.tests.base import AppTest
+from stmoab.RateLimiter import RateLimiter
+from stmoab.SummaryDashboard import SummaryDashboard
+
+
+class TestRateLimiter(AppTest):
+
+  def setUp(self):
+    super(TestRateLimiter, self).setUp()
+
+    sleep_patcher = mock.patch("stmoab.RateLimiter.time.sleep")
+    self.mock_sleep = sleep_patcher.start()
+    self.addCleanup(sleep_patcher.stop)
+
+  def get_limited_dashboard(self, limiter):
+    dash = SummaryDashboard(self.API_KEY, "Limited", rate_limiter=limiter)
+    self.mock_requests_get.reset_mock()
+    self.mock_requests_post.reset_mock()
+    return dash
+
+  def test_throttled_requests_are_retried(self):
+    limiter = RateLimiter(rate=1000, max_concurrency=8)
+    dash = self.get_limited_dashboard(limiter)
+    self.mock_requests_get.side_effect = [
+        self.get_mock_response(status=429),
+        self.get_mock_response(status=503),
+        self.get_mock_response(content='{"widgets": []}'),
+    ]
+
+    dash.refresh()
+
+    self.assertEqual(self.mock_requests_get.call_count, 3)
+    self.assertEqual(self.mock_sleep.call_count, 2)
+    # Each throttled response halves the concurrency limit.
+    self.assertEqual(limiter.concurrency, 2)
+
+  def test_other_errors_are_not_retried(self):
+    dash = self.get_limited_dashboard(RateLimiter(rate=1000))
+    self.mock_requests_get.return_value = self.get_mock_response(status=404)
+
+    self.assertRaises(dash.ExternalAPIError, dash.refresh)
+    self.assertEqual(self.mock_requests_get.call_count, 1)
+    self.assertEqual(self.mock_sleep.call_count, 0)
+
+  def test_retries_give_up_after_max_retries(self):
+    dash = self.get_limited_dashboard(
+        RateLimiter(rate=1000, max_retries=2))
+    self.mock_requests_get.side_effect = requests.ConnectionError
+
+    self.assertRaises(dash.ExternalAPIError, dash.refresh)
+    self.assertEqual(self.mock_requests_get.call_count, 3)
+
+  def test_concurrency_recovers_additively(self):
+    limiter = RateLimiter(rate=1000, max_concurrency=4)
+    limiter._concurrency = 2.0
+
+    for i in range(4):
+      limiter.call(lambda: None)
+
+    self.assertEqual(limiter.concurrency, 3)
+
+  def test_backoff_is_bounded(self):
+    limiter = RateLimiter(base_delay=1, max_delay=5)
+
+    for attempt in range(10):
+      self.assertTrue(0 <= limiter.get_backoff(attempt) <= 5)
+
+  def test_shared_limiter_is_reused(self):
+    self.addCleanup(RateLimiter._shared.pop, "test", None)
+    self.addCleanup(RateLimiter._shared.pop, "default", None)
+
+    self.assertIs(
+        RateLimiter.shared("test", rate=5), RateLimiter.shared("test"))
+    self.assertIsNot(RateLimiter.shared("test"), RateLimiter.shared())
+
+  def test_posts_are_not_retried_on_gateway_errors(self):
+    dash = self.get_limited_dashboard(RateLimiter(rate=1000))
+    self.mock_requests_post.return_value = self.get_mock_response(status=502)
+
+    self.assertRaises(
+        dash.ExternalAPIError, dash._create_new_query,
+        "Title", "SELECT 1", 5)
+    self.assertEqual(self.mock_requests_post.call_count, 1)
+    self.assertEqual(self.mock_sleep.call_count, 0)
+
+  def test_posts_are_retried_when_throttled_or_not_sent(self):
+    dash = self.get_limited_dashboard(RateLimiter(rate=1000))
+    self.mock_requests_post.side_effect = [
+        self.get_mock_response(status=429),
+        requests.ConnectTimeout(),
+        self.get_mock_response(content='{"id": 5}'),
+        self.get_mock_response(content="{}"),
+    ]
+
+    dash._create_new_query("Title", "SELECT 1", 5)
+
+    self.assertEqual(self.mock_requests_post.call_count, 4)
+    self.assertEqual(self.mock_sleep.call_count, 2)
+
+  def test_posts_are_not_retried_after_dropped_connections(self):
+    dash = self.get_limited_dashboard(RateLimiter(rate=1000))
+    self.mock_requests_post.side_effect = requests.ConnectionError(
+        "Connection aborted.")
+
+    self.assertRaises(
+        dash.ExternalAPIError, dash._create_new_query,
+        "Title", "SELECT 1", 5)
+    self.assertEqual(self.mock_requests_post.call_count, 1)
@@ -0,0 +1,58 @@
+import mock
+import requests
+
+from stmoab.tests.base import AppTest
+from stmoab.SessionRedashClient import SessionRedashClient
+
+
+class TestSessionRedashClient(AppTest):
+
+  def setUp(self):
+    super(TestSessionRedashClient, self).setUp()
+
+    self.session = mock.Mock()
+    self.session.get.return_value = self.get_mock_response(
+        content='{"id": 1}')
+    self.session.post.return_value = self.get_mock_response()
+    self.session.delete.return_value = self.get_mock_response()
+    self.client = SessionRedashClient(self.API_KEY, self.session)
+
+    self.mock_requests_get.reset_mock()
+    self.mock_requests_post.reset_mock()
+
+  def test_requests_go_through_the_session(self):
+    json_result, response = self.client._make_request(
+        requests.get, "https://redash/api/queries/1")
+    self.client._make_request(requests.post, "https://redash/api/x", "{}")
+    self.client._make_request(None, "https://redash/api/y", "[]")
+    self.client._make_request(requests.delete, "https://redash/api/z")
+
+    self.assertEqual(json_result, {"id": 1})
+    self.session.get.assert_called_once_with("https://redash/api/queries/1")
+    self.assertEqual(self.session.post.call_args_list, [
+        mock.call("https://redash/api/x", data="{}"),
+        mock.call("https://redash/api/y", data="[]"),
+    ])
+    self.session.delete.assert_called_once_with("https://redash/api/z")
+    self.assertEqual(self.mock_requests_get.call_count, 0)
+    self.assertEqual(self.mock_requests_post.call_count, 0)
+
+  def test_api_calls_go_through_the_session(self):
+    self.client.publish_dashboard(1)
+
+    self.assertEqual(self.session.post.call_count, 1)
+    self.assertEqual(self.mock_requests_post.call_count, 0)
+
+  def test_errors_are_wrapped(self):
+    error = requests.ConnectionError("refused")
+    self.session.get.side_effect = error
+
+    with self.assertRaises(self.client.RedashClientException) as context:
+      self.client._make_request(requests.get, "https://redash/api/x")
+    self.assertIs(context.exception.args[1], error)
+
+    self.session.get.side_effect = None
+    self.session.get.return_value = self.get_mock_response(status=502)
+    with self.assertRaises(self.client.RedashClientException) as context:
+      self.client._make_request(requests.get, "https://redash/api/x")
+    self.assertEqual(context.exception.args[1], 502)
@@ -0,0 +1,49 @@
+import unittest
+
+from stmoab.SQLTemplate import SQLTemplate
+
+
+class TestSQLTemplate(unittest.TestCase):
+
+  PARAMS = {
+      "start_date": "2017-01-01",
+      "event_string": "('CLICK')",
+      "count": 3.14159,
+  }
+
+  def assertRendersLikeFormat(self, sql):
+    adjusted_sql = sql.replace("{{{", "{").replace("}}}", "}")
+    self.assertEqual(
+        SQLTemplate(sql).render(self.PARAMS),
+        adjusted_sql.format(**self.PARAMS))
+
+  def test_renders_like_str_format(self):
+    self.assertRendersLikeFormat(
+        "SELECT * FROM t WHERE date >= '{{{start_date}}}' "
+        "AND event IN {{{event_string}}}")
+    self.assertRendersLikeFormat("SELECT {start_date}, '{{literal}}'")
+    self.assertRendersLikeFormat("SELECT {count:.2f}, {start_date!r}")
+    self.assertRendersLikeFormat("SELECT 1")
+
+  def test_parameters(self):
+    compiled = SQLTemplate("SELECT {{{start_date}}}, {count:.1f}, {{x}}")
+
+    self.assertEqual(compiled.parameters, set(["start_date", "count"]))
+    self.assertEqual(
+        compiled.get_missing_parameters({"count": 1}), ["start_date"])
+    self.assertRaises(
+        SQLTemplate.MissingParameterError, compiled.render, {"count": 1})
+
+  def test_positional_fields_are_rejected(self):
+    self.assertRaises(ValueError, SQLTemplate, "SELECT {}")
+    self.assertRaises(ValueError, SQLTemplate, "SELECT {0}")
+
+  def test_compiled_templates_are_cached_by_id_and_version(self):
+    first = SQLTemplate.compile("SELECT 1", 5, 1)
+
+    self.assertIs(SQLTemplate.compile("SELECT 1", 5, 1), first)
+    self.assertIsNot(SQLTemplate.compile("SELECT 1", 5, 2), first)
+    self.assertIs(
+        SQLTemplate.compile("SELECT 2", 6), SQLTemplate.compile("SELECT 2", 6))
+    self.assertIsNot(
+        SQLTemplate.compile("SELECT 2", 6), SQLTemplate.compile("SELECT 3", 6))
@@ -1,10 +1,17 @@
+import os
 import math
 import mock
 import json
+import sys
 import time
+import shutil
+import tempfile
+import subprocess
 import statistics
 
 from stmoab.tests.base import AppTest
+from stmoab.utils import BotoTransfer
+from stmoab.SufficientStatsStore import SufficientStatsStore
 from stmoab.StatisticalDashboard import (
     StatisticalDashboard)
 
@@ -32,10 +39,9 @@ class TestStatisticalDashboard(AppTest):
     self.mock_requests_get.return_value = self.get_mock_response(
         content=json.dumps(QUERY_ID_RESPONSE))
     self.mock_requests_post.return_value = self.get_mock_response()
-    mock_boto_transfer_patcher = mock.patch(
-        "stmoab.utils.S3Transfer")
-    mock_boto_transfer_patcher.start()
-    self.addCleanup(mock_boto_transfer_patcher.stop)
+    mock_boto_client_patcher = mock.patch("boto3.client")
+    mock_boto_client_patcher.start()
+    self.addCleanup(mock_boto_client_patcher.stop)
 
     dashboard = StatisticalDashboard(
         self.API_KEY,
@@ -50,6 +56,46 @@ class TestStatisticalDashboard(AppTest):
     )
     return dashboard
 
+  def test_transfer_is_created_on_first_upload(self):
+    transfer_patcher = mock.patch(
+        "stmoab.StatisticalDashboard.create_boto_transfer")
+    mock_create_transfer = transfer_patcher.start()
+    self.addCleanup(transfer_patcher.stop)
+
+    dashboard = self.get_dashboard(self.API_KEY)
+    self.assertEqual(mock_create_transfer.call_count, 0)
+
+    self.assertIs(dashboard._transfer, dashboard._transfer)
+    self.assertEqual(mock_create_transfer.call_count, 1)
+
+  def test_transfer_can_be_passed_in(self):
+    transfer_patcher = mock.patch(
+        "stmoab.StatisticalDashboard.create_boto_transfer")
+    mock_create_transfer = transfer_patcher.start()
+    self.addCleanup(transfer_patcher.stop)
+    transfer = BotoTransfer(mock.Mock(), None)
+
+    dashboard = StatisticalDashboard(
+        self.API_KEY, self.AWS_ACCESS_KEY, self.AWS_SECRET_KEY,
+        self.AWS_REGION, self.AWS_BUCKET_ID, self.DASH_PROJECT,
+        self.DASH_NAME, self.EXPERIMENT_ID, self.START_DATE,
+        s3_transfer=transfer)
+    dashboard._ttables["Table"] = {"columns": [], "rows": [{"row": 1}]}
+    dashboard.add_ttable("Table")
+
+    self.assertIs(dashboard._transfer, transfer)
+    self.assertEqual(transfer.client.upload_fileobj.call_count, 1)
+    self.assertEqual(mock_create_transfer.call_count, 0)
+
+  def test_import_does_not_load_heavy_dependencies(self):
+    loaded = subprocess.check_output([
+        sys.executable, "-c",
+        "import sys, stmoab.StatisticalDashboard; "
+        "print(sorted(m for m in ('boto3', 'scipy', 'statsmodels') "
+        "if m in sys.modules))"])
+
+    self.assertEqual(loaded.strip(), b"[]")
+
   def test_pooled_stddev(self):
     exp_vals = [1, 2, 3]
     control_vals = [4, 6, 8]
@@ -183,6 +229,33 @@ class TestStatisticalDashboard(AppTest):
         ttable_row[0]["Experiment Mean - Control Mean"],
         EXPECTED_MEAN_DIFFERENCE)
 
+  def test_variant_stats_accumulate_from_an_iterator(self):
+    rows = (
+        {"type": variant, "count": value}
+        for variant, value in [
+            ("control", 4), ("experiment", 1), ("control", 8),
+            ("experiment", 3), ("other", 2)])
+
+    control_stats, exp_stats = self.dash._accumulate_variant_stats(
+        rows, "count")
+
+    self.assertEqual(control_stats.summary()[:2], (2, 6))
+    self.assertEqual(list(exp_stats.keys()), ["experiment", "other"])
+    self.assertEqual(exp_stats["experiment"].summary()[:2], (2, 2))
+    self.assertEqual(exp_stats["other"].count, 1)
+
+  def test_ttable_skips_variants_without_variance(self):
+    ROWS = [{"type": "control", "count": i} for i in range(4)]
+    ROWS.append({"type": "experiment", "count": 5})
+
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps({"query_result": {"data": {"rows": ROWS}}}))
+
+    ttable_row = self.dash._get_ttable_data_for_query(
+        "beep", "meep", "count", 5)
+
+    self.assertEqual(ttable_row, [])
+
   def test_add_ttable_makes_correct_calls(self):
     self.get_calls = 0
     self.server_calls = 0
@@ -256,7 +329,7 @@ class TestStatisticalDashboard(AppTest):
 
     # GET calls:
     #     1) Create dashboard
-    #     2) Get dashboard widgets (2 times)
+    #     2) Get dashboard widgets (once, then served from the index)
     #     3) Search for templates
     #     4) Get template
     # POST calls:
@@ -267,7 +340,7 @@ class TestStatisticalDashboard(AppTest):
     #     5) Add query to dashboard
     #     6) Make dashboard public
     self.assertEqual(self.mock_requests_post.call_count, 19)
-    self.assertEqual(self.mock_requests_get.call_count, 5)
+    self.assertEqual(self.mock_requests_get.call_count, 4)
     self.assertEqual(self.mock_requests_delete.call_count, 0)
 
   def test_ttable_with_no_rows(self):
@@ -333,7 +406,7 @@ class TestStatisticalDashboard(AppTest):
 
     # GET calls:
     #     1) Create dashboard
-    #     2) Get dashboard widgets (2 times)
+    #     2) Get dashboard widgets (once, then served from the index)
     #     3) Search for templates
     #     4) Get templates (2 calls)
     # POST calls:
@@ -344,12 +417,13 @@ class TestStatisticalDashboard(AppTest):
     #     5) Add query to dashboard
     #     6) Make dashboard public
     self.assertEqual(self.mock_requests_post.call_count, 20)
-    self.assertEqual(self.mock_requests_get.call_count, 6)
+    self.assertEqual(self.mock_requests_get.call_count, 5)
     self.assertEqual(self.mock_requests_delete.call_count, 0)
 
-    # The ttable has no rows
+    # The query had no rows, so only the row already in the ttable is
+    # uploaded.
     args, kwargs = upload_file_patch.call_args
-    self.assertEqual(len(args[2]["rows"]), 0)
+    self.assertEqual(args[4]["rows"], [{"row": 1}])
 
     mock_json_uploader.stop()
 
@@ -444,7 +518,7 @@ class TestStatisticalDashboard(AppTest):
       if self.get_calls == 0:
         response = self.get_mock_response(
             content=json.dumps(QUERIES_IN_SEARCH))
-      elif self.get_calls <= 2 and self.get_calls > 0:
+      elif self.get_calls == 1:
         response = self.get_mock_response(
             content=json.dumps(VISUALIZATIONS_FOR_QUERY))
       else:
@@ -472,7 +546,7 @@ class TestStatisticalDashboard(AppTest):
 
     # GET calls:
     #     1) Create dashboard
-    #     2) Get dashboard widgets (2 times)
+    #     2) Get dashboard widgets (once, then served from the index)
     #     3) Search for templates
     #     4) Get template
     # POST calls:
@@ -484,7 +558,177 @@ class TestStatisticalDashboard(AppTest):
     #     6) Add query to dashboard
     #     7) Make dashboard public
     self.assertEqual(self.mock_requests_post.call_count, 20)
-    self.assertEqual(self.mock_requests_get.call_count, 5)
+    self.assertEqual(self.mock_requests_get.call_count, 4)
     self.assertEqual(self.mock_requests_delete.call_count, 2)
 
     mock_json_uploader.stop()
+
+  def _get_daily_rows(self, days):
+    rows = []
+    for day in days:
+      for i in range(6):
+        rows.append(
+            {"date": day, "type": "control", "count": i + int(day[-1:])})
+        rows.append({"date": day, "type": "exp", "count": 2 * i})
+    return rows
+
+  def test_incremental_ttable_only_queries_new_days(self):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    TEMPLATE = {
+        "id": 7,
+        "name": "TTests Template: Event",
+        "description": "",
+        "query": "SELECT * FROM t WHERE date >= '{{{start_date}}}'",
+        "data_source_id": 5
+    }
+    FIRST_DAYS = ["2018-01-01", "2018-01-02", "2018-01-03"]
+    ALL_DAYS = FIRST_DAYS + ["2018-01-04"]
+
+    dash = self.get_dashboard(self.API_KEY)
+    dash._stats_store = SufficientStatsStore(
+        os.path.join(temp_dir, "stats.sqlite"))
+    dash._end_date = "2018-01-05"
+    params = dash._get_query_params("events", "CLICK")
+    dash._get_query_results = mock.Mock()
+
+    dash._get_query_results.return_value = self._get_daily_rows(FIRST_DAYS)
+    dash._apply_ttable_event_template(TEMPLATE, {}, params, "CLICK", "T")
+    dash._get_query_results.return_value = self._get_daily_rows(
+        ["2018-01-04"])
+    staged = dash._apply_ttable_event_template(
+        TEMPLATE, {}, params, "CLICK", "T")
+
+    # The second run only asks for the days after the first one's.
+    query_string = dash._get_query_results.call_args[0][0]
+    self.assertTrue("'2018-01-04'" in query_string)
+
+    # And matches computing the whole window from scratch.
+    dash._get_query_results.return_value = self._get_daily_rows(ALL_DAYS)
+    expected = dash._get_ttable_data_for_query(
+        "Click", query_string, "count", 5)
+
+    self.assertEqual(len(staged["rows"]), 1)
+    for column in expected[0]:
+      if isinstance(expected[0][column], float):
+        self.assertAlmostEqual(
+            staged["rows"][0][column], expected[0][column])
+      else:
+        self.assertEqual(staged["rows"][0][column], expected[0][column])
+
+  def test_incremental_ttable_starts_over_when_its_query_changes(self):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    TEMPLATE = {
+        "id": 7,
+        "name": "TTests Template: Event",
+        "description": "",
+        "query": (
+            "SELECT * FROM {{{events_table}}} "
+            "WHERE date >= '{{{start_date}}}'"),
+        "data_source_id": 5
+    }
+    EDITED_TEMPLATE = dict(TEMPLATE, query=TEMPLATE["query"] + " LIMIT 5")
+
+    dash = self.get_dashboard(self.API_KEY)
+    dash._stats_store = SufficientStatsStore(
+        os.path.join(temp_dir, "stats.sqlite"))
+    dash._end_date = "2018-01-05"
+    dash._get_query_results = mock.Mock(
+        return_value=self._get_daily_rows(["2018-01-01", "2018-01-02"]))
+
+    params = dash._get_query_params("events", "CLICK")
+    dash._apply_ttable_event_template(TEMPLATE, {}, params, "CLICK", "T")
+
+    # Moving the end date keeps the stored days.
+    dash._apply_ttable_event_template(
+        TEMPLATE, {}, dict(params, end_date="2018-01-06"), "CLICK", "T")
+    query_string = dash._get_query_results.call_args[0][0]
+    self.assertTrue("'2018-01-03'" in query_string)
+
+    # Anything else queries the whole window again.
+    for template, events_table in [(EDITED_TEMPLATE, "events"),
+                                   (TEMPLATE, "other_events")]:
+      dash._apply_ttable_event_template(
+          template, {}, dash._get_query_params(events_table, "CLICK"),
+          "CLICK", "T")
+      query_string = dash._get_query_results.call_args[0][0]
+      self.assertTrue(dash._start_date in query_string)
+      self.assertTrue(events_table in query_string)
+
+  def _assert_ttable_rows_equal(self, rows, expected):
+    self.assertEqual(len(rows), len(expected))
+    for row, expected_row in zip(rows, expected):
+      for column in expected_row:
+        if isinstance(expected_row[column], float):
+          self.assertAlmostEqual(row[column], expected_row[column])
+        else:
+          self.assertEqual(row[column], expected_row[column])
+
+  def test_aggregated_ttable_matches_per_client_rows(self):
+    ROWS = self._get_daily_rows(["2018-01-01", "2018-01-02"])
+    AGGREGATED_ROWS = []
+    for variant in ["control", "exp"]:
+      values = [row["count"] for row in ROWS if row["type"] == variant]
+      AGGREGATED_ROWS.append({
+          "type": variant,
+          "n": len(values),
+          "mean": statistics.mean(values),
+          "variance": statistics.variance(values),
+      })
+
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps({"query_result": {"data": {"rows": ROWS}}}))
+    expected = self.dash._get_ttable_data_for_query(
+        "beep", "meep", "count", 5)
+
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps(
+            {"query_result": {"data": {"rows": AGGREGATED_ROWS}}}))
+    rows = self.dash._get_aggregated_ttable_data("beep", "meep", 5)
+
+    self.assertEqual(len(expected), 1)
+    self._assert_ttable_rows_equal(rows, expected)
+
+  def test_ttable_rows_from_summed_aggregates(self):
+    ROWS = [
+        {"type": "control", "n": 4, "total": 10.0, "total_sq": 30.0},
+        {"type": "exp", "n": 4, "total": 14.0, "total_sq": 54.0},
+    ]
+
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps({"query_result": {"data": {"rows": ROWS}}}))
+    rows = self.dash._get_aggregated_ttable_data("beep", "meep", 5)
+
+    self.assertEqual(len(rows), 1)
+    self.assertEqual(rows[0]["Control Mean"], 2.5)
+    self.assertEqual(rows[0]["Experiment Mean - Control Mean"], 1.0)
+
+  def test_aggregated_ttable_ignores_per_client_rows(self):
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps({"query_result": {"data": {
+            "rows": self._get_daily_rows(["2018-01-01"])}}}))
+
+    rows = self.dash._get_aggregated_ttable_data("beep", "meep", 5)
+
+    self.assertEqual(rows, [])
+
+  def test_ttable_rows_from_summaries_merge_control_variants(self):
+    control = [4, 6, 8, 4, 6, 8]
+    exp = [1, 2, 3, 1, 2, 3]
+
+    rows = self.dash.get_ttable_rows_from_summaries("beep", {
+        "control": (3, 6.0, 2.0),
+        "control-holdback": (3, 6.0, 2.0),
+        "exp": (len(exp), statistics.mean(exp), statistics.stdev(exp)),
+    })
+    expected = self.dash._ttest_results(
+        (len(control), statistics.mean(control), statistics.stdev(control)),
+        [(len(exp), statistics.mean(exp), statistics.stdev(exp))])[0]
+
+    self.assertEqual(len(rows), 1)
+    self.assertEqual(rows[0]["Metric"], "[control vs. exp] beep")
+    self.assertAlmostEqual(rows[0]["Control Mean"], expected["control_mean"])
+    self.assertAlmostEqual(
+        rows[0]["Two-Tailed P-value (ttest)"], expected["p_val"])
+    self.assertAlmostEqual(rows[0]["Power"], expected["power"])
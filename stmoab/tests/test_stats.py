@@ -0,0 +1,146 @@
+import mock
+import random
+import unittest
+
+import numpy as np
+
+from scipy import stats
+import statsmodels.stats.power as smp
+
+from stmoab.stats import (
+    RunningStats, summarize, summary_from_sums, summary_from_variance,
+    sums_from_summary, pooled_stddev, ttest_and_power, ttest_ind_power)
+import stmoab.stats
+
+
+class TestStats(unittest.TestCase):
+
+  ALPHA = 0.005
+
+  def _per_pair(self, control_vals, exp_vals):
+    control_n, control_mean, control_std = summarize(control_vals)
+    exp_n, exp_mean, exp_std = summarize(exp_vals)
+    pooled = pooled_stddev(control_n, control_std, exp_n, exp_std)
+    percent_diff = (control_mean - exp_mean) / control_mean
+
+    power = smp.TTestIndPower().solve_power(
+        abs(percent_diff) * control_mean / pooled,
+        nobs1=control_n,
+        ratio=exp_n / float(control_n),
+        alpha=self.ALPHA, alternative='two-sided')
+    p_val = stats.ttest_ind(control_vals, exp_vals, equal_var=False)[1]
+    return power, p_val, percent_diff * -100
+
+  def test_batch_matches_per_pair_results(self):
+    rand = random.Random(42)
+    control_vals = [rand.gauss(10, 3) for i in range(200)]
+    variants = [
+        [rand.gauss(10 + shift, 3) for i in range(size)]
+        for shift, size in [(0.1, 150), (1, 200), (-2, 90)]]
+
+    control_summary = summarize(control_vals)
+    exp_n, exp_mean, exp_std = zip(*[summarize(v) for v in variants])
+    batch = ttest_and_power(
+        control_summary[0], control_summary[1], control_summary[2],
+        exp_n, exp_mean, exp_std, self.ALPHA)
+
+    for i, exp_vals in enumerate(variants):
+      power, p_val, percent_diff = self._per_pair(control_vals, exp_vals)
+
+      self.assertAlmostEqual(batch["power"][i], power, places=10)
+      self.assertAlmostEqual(batch["p_val"][i], p_val, places=10)
+      self.assertAlmostEqual(batch["percent_diff"][i], percent_diff)
+
+  def test_undefined_results(self):
+    # Zero control mean: no power. No variance at all: no p-value.
+    batch = ttest_and_power(
+        [10, 10], [0, 5], [1, 0], [10, 10], [1, 5], [1, 0], self.ALPHA)
+
+    self.assertEqual(list(batch["power"]), [0, 0])
+    self.assertEqual(list(batch["percent_diff"]), [0, 0])
+    self.assertFalse(batch["p_val"][0] != batch["p_val"][0])
+    self.assertTrue(batch["p_val"][1] != batch["p_val"][1])
+
+  def test_running_stats_match_summary(self):
+    rand = random.Random(7)
+    values = [rand.gauss(1e6, 5) for i in range(1000)]
+
+    running_stats = RunningStats()
+    for value in values:
+      running_stats.push(value)
+
+    count, mean, stdev = summarize(values)
+    self.assertEqual(running_stats.count, count)
+    self.assertAlmostEqual(running_stats.mean, mean, places=6)
+    self.assertAlmostEqual(running_stats.stdev, stdev, places=6)
+
+  def test_running_stats_need_two_values_for_variance(self):
+    running_stats = RunningStats()
+    running_stats.push(3)
+
+    self.assertEqual(running_stats.mean, 3)
+    self.assertTrue(running_stats.variance != running_stats.variance)
+
+  def test_summary_from_sums_matches_summary(self):
+    values = [random.uniform(0, 50) for i in range(200)]
+    n, mean, std = summary_from_sums(
+        len(values), sum(values), sum(value * value for value in values))
+    expected = summarize(values)
+
+    self.assertEqual(n, expected[0])
+    self.assertAlmostEqual(mean, expected[1])
+    self.assertAlmostEqual(std, expected[2])
+
+  def test_summaries_convert_to_sums_and_back(self):
+    values = [random.uniform(0, 50) for i in range(100)]
+    summary = summarize(values)
+
+    n, mean, std = summary_from_sums(*sums_from_summary(*summary))
+
+    self.assertEqual(n, summary[0])
+    self.assertAlmostEqual(mean, summary[1])
+    self.assertAlmostEqual(std, summary[2])
+    self.assertAlmostEqual(
+        summary_from_variance(n, mean, std * std)[2], summary[2])
+
+  def test_power_matches_statsmodels(self):
+    rand = np.random.RandomState(7)
+    effect_size = rand.uniform(0, 2, 200)
+    nobs1 = rand.randint(2, 5000, 200).astype(float)
+    ratio = rand.uniform(0.1, 3, 200)
+
+    power = ttest_ind_power(effect_size, nobs1, self.ALPHA, ratio)
+    expected = smp.TTestIndPower().power(
+        effect_size, nobs1=nobs1, alpha=self.ALPHA, ratio=ratio,
+        alternative="two-sided")
+
+    np.testing.assert_allclose(power, expected, rtol=1e-9, atol=1e-12)
+
+  def test_power_is_memoized(self):
+    compute_power = stmoab.stats._noncentral_t_power
+    with mock.patch(
+            "stmoab.stats._noncentral_t_power",
+            side_effect=compute_power) as mock_power:
+      first = ttest_ind_power([0.25, 0.5], [123, 456], self.ALPHA, 1.5)
+      second = ttest_ind_power([0.5, 0.75], [456, 789], self.ALPHA, 1.5)
+
+    self.assertEqual(mock_power.call_count, 2)
+    self.assertEqual(list(mock_power.call_args_list[1][0][0]), [0.75])
+    self.assertEqual(first[1], second[0])
+
+  def test_power_cache_evicts_least_recently_used(self):
+    stmoab.stats._power_cache.clear()
+    self.addCleanup(stmoab.stats._power_cache.clear)
+
+    with mock.patch("stmoab.stats.MAX_CACHED_POWERS", 3):
+      ttest_ind_power([0.1, 0.2], [100, 100], self.ALPHA)
+      ttest_ind_power([0.1], [100], self.ALPHA)
+      ttest_ind_power([0.3, 0.4, 0.5, 0.6], [100] * 4, self.ALPHA)
+      self.assertEqual(len(stmoab.stats._power_cache), 3)
+
+      ttest_ind_power([0.4], [100], self.ALPHA)
+      ttest_ind_power([0.7], [100], self.ALPHA)
+
+    self.assertEqual(
+        [key[0] for key in stmoab.stats._power_cache],
+        [0.6, 0.4, 0.7])
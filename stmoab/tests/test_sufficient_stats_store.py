@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from stmoab.SufficientStatsStore import SufficientStatsStore
+
+
+class TestSufficientStatsStore(unittest.TestCase):
+
+  def setUp(self):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    self.path = os.path.join(temp_dir, "stats.sqlite")
+
+  def test_totals_sum_every_stored_day(self):
+    store = SufficientStatsStore(self.path)
+    store.save_days("exp", 7, "Click", {
+        ("2018-01-01", "control"): (2, 3.0, 5.0),
+        ("2018-01-02", "control"): (1, 4.0, 16.0),
+        ("2018-01-02", "exp"): (3, 6.0, 14.0),
+    })
+    store.save_days("other_exp", 7, "Click", {
+        ("2018-01-05", "control"): (1, 1.0, 1.0),
+    })
+
+    self.assertEqual(store.get_checkpoint("exp", 7, "Click"), "2018-01-02")
+    self.assertIsNone(store.get_checkpoint("exp", 7, "Search"))
+    self.assertEqual(
+        dict(SufficientStatsStore(self.path).get_totals("exp", 7, "Click")),
+        {"control": (3, 7.0, 21.0), "exp": (3, 6.0, 14.0)})
+
+  def test_saving_a_day_again_replaces_it(self):
+    store = SufficientStatsStore(self.path)
+    store.save_days("exp", 7, "Click", {("2018-01-01", "exp"): (1, 1.0, 1.0)})
+    store.save_days("exp", 7, "Click", {("2018-01-01", "exp"): (2, 2.0, 2.0)})
+
+    self.assertEqual(
+        dict(store.get_totals("exp", 7, "Click")), {"exp": (2, 2.0, 2.0)})
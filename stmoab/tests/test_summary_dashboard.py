@@ -33,6 +33,20 @@ class TestSummaryDashboard(AppTest):
         "Unable to fetch query results",
         lambda: self.dash._get_query_results("a", "b"))
 
+  def test_check_query_results_asks_once(self):
+    self.mock_requests_post.reset_mock()
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps({"job": {"id": 1}}))
+
+    self.assertEqual(self.dash._check_query_results("SELECT 1", 5), [])
+    self.assertEqual(self.mock_requests_post.call_count, 1)
+
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps(
+            {"query_result": {"data": {"rows": [{"a": 1}]}}}))
+    self.assertEqual(
+        self.dash._check_query_results("SELECT 1", 5), [{"a": 1}])
+
   def test_update_query_exception_thrown(self):
     self._setupMockRedashClientException("update_query")
 
@@ -111,7 +125,7 @@ class TestSummaryDashboard(AppTest):
 
     self.assertRaisesRegexp(
         self.dash.ExternalAPIError,
-        "Unable to update schedule for widget",
+        "Unable to update schedule for query 1",
         lambda: self.dash.update_refresh_schedule(1000))
 
   def test_update_refresh_schedule_success(self):
@@ -153,6 +167,55 @@ class TestSummaryDashboard(AppTest):
     self.assertEqual(self.mock_requests_get.call_count, 2)
     self.assertEqual(self.mock_requests_delete.call_count, 0)
 
+  def test_update_refresh_schedule_updates_each_query_once(self):
+    WIDGETS_RESPONSE = {
+        "widgets": [
+            {"visualization": {"query": {"id": 1}}},
+            {"visualization": {"query": {"id": 2}}},
+            {"visualization": {"query": {"id": 1}}},
+            {"visualization": {"query": {"id": 3}}},
+        ]
+    }
+    self.mock_requests_get.return_value = self.get_mock_response(
+        content=json.dumps(WIDGETS_RESPONSE))
+    self.mock_requests_post.return_value = self.get_mock_response()
+    self.mock_requests_post.reset_mock()
+
+    report = self.dash.update_refresh_schedule(86400, max_workers=3)
+
+    self.assertEqual(report, {"updated": [1, 2, 3], "failed": []})
+    self.assertEqual(self.mock_requests_post.call_count, 3)
+
+  def test_update_refresh_schedule_reports_failed_queries(self):
+    WIDGETS = [
+        {"visualization": {"query": {"id": 1}}},
+        {"visualization": {"query": {"id": 2}}},
+    ]
+
+    def update_query_schedule_mock(query_id, seconds_to_refresh):
+      if query_id == 1:
+        raise self.dash.redash.RedashClientException
+
+    self._setupMockRedashClientException(
+        "get_widget_from_dash", lambda name: WIDGETS)
+    self._setupMockRedashClientException(
+        "update_query_schedule", update_query_schedule_mock)
+
+    # The failed query doesn't stop the rest from being scheduled
+    report = self.dash.update_refresh_schedule(1000, raise_on_error=False)
+
+    self.assertEqual(report["updated"], [2])
+    self.assertEqual(len(report["failed"]), 1)
+    self.assertEqual(report["failed"][0]["query_id"], 1)
+
+    with self.assertRaises(self.dash.BulkOperationError) as context:
+      self.dash.update_refresh_schedule(1000)
+
+    self.assertEqual(context.exception.report["updated"], [2])
+    self.assertRegexpMatches(
+        str(context.exception),
+        "Unable to update the refresh schedule of 1 of 2 queries")
+
   def test_get_chart_data_success(self):
     EXPECTED_QUERY_NAME = "query_name123"
     EXPECTED_QUERY_NAME2 = "query_name456"
@@ -304,6 +367,43 @@ class TestSummaryDashboard(AppTest):
     self.assertEqual(self.mock_requests_get.call_count, 2)
     self.assertEqual(self.mock_requests_delete.call_count, 6)
 
+  def test_remove_graphs_continues_past_failures(self):
+    WIDGETS_RESPONSE = {
+        "widgets": [{
+            "id": widget_id,
+            "visualization": {
+                "query": {
+                    "id": widget_id,
+                    "name": name
+                }
+            }
+        } for widget_id, name in [(1, "A"), (2, "B"), (3, "C")]]
+    }
+
+    def remove_visualization_mock(widget_id):
+      if widget_id == 2:
+        raise self.dash.redash.RedashClientException
+
+    self.mock_requests_get.return_value = self.get_mock_response(
+        content=json.dumps(WIDGETS_RESPONSE))
+    self.mock_requests_delete.return_value = self.get_mock_response()
+    self._setupMockRedashClientException(
+        "remove_visualization", remove_visualization_mock)
+
+    report = self.dash.remove_graphs(
+        ["A", "B", "D"], max_workers=2, raise_on_error=False)
+
+    self.assertEqual(report["removed"], ["A"])
+    self.assertEqual(len(report["failed"]), 1)
+    self.assertEqual(report["failed"][0]["name"], "B")
+    self.assertEqual(
+        sorted(self.dash.get_query_ids_and_names()), ["B", "C"])
+
+    with self.assertRaises(self.dash.BulkOperationError) as context:
+      self.dash.remove_all_graphs(max_workers=2)
+
+    self.assertEqual(context.exception.report["removed"], ["C"])
+
   def test_add_query_to_dashboard_makes_expected_calls(self):
     QUERY_TITLE = "title"
     QUERY_STRING = "SELECT * FROM test"
@@ -334,3 +434,132 @@ class TestSummaryDashboard(AppTest):
     #     1) Create dashboard
     self.assertEqual(self.mock_requests_post.call_count, 5)
     self.assertEqual(self.mock_requests_get.call_count, 1)
+
+  def test_widget_index_is_loaded_once_and_refreshed(self):
+    WIDGETS_RESPONSE = {
+        "widgets": [{
+            "id": 4,
+            "visualization": {
+                "query": {
+                    "updated_at": "2018-02-27T18:45:01.995651+00:00",
+                    "name": "query_name",
+                    "id": 1
+                }
+            }
+        }]
+    }
+    self.mock_requests_get.return_value = self.get_mock_response(
+        content=json.dumps(WIDGETS_RESPONSE))
+
+    self.dash.get_query_ids_and_names()
+    self.dash.get_update_range()
+    self.dash.get_query_ids_and_names()
+
+    # 1 get for creating the dashboard, 1 for loading the index
+    self.assertEqual(self.mock_requests_get.call_count, 2)
+
+    self.dash.refresh()
+    self.assertEqual(self.mock_requests_get.call_count, 3)
+
+  def test_widget_index_is_updated_in_place(self):
+    WIDGETS_RESPONSE = {
+        "widgets": [{
+            "id": 4,
+            "visualization": {
+                "query": {
+                    "updated_at": "2018-02-27T18:45:01.995651+00:00",
+                    "name": "query_name",
+                    "id": 1
+                }
+            }
+        }]
+    }
+    self.mock_requests_get.return_value = self.get_mock_response(
+        content=json.dumps(WIDGETS_RESPONSE))
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps({"id": 2}))
+    self.mock_requests_delete.return_value = self.get_mock_response()
+
+    self.dash.get_query_ids_and_names()
+    self.dash.add_query_to_dashboard(
+        "new_query", "SELECT 1", 5, VizWidth.WIDE,
+        column_mapping={"a": "x"}, chart_type=ChartType.BAR)
+    self.dash.remove_graph_from_dashboard(4, 1)
+
+    data_dict = self.dash.get_query_ids_and_names()
+
+    self.assertEqual(list(data_dict.keys()), ["new_query"])
+    self.assertEqual(data_dict["new_query"]["query_id"], 2)
+    self.assertEqual(data_dict["new_query"]["query"], "SELECT 1")
+    self.assertEqual(len(self.dash.get_update_range()), 2)
+
+    # 1 get for creating the dashboard, 1 for loading the index and
+    # 1 for looking up the new query's visualization
+    self.assertEqual(self.mock_requests_get.call_count, 3)
+
+  def test_attach_to_public_dashboard_skips_publishing(self):
+    DASHBOARD_RESPONSE = {
+        "id": 7,
+        "slug": "existing-dashboard",
+        "name": "Existing Dashboard",
+        "is_draft": False,
+        "public_url": "https://public/url",
+        "widgets": [{
+            "id": 4,
+            "visualization": {
+                "query": {
+                    "name": "query_name",
+                    "id": 1
+                }
+            }
+        }]
+    }
+    self.mock_requests_get.reset_mock()
+    self.mock_requests_post.reset_mock()
+    self.mock_requests_get.return_value = self.get_mock_response(
+        content=json.dumps(DASHBOARD_RESPONSE))
+
+    dash = SummaryDashboard(
+        self.API_KEY, None, dash_slug="existing-dashboard")
+    data_dict = dash.get_query_ids_and_names()
+
+    self.assertEqual(dash._dash_id, 7)
+    self.assertEqual(dash._dash_name, "Existing Dashboard")
+    self.assertEqual(dash.public_url, "https://public/url")
+    self.assertEqual(list(data_dict.keys()), ["query_name"])
+
+    # The dashboard lookup also loads the widget index
+    self.assertEqual(self.mock_requests_get.call_count, 1)
+    self.assertEqual(self.mock_requests_post.call_count, 0)
+
+  def test_attach_to_draft_dashboard_by_id_publishes_it(self):
+    self.mock_requests_get.reset_mock()
+    self.mock_requests_post.reset_mock()
+    self.mock_requests_get.return_value = self.get_mock_response(
+        content=json.dumps({"id": 7, "slug": "draft", "is_draft": True}))
+
+    SummaryDashboard(self.API_KEY, "Draft", dash_id=7)
+
+    # 1 post to publish the dashboard and 1 post to share it
+    self.assertEqual(self.mock_requests_get.call_count, 1)
+    self.assertEqual(self.mock_requests_post.call_count, 2)
+
+  def test_lazy_public_url_is_fetched_on_first_read(self):
+    self.mock_requests_post.reset_mock()
+    self.mock_requests_post.return_value = self.get_mock_response(
+        content=json.dumps({"public_url": "https://public/url"}))
+
+    dash = SummaryDashboard(self.API_KEY, "Lazy", lazy_public_url=True)
+    self.assertEqual(self.mock_requests_post.call_count, 1)
+
+    self.assertEqual(dash.public_url, "https://public/url")
+    self.assertEqual(dash.public_url, "https://public/url")
+    self.assertEqual(self.mock_requests_post.call_count, 2)
+
+  def test_attach_to_missing_dashboard_exception_thrown(self):
+    self.mock_requests_get.return_value = self.get_mock_response(status=404)
+
+    self.assertRaisesRegexp(
+        self.dash.ExternalAPIError,
+        "Unable to create new dashboard",
+        lambda: SummaryDashboard(self.API_KEY, None, dash_slug="missing"))
@@ -0,0 +1,104 @@
+import os
+import json
+import shutil
+import tempfile
+
+from stmoab.tests.base import AppTest
+from stmoab.TemplateRegistry import TemplateRegistry
+
+
+class TestTemplateRegistry(AppTest):
+
+  def setUp(self):
+    super(TestTemplateRegistry, self).setUp()
+
+    self.queries = [{
+        "id": 5,
+        "description": "SomeQuery",
+        "name": "AS Template: Query Title Event",
+        "query": "SELECT * FROM table",
+        "data_source_id": 5,
+        "updated_at": "2018-01-01T00:00:00"
+    }, {
+        "id": 6,
+        "description": "SomeQuery2",
+        "name": "TTests Template: Query Title",
+        "query": "SELECT * FROM table",
+        "data_source_id": 5,
+        "updated_at": "2018-01-01T00:00:00"
+    }]
+
+    def get_server(url):
+      if "/queries?" in url:
+        content = {"count": len(self.queries), "results": self.queries}
+      else:
+        content = {"visualizations": [{"type": "CHART", "options": {}}]}
+      return self.get_mock_response(content=json.dumps(content))
+
+    self.mock_requests_get.reset_mock()
+    self.mock_requests_get.side_effect = get_server
+
+  def test_keyword_lookups_are_local(self):
+    registry = TemplateRegistry()
+
+    as_templates = registry.search(self.dash.redash, "AS Template:")
+    ttest_templates = registry.search(self.dash.redash, "ttests template")
+
+    # One listing and one visualization per template, fetched once
+    self.assertEqual(self.mock_requests_get.call_count, 3)
+    self.assertEqual([template["id"] for template in as_templates], [5])
+    self.assertEqual([template["id"] for template in ttest_templates], [6])
+    self.assertEqual(as_templates[0]["type"], "CHART")
+    self.assertEqual(as_templates[0]["query"], "SELECT * FROM table")
+
+  def test_only_changed_templates_are_fetched_again(self):
+    registry = TemplateRegistry(ttl=-1)
+    registry.search(self.dash.redash, "Template")
+    self.mock_requests_get.reset_mock()
+
+    self.queries[1]["updated_at"] = "2018-02-01T00:00:00"
+    self.queries[1]["query"] = "SELECT 1"
+    templates = registry.search(self.dash.redash, "Template")
+
+    # The listing and the changed template's visualization
+    self.assertEqual(self.mock_requests_get.call_count, 2)
+    self.assertEqual(templates[1]["query"], "SELECT 1")
+
+  def test_registry_persists_to_disk(self):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    path = os.path.join(temp_dir, "templates.json")
+
+    TemplateRegistry(path=path).search(self.dash.redash, "Template")
+    self.mock_requests_get.reset_mock()
+
+    templates = TemplateRegistry(path=path).search(
+        self.dash.redash, "Template")
+
+    self.assertEqual(len(templates), 2)
+    self.assertEqual(self.mock_requests_get.call_count, 0)
+
+  def test_other_keywords_are_searched_on_the_server(self):
+    registry = TemplateRegistry()
+
+    templates = registry.search(self.dash.redash, "SomeQuery2")
+
+    # A server side search and the visualization of its result, without
+    # listing the templates.
+    urls = [call[0][0] for call in self.mock_requests_get.call_args_list]
+    self.assertEqual(len(urls), 3)
+    self.assertTrue("q=SomeQuery2" in urls[0])
+    self.assertTrue(registry.is_stale())
+    self.assertEqual(len(templates), 2)
+
+  def test_keywords_without_cached_matches_are_searched_on_the_server(self):
+    registry = TemplateRegistry()
+
+    registry.search(self.dash.redash, "Template: Missing")
+
+    # The listing and its visualizations, then the search and its
+    # results' visualizations.
+    urls = [call[0][0] for call in self.mock_requests_get.call_args_list]
+    self.assertEqual(len(urls), 6)
+    self.assertTrue("q=Template&" in urls[0])
+    self.assertTrue("q=Template: Missing" in urls[3])
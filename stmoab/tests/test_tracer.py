@@ -0,0 +1,151 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+from stmoab import loadtest
+from stmoab.FakeRedashServer import FakeRedashServer
+from stmoab.StatisticalDashboard import StatisticalDashboard
+from stmoab.Tracer import Tracer, JSONLinesExporter
+
+
+class ListExporter(object):
+
+  def __init__(self):
+    self.spans = []
+
+  def export(self, span):
+    self.spans.append(span)
+
+
+class TestTracer(unittest.TestCase):
+
+  def setUp(self):
+    self.exporter = ListExporter()
+    self.tracer = Tracer(self.exporter)
+
+  def _get_span(self, name):
+    return [span for span in self.exporter.spans if span["name"] == name][0]
+
+  def test_spans_nest_on_a_thread(self):
+    with self.tracer.span("run", keyword="a") as run_span:
+      with self.tracer.span("query") as query_span:
+        query_span.set_attribute("rows", 3)
+
+    self.assertEqual(
+        [span["name"] for span in self.exporter.spans], ["query", "run"])
+    self.assertEqual(self._get_span("query")["parent_id"], run_span.span_id)
+    self.assertEqual(self._get_span("query")["trace_id"], run_span.trace_id)
+    self.assertEqual(self._get_span("query")["attributes"], {"rows": 3})
+    self.assertEqual(self._get_span("run")["attributes"], {"keyword": "a"})
+    self.assertTrue(self._get_span("run")["duration_seconds"] >= 0)
+    self.assertIsNone(self.tracer.current_span())
+
+  def test_parent_is_passed_to_other_threads(self):
+    with self.tracer.span("run") as run_span:
+      def work():
+        with self.tracer.span("stage", run_span):
+          with self.tracer.span("query"):
+            pass
+
+      thread = threading.Thread(target=work)
+      thread.start()
+      thread.join()
+
+    self.assertEqual(self._get_span("stage")["parent_id"], run_span.span_id)
+    self.assertEqual(
+        self._get_span("query")["parent_id"],
+        self._get_span("stage")["span_id"])
+
+  def test_errors_are_recorded(self):
+    with self.assertRaises(ValueError):
+      with self.tracer.span("run"):
+        raise ValueError("boom")
+
+    self.assertEqual(self._get_span("run")["status"], "error")
+    self.assertEqual(self._get_span("run")["error"], "ValueError: boom")
+
+  def test_json_lines_exporter(self):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    path = os.path.join(temp_dir, "trace.jsonl")
+    tracer = Tracer(JSONLinesExporter(path))
+
+    with tracer.span("run"):
+      with tracer.span("query"):
+        pass
+
+    with open(path) as trace_file:
+      spans = [json.loads(line) for line in trace_file]
+    self.assertEqual([span["name"] for span in spans], ["query", "run"])
+
+  def test_dashboard_pipeline_spans(self):
+    server = FakeRedashServer()
+    server.start()
+    server.install()
+    self.addCleanup(server.stop)
+    loadtest.add_templates(server)
+
+    dash = StatisticalDashboard(
+        "api_key", "access", "secret", "us-west-2", "bucket",
+        "Load Test", "Traced", "exp", start_date="2018-01-01",
+        lazy_public_url=True, tracer=self.tracer)
+    dash.add_graph_templates(
+        loadtest.GRAPH_TEMPLATE, ["CLICK", "SEARCH"], max_workers=2)
+
+    spans = dict((span["span_id"], span) for span in self.exporter.spans)
+
+    def get_ancestors(span):
+      names = []
+      while span["parent_id"] is not None:
+        span = spans[span["parent_id"]]
+        names.append(span["name"])
+      return names
+
+    queries = [span for span in spans.values() if span["name"] == "query"]
+    events = [span for span in spans.values() if span["name"] == "event"]
+    widgets = [span for span in spans.values() if span["name"] == "widget"]
+
+    self.assertEqual(
+        sorted(span["attributes"]["event"] for span in events),
+        ["CLICK", "SEARCH"])
+    self.assertEqual(len(queries), 2)
+    self.assertEqual(
+        get_ancestors(queries[0]), ["stage", "event", "template", "run"])
+    self.assertEqual(queries[0]["attributes"]["rows"], 140)
+    self.assertEqual(len(widgets), 2)
+    self.assertEqual(
+        get_ancestors(widgets[0]), ["commit", "event", "template", "run"])
+    self.assertEqual(
+        len(set(span["trace_id"] for span in spans.values())), 1)
+
+  def test_unit_spans_only_time_their_unit(self):
+    server = FakeRedashServer(latency={"*": 0.005})
+    server.start()
+    server.install()
+    self.addCleanup(server.stop)
+    loadtest.add_templates(server)
+
+    dash = StatisticalDashboard(
+        "api_key", "access", "secret", "us-west-2", "bucket",
+        "Load Test", "Traced", "exp", start_date="2018-01-01",
+        lazy_public_url=True, tracer=self.tracer)
+    dash.add_graph_templates(loadtest.POPULATION_TEMPLATE)
+    dash.add_graph_templates(
+        loadtest.GRAPH_TEMPLATE, ["CLICK", "SEARCH", "BLOCK"])
+
+    events = [span for span in self.exporter.spans if span["name"] == "event"]
+    templates = [
+        span for span in self.exporter.spans if span["name"] == "template"]
+    self.assertEqual(
+        [span["attributes"]["event"] for span in events],
+        ["CLICK", "SEARCH", "BLOCK"])
+
+    # Run one at a time, each event starts after the one before it ends.
+    for previous, event in zip(events, events[1:]):
+      self.assertTrue(event["start"] >= previous["end"])
+    self.assertTrue(templates[1]["start"] >= templates[0]["end"])
+    self.assertTrue(templates[1]["start"] <= events[0]["start"])
+    self.assertTrue(templates[1]["end"] >= events[-1]["end"])
@@ -1,14 +1,20 @@
+import io
+import os
+import gzip
 import mock
 import json
 import tempfile
 import calendar
 from datetime import datetime, timedelta
 
+import stmoab.utils
 from stmoab.tests.base import AppTest
+from stmoab.Metrics import Metrics
 from stmoab.constants import TTableSchema
 from stmoab.utils import (
     upload_as_json, read_experiment_definition, create_boto_transfer,
-    read_experiment_definition_s3, format_date, is_old_date)
+    read_experiment_definition_s3, format_date, is_old_date,
+    imap_concurrently, get_s3_client, BotoTransfer)
 
 
 class TestUtils(AppTest):
@@ -25,20 +31,90 @@ class TestUtils(AppTest):
     EXPECTED_S3_KEY = "activity-stream/" + DIRECTORY_NAME + "/" + FILENAME
     EXPECTED_BASE_URL = "https://analysis-output.telemetry.mozilla.org/"
 
-    mock_boto_transfer_patcher = mock.patch("stmoab.utils.S3Transfer")
-    mock_boto_transfer_patcher.start()
+    mock_boto_client_patcher = mock.patch("boto3.client")
+    mock_boto_client = mock_boto_client_patcher.start()
 
     transfer = create_boto_transfer(ACCESS_KEY, SECRET_KEY, REGION)
     query_string = upload_as_json(DIRECTORY_NAME, FILENAME, transfer, BUCKET_ID, DATA)
 
     self.assertEqual(query_string, EXPECTED_BASE_URL + EXPECTED_S3_KEY)
+    upload_fileobj = mock_boto_client.return_value.upload_fileobj
+    self.assertEqual(upload_fileobj.call_count, 1)
+    self.assertEqual(
+        upload_fileobj.call_args[1]["Config"], transfer.config)
 
-    mock_boto_transfer_patcher.stop()
+    mock_boto_client_patcher.stop()
+
+  def _upload_and_capture(self, data, **kwargs):
+    transfer = BotoTransfer(mock.Mock(), None)
+    uploads = []
+
+    def upload_fileobj(fileobj, bucket, key, ExtraArgs=None, Config=None):
+      uploads.append((fileobj.read(), bucket, key, ExtraArgs))
+
+    transfer.client.upload_fileobj.side_effect = upload_fileobj
+    upload_as_json("experiments", "file", transfer, "bucket", data, **kwargs)
+
+    self.assertEqual(len(uploads), 1)
+    return uploads[0]
+
+  def test_upload_as_json_with_an_s3_transfer(self):
+    DATA = {"columns": TTableSchema, "rows": [{"Metric": "a"}]}
+    transfer = mock.Mock(spec=["upload_file"])
+    uploads = []
+
+    def upload_file(filename, bucket, key, extra_args=None):
+      with open(filename, "rb") as upload_file:
+        uploads.append((upload_file.read(), bucket, key, extra_args))
+      self.filename = filename
+
+    transfer.upload_file.side_effect = upload_file
+    url = upload_as_json("experiments", "file", transfer, "bucket", DATA)
+
+    body, bucket, key, extra_args = uploads[0]
+    self.assertEqual(json.loads(body.decode("utf-8")), DATA)
+    self.assertEqual(key, "activity-stream/experiments/file")
+    self.assertEqual(extra_args, {"ContentType": "application/json"})
+    self.assertTrue(url.endswith(key))
+    self.assertFalse(os.path.exists(self.filename))
+
+  def test_upload_as_json_streams_file_object(self):
+    DATA = {"columns": TTableSchema, "rows": [{"Metric": "a"}]}
+
+    body, bucket, key, extra_args = self._upload_and_capture(DATA)
+
+    self.assertEqual(json.loads(body.decode("utf-8")), DATA)
+    self.assertEqual(bucket, "bucket")
+    self.assertEqual(key, "activity-stream/experiments/file")
+    self.assertEqual(extra_args, {"ContentType": "application/json"})
+
+  def test_upload_as_json_compressed(self):
+    DATA = {"columns": TTableSchema, "rows": [{"Metric": "a"}]}
+
+    body, bucket, key, extra_args = self._upload_and_capture(
+        DATA, compress=True)
+
+    self.assertEqual(extra_args["ContentEncoding"], "gzip")
+    self.assertEqual(
+        json.loads(gzip.GzipFile(fileobj=io.BytesIO(body)).read().decode(
+            "utf-8")),
+        DATA)
+
+  def test_upload_as_json_records_metrics(self):
+    DATA = {"columns": TTableSchema, "rows": [{"Metric": "a"}]}
+    metrics = Metrics()
+
+    body, bucket, key, extra_args = self._upload_and_capture(
+        DATA, metrics=metrics)
+
+    upload = metrics.get_summary()["operations"]["s3_upload"]
+    self.assertEqual(upload["count"], 1)
+    self.assertEqual(upload["bytes_sent"], len(body))
 
   def test_download_experiment_definition_json_non_json_return_val(self):
-    mock_boto_transfer_patcher = mock.patch("stmoab.utils.s3.get_object")
-    mock_transfer = mock_boto_transfer_patcher.start()
-    mock_transfer.return_value = "fail"
+    mock_boto_transfer_patcher = mock.patch("stmoab.utils.get_s3_client")
+    mock_client = mock_boto_transfer_patcher.start()
+    mock_client.return_value.get_object.return_value = "fail"
 
     json_result = read_experiment_definition_s3("beep")
 
@@ -81,7 +157,7 @@ class TestUtils(AppTest):
   def test_download_experiment_definition_s3_json_return_val(self):
     EXPECTED_JSON = json.dumps({"experiment1": "some_value"})
 
-    mock_boto_download_patcher = mock.patch("stmoab.utils.s3.get_object")
+    mock_boto_download_patcher = mock.patch("stmoab.utils.get_s3_client")
     mock_download = mock_boto_download_patcher.start()
 
     # Make a temp file for returning
@@ -90,7 +166,8 @@ class TestUtils(AppTest):
     file_handle.write(EXPECTED_JSON)
     file_handle.seek(0)
 
-    mock_download.return_value = {"Body": file_handle}
+    mock_download.return_value.get_object.return_value = {
+        "Body": file_handle}
 
     json_result = read_experiment_definition_s3("boop")
 
@@ -117,3 +194,26 @@ class TestUtils(AppTest):
 
     is_old = is_old_date(MS_DATE_NEW)
     self.assertEqual(is_old, False)
+
+  def test_imap_concurrently_keeps_order_and_errors(self):
+    def invert(value):
+      return 1.0 / value
+
+    for max_workers in [None, 3]:
+      results = list(imap_concurrently(invert, [1, 0, 4], max_workers))
+
+      self.assertEqual(len(results), 3)
+      self.assertEqual(results[0], (1.0, None))
+      self.assertIsNone(results[1][0])
+      self.assertTrue(isinstance(results[1][1], ZeroDivisionError))
+      self.assertEqual(results[2], (0.25, None))
+
+  def test_s3_client_is_created_once_on_first_use(self):
+    client_patcher = mock.patch("boto3.client")
+    mock_client = client_patcher.start()
+    self.addCleanup(client_patcher.stop)
+    self.addCleanup(setattr, stmoab.utils, "_s3_client", None)
+    stmoab.utils._s3_client = None
+
+    self.assertIs(get_s3_client(), get_s3_client())
+    self.assertEqual(mock_client.call_count, 1)
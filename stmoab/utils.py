@@ -1,37 +1,114 @@
+import os
+import gzip
 import json
-import boto3
+import time
+import shutil
 import urllib
-from boto3.s3.transfer import S3Transfer
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from datetime import datetime, timedelta
 
-s3 = boto3.client("s3")
+# boto3 is imported and its clients are built on first use, since loading
+# botocore's service data dominates the cost of importing stmoab.
+_s3_client = None
+_s3_client_lock = threading.Lock()
 
 
-def create_boto_transfer(access_key, secret_key, region):
+# Uploads are encoded in memory and only spill over to a temporary file
+# past this many bytes.
+UPLOAD_SPOOL_SIZE = 8 * 1024 * 1024
+
+# An S3 client and the transfer settings its uploads use. upload_as_json
+# also takes a boto3 S3Transfer.
+BotoTransfer = namedtuple("BotoTransfer", ["client", "config"])
+
+
+def get_s3_client():
+  global _s3_client
+
+  if _s3_client is None:
+    with _s3_client_lock:
+      if _s3_client is None:
+        import boto3
+        _s3_client = boto3.client("s3")
+
+  return _s3_client
+
+
+def create_boto_transfer(access_key, secret_key, region,
+                         max_concurrency=10,
+                         multipart_threshold=8 * 1024 * 1024):
+  import boto3
+  from boto3.s3.transfer import TransferConfig
+
   client = boto3.client(
       "s3",
       region_name=region,
       aws_access_key_id=access_key,
       aws_secret_access_key=secret_key)
-  transfer = S3Transfer(client)
-  return transfer
+  config = TransferConfig(
+      max_concurrency=max_concurrency,
+      multipart_threshold=multipart_threshold)
+  return BotoTransfer(client, config)
+
+
+def write_json(data, fileobj):
+  for chunk in json.JSONEncoder().iterencode(data):
+    fileobj.write(chunk.encode("utf-8"))
 
 
-def upload_as_json(directory_name, filename, transfer, bucket_id, data):
+def _upload_named_file(transfer, upload_buffer, bucket_id, s3_key,
+                       extra_args):
+  # S3Transfer only uploads files by name.
+  with tempfile.NamedTemporaryFile(delete=False) as named_file:
+    shutil.copyfileobj(upload_buffer, named_file)
+
+  try:
+    transfer.upload_file(
+        named_file.name, bucket_id, s3_key, extra_args=extra_args)
+  finally:
+    os.remove(named_file.name)
+
+
+def upload_as_json(directory_name, filename, transfer, bucket_id, data,
+                   compress=False, metrics=None):
   path = "activity-stream/" + directory_name + "/"
   s3_key = path + filename
+  extra_args = {"ContentType": "application/json"}
 
-  json_data = json.dumps(data)
-  file_path = "/tmp/{filename}".format(filename=filename)
-  with open(file_path, 'w') as f:
-    f.write(json_data)
-
-  transfer.upload_file(
-      file_path,
-      bucket_id,
-      s3_key,
-      extra_args={"ContentType": "application/json"})
+  started_at = time.time()
+  upload_buffer = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+  try:
+    if compress:
+      extra_args["ContentEncoding"] = "gzip"
+      with gzip.GzipFile(fileobj=upload_buffer, mode="wb") as gzip_file:
+        write_json(data, gzip_file)
+    else:
+      write_json(data, upload_buffer)
+
+    upload_size = upload_buffer.tell()
+    upload_buffer.seek(0)
+
+    if isinstance(transfer, BotoTransfer):
+      transfer.client.upload_fileobj(
+          upload_buffer, bucket_id, s3_key,
+          ExtraArgs=extra_args, Config=transfer.config)
+    else:
+      _upload_named_file(
+          transfer, upload_buffer, bucket_id, s3_key, extra_args)
+  except Exception:
+    if metrics is not None:
+      metrics.record("s3_upload", time.time() - started_at, error=True)
+    raise
+  finally:
+    upload_buffer.close()
+
+  if metrics is not None:
+    metrics.record(
+        "s3_upload", time.time() - started_at, bytes_sent=upload_size)
 
   return "https://analysis-output.telemetry.mozilla.org/" + s3_key
 
@@ -50,7 +127,8 @@ def read_experiment_definition_s3(filename):
   path = "activity-stream/" + DIRECTORY_NAME + "/"
   s3_key = path + filename
 
-  obj = s3.get_object(Bucket="telemetry-public-analysis-2", Key=s3_key)
+  obj = get_s3_client().get_object(
+      Bucket="telemetry-public-analysis-2", Key=s3_key)
 
   try:
     experiments_string = obj["Body"].read()
@@ -59,6 +137,33 @@ def read_experiment_definition_s3(filename):
     return {}
 
 
+def imap_concurrently(function, items, max_workers=None):
+  # Yields a (result, error) pair for every item, in the order of `items`.
+  # Without `max_workers` the items are processed lazily one at a time,
+  # otherwise they are processed by a bounded pool of threads.
+  if not max_workers:
+    for item in items:
+      try:
+        yield function(item), None
+      except Exception as e:
+        yield None, e
+    return
+
+  def call(item):
+    try:
+      return function(item), None
+    except Exception as e:
+      return None, e
+
+  executor = ThreadPoolExecutor(max_workers=max_workers)
+  try:
+    futures = [executor.submit(call, item) for item in items]
+    for future in futures:
+      yield future.result()
+  finally:
+    executor.shutdown(wait=True)
+
+
 def format_date(date):
   date_epoch = datetime.fromtimestamp(date / 1000.0)
   date = date_epoch.strftime("%m/%d/%y")